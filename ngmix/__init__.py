@@ -17,6 +17,7 @@ from .gmix_ndim import GMixND
 from . import jacobian
 from .jacobian import Jacobian, UnitJacobian, DiagonalJacobian
 from . import fastexp
+from . import parallel
 
 from . import priors
 from .priors import srandu
@@ -37,6 +38,7 @@ from . import simplex
 from . import galsimfit
 
 from . import bootstrap
+from . import psfcache
 from .bootstrap import Bootstrapper, CompositeBootstrapper
 
 from . import em
@@ -55,9 +57,12 @@ from . import guessers
 from . import roundify
 
 from . import metacal
+from . import metacal_fft
 
 from . import simobs
 
 from . import test
 
 from . import gaussap
+
+from . import batchfit
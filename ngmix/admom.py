@@ -19,6 +19,119 @@ def run_admom(obs, guess, **kw):
 
     return am
 
+def run_admom_batch(pixels, offsets, guesses, ntry=1, scale=1.0,
+                    maxiter=200, shiftmax=5.0, etol=1.0e-5, Ttol=0.001,
+                    rng=None):
+    """
+    run adaptive moments for many objects in a single compiled call,
+    processing the objects in parallel
+
+    parameters
+    ----------
+    pixels: array
+        Array of pixel structures for all objects, e.g. from
+        batchfit.pack_pixels
+    offsets: array
+        Array of size nobj+1, the pixels for object i are
+        pixels[offsets[i]:offsets[i+1]]
+    guesses: number, array or list of GMix
+        A single T for all objects, in which case the guesses are round
+        and at the jacobian center, an [nobj, 6] array of gauss model
+        parameters, or a list of single gaussian GMix
+    ntry: int, optional
+        Number of tries.  Tries after the first start from a perturbed
+        guess, with T perturbed by up to 10 percent, ellipticity drawn
+        in [-0.3, 0.3] and the center shifted by up to half of scale
+    scale: float or array, optional
+        Pixel scale, a scalar or one per object, default 1
+    maxiter, shiftmax, etol, Ttol:
+        See Admom
+    rng: numpy.random.RandomState, optional
+        Used to draw the guess perturbations
+
+    returns
+    -------
+    result: array
+        Result array with the fields of the Admom result structure, plus
+        ntry.  Use get_result(result[i:i+1]) to get the result dict for
+        object i
+    """
+    from .admom_nb import admom_batch
+    from .gmix import make_gmix_model_batch, _gauss2d_dtype
+
+    offsets = numpy.array(offsets, dtype='i8', ndmin=1)
+    nobj = offsets.size-1
+
+    if ntry < 1:
+        raise ValueError("ntry must be at least 1, got %d" % ntry)
+
+    if numpy.isscalar(guesses):
+        pars = numpy.zeros( (nobj, 6) )
+        pars[:, 4] = guesses
+        pars[:, 5] = 1.0
+        guess_data = make_gmix_model_batch(pars, 'gauss')
+    elif isinstance(guesses, numpy.ndarray):
+        guess_data = make_gmix_model_batch(guesses, 'gauss')
+    else:
+        for gm in guesses:
+            if len(gm) != 1:
+                raise ValueError("guesses must have a single gaussian, "
+                                 "got %d" % len(gm))
+        guess_data = numpy.vstack([gm.get_data() for gm in guesses])
+
+    if guess_data.shape[0] != nobj:
+        raise ValueError("expected %d guesses, "
+                         "got %d" % (nobj, guess_data.shape[0]))
+
+    if rng is None:
+        rng = numpy.random.RandomState()
+
+    perturb = rng.uniform(low=-1.0, high=1.0, size=(nobj, ntry, 5))
+    shifts = 0.5*(numpy.zeros(nobj) + scale)
+
+    conf = _make_admom_conf(maxiter, shiftmax, etol, Ttol)
+    wts = numpy.zeros( (nobj, 1), dtype=_gauss2d_dtype)
+    result = numpy.zeros(nobj, dtype=_admom_batch_result_dtype)
+
+    admom_batch(
+        conf,
+        guess_data,
+        wts,
+        pixels,
+        offsets,
+        perturb,
+        shifts,
+        result,
+    )
+
+    return result
+
+def run_admom_obs_batch(obs_list, guesses, **kw):
+    """
+    run adaptive moments for a list of observations in a single compiled
+    call, see run_admom_batch.  The pixel scale for the perturbed guesses
+    is taken from the jacobian of each observation
+
+    parameters
+    ----------
+    obs_list: sequence of Observation
+        The observations
+    guesses: number, array or list of GMix
+        See run_admom_batch
+    **kw:
+        Other keywords for run_admom_batch
+    """
+    from .batchfit import pack_pixels
+
+    pixels, offsets = pack_pixels(obs_list)
+
+    if 'scale' not in kw:
+        kw['scale'] = numpy.array(
+            [obs.jacobian.get_scale() for obs in obs_list]
+        )
+
+    return run_admom_batch(pixels, offsets, guesses, **kw)
+
 class Admom(object):
     """
     Measure adaptive moments for the input observation
@@ -76,17 +189,17 @@ class Admom(object):
             the rest of the parameters are random numbers
             about the jacobian center and zero ellipticity
         """
-        from .admom_nb import admom
+        from .admom_nb import admom_soa
 
         guess_gmix=self._get_guess(guess)
 
         ares=self._get_am_result()
 
         wt_gmix = guess_gmix._data
-        admom(
+        admom_soa(
             self.conf,
             wt_gmix,
-            self._obs.pixels,
+            self._obs.pixels_soa,
             ares,
         )
 
@@ -129,15 +242,7 @@ class Admom(object):
         return guess_gmix
 
     def _set_conf(self, maxiter, shiftmax, etol, Ttol):
-        dt=numpy.dtype(_admom_conf_dtype, align=True)
-        conf=numpy.zeros(1, dtype=dt)
-
-        conf['maxit']=maxiter
-        conf['shiftmax']=shiftmax
-        conf['etol']=etol
-        conf['Ttol']=Ttol
-
-        self.conf=conf
+        self.conf=_make_admom_conf(maxiter, shiftmax, etol, Ttol)
 
     def _get_am_result(self):
         dt=numpy.dtype(_admom_result_dtype, align=True)
@@ -163,6 +268,17 @@ class Admom(object):
 
         return GMixModel(pars, "gauss")
 
+def _make_admom_conf(maxiter, shiftmax, etol, Ttol):
+    dt=numpy.dtype(_admom_conf_dtype, align=True)
+    conf=numpy.zeros(1, dtype=dt)
+
+    conf['maxit']=maxiter
+    conf['shiftmax']=shiftmax
+    conf['etol']=etol
+    conf['Ttol']=Ttol
+
+    return conf
+
 def get_ratio_error(a, b, var_a, var_b, cov_ab):
     """
     get a/b and error on a/b
@@ -326,6 +442,11 @@ _admom_result_dtype=[
     ('F','f8',6),
 ]
 
+_admom_batch_result_dtype=numpy.dtype(
+    _admom_result_dtype + [('ntry','i4')],
+    align=True,
+)
+
 _admom_flagmap={
     0:'ok',
     0x1:'edge hit', # not currently used
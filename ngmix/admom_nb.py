@@ -3,9 +3,17 @@ try:
 except NameError:
     xrange=range
 
-from numba import njit
-
+from numba import njit, prange
+
+from .fastexp_nb import exp3
+from .pixels import (
+    PIXELS_SOA_V,
+    PIXELS_SOA_U,
+    PIXELS_SOA_VAL,
+    PIXELS_SOA_IERR,
+)
 from .gmix_nb import (
+    gauss2d_set,
     gmix_set_norms,
     gmix_eval_pixel_fast,
     GMIX_LOW_DETVAL,
@@ -28,6 +36,145 @@ def admom(confarray, wt, pixels, resarray):
     conf: admom config struct
         See admom._admom_conf_dtype
     """
+    admom_run(
+        confarray, wt, pixels, resarray,
+        admom_censums, admom_momsums,
+    )
+
+@njit
+def admom_soa(confarray, wt, pixels, resarray):
+    """
+    run the adaptive moments algorithm, with pixels in the
+    structure-of-arrays layout
+
+    parameters
+    ----------
+    conf: admom config struct
+        See admom._admom_conf_dtype
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    """
+    admom_run(
+        confarray, wt, pixels, resarray,
+        admom_censums_soa, admom_momsums_soa,
+    )
+
+@njit(parallel=True)
+def admom_batch(confarray, guesses, wts, pixels, offsets, perturb, shifts,
+                resarray):
+    """
+    run the adaptive moments algorithm for many objects, processing the
+    objects in parallel
+
+    If the first try fails, the algorithm is run again from perturbed
+    guesses, up to the number of tries
+
+    parameters
+    ----------
+    conf: admom config struct
+        See admom._admom_conf_dtype
+    guesses: gaussian mixtures
+        [nobj, 1] array holding the guess for each object
+    wts: gaussian mixtures
+        [nobj, 1] array to hold the final weight for each object
+    pixels: pixel array
+        Array of pixel structures for all objects
+    offsets: array
+        Array of size nobj+1, the pixels for object i are
+        pixels[offsets[i]:offsets[i+1]]
+    perturb: array
+        [nobj, ntry, 5] array of uniform random numbers in [-1, 1] for
+        perturbing the guesses, see admom_set_guess
+    shifts: array
+        [nobj] array with the largest shift of the center for the
+        perturbed guesses
+    resarray: admom result array
+        [nobj] result array, see admom._admom_batch_result_dtype
+    """
+
+    nobj = offsets.size-1
+    ntry = perturb.shape[1]
+
+    for iobj in prange(nobj):
+        beg = offsets[iobj]
+        end = offsets[iobj+1]
+
+        res = resarray[iobj:iobj+1]
+        wt = wts[iobj]
+
+        for itry in xrange(ntry):
+            admom_set_guess(
+                guesses[iobj], wt, perturb[iobj, itry], shifts[iobj], itry,
+            )
+
+            res['flags'][0] = 0
+            res['numiter'][0] = 0
+
+            admom_run(
+                confarray, wt, pixels[beg:end], res,
+                admom_censums, admom_momsums,
+            )
+
+            res['ntry'][0] = itry+1
+            if res['flags'][0] == 0:
+                break
+
+@njit
+def admom_set_guess(guess, wt, rand, shift, itry):
+    """
+    set the weight from the guess.  For tries after the first, T is
+    perturbed by up to 10 percent, the ellipticity is drawn in [-0.3, 0.3]
+    and the center is shifted by up to shift
+
+    parameters
+    ----------
+    guess: gaussian mixture
+        The guess, a single gaussian
+    wt: gaussian mixture
+        The weight to set
+    rand: array
+        5 uniform random numbers in [-1, 1]
+    shift: float
+        Largest shift of the center
+    itry: int
+        The try number, starting at zero
+    """
+
+    gauss = guess[0]
+    row = gauss['row']
+    col = gauss['col']
+    irr = gauss['irr']
+    irc = gauss['irc']
+    icc = gauss['icc']
+
+    if itry > 0:
+        T = (irr + icc)*(1.0 + 0.1*rand[0])
+        e1 = 0.3*rand[1]
+        e2 = 0.3*rand[2]
+
+        irr = 0.5*T*(1.0 - e1)
+        irc = 0.5*T*e2
+        icc = 0.5*T*(1.0 + e1)
+
+        row += shift*rand[3]
+        col += shift*rand[4]
+
+    gauss2d_set(wt[0], 1.0, row, col, irr, irc, icc)
+
+@njit
+def admom_run(confarray, wt, pixels, resarray, censums_func, momsums_func):
+    """
+    run the adaptive moments algorithm, using the input functions
+    to do the sums over pixels
+
+    parameters
+    ----------
+    conf: admom config struct
+        See admom._admom_conf_dtype
+    censums_func, momsums_func: functions
+        Functions to do the center and moment sums for the pixel layout,
+        e.g. admom_censums, admom_momsums
+    """
     # to simplify notation
     conf = confarray[0]
     res  = resarray[0]
@@ -46,7 +193,7 @@ def admom(confarray, wt, pixels, resarray):
         gmix_set_norms(wt)
 
         clear_result(res)
-        admom_censums(wt, pixels, res)
+        censums_func(wt, pixels, res)
 
         if res['sums'][5] <= 0.0:
             res['flags'] = ADMOM_FAINT
@@ -61,7 +208,7 @@ def admom(confarray, wt, pixels, resarray):
             break
 
         clear_result(res)
-        admom_momsums(wt, pixels, res)
+        momsums_func(wt, pixels, res)
 
         if res['sums'][5] <= 0.0:
             res['flags'] = ADMOM_FAINT
@@ -177,6 +324,108 @@ def admom_momsums(wt, pixels, res):
                 res['sums_cov'][i,j] += w2*var*F[i]*F[j]
 
 
+@njit
+def admom_censums_soa(wt, pixels, res):
+    """
+    do sums for determining the center, with pixels in the
+    structure-of-arrays layout
+    """
+
+    v    = pixels[PIXELS_SOA_V]
+    u    = pixels[PIXELS_SOA_U]
+    vals = pixels[PIXELS_SOA_VAL]
+
+    gauss = wt[0]
+    row   = gauss['row']
+    col   = gauss['col']
+    dcc   = gauss['dcc']
+    drr   = gauss['drr']
+    drc2  = 2.0*gauss['drc']
+    pnorm = gauss['pnorm']
+
+    vsum = usum = wsum = 0.0
+
+    n_pixels = v.size
+    for i in xrange(n_pixels):
+        vdiff = v[i] - row
+        udiff = u[i] - col
+
+        chi2 = dcc*vdiff*vdiff + drr*udiff*udiff - drc2*vdiff*udiff
+
+        if chi2 < 25.0 and chi2 >= 0.0:
+            wdata = pnorm*exp3( -0.5*chi2 )*vals[i]
+
+            vsum += wdata*v[i]
+            usum += wdata*u[i]
+            wsum += wdata
+
+    res['npix'] += n_pixels
+    res['sums'][0] += vsum
+    res['sums'][1] += usum
+    res['sums'][5] += wsum
+
+@njit
+def admom_momsums_soa(wt, pixels, res):
+    """
+    do sums for calculating the weighted moments, with pixels in the
+    structure-of-arrays layout
+    """
+
+    v     = pixels[PIXELS_SOA_V]
+    u     = pixels[PIXELS_SOA_U]
+    vals  = pixels[PIXELS_SOA_VAL]
+    ierrs = pixels[PIXELS_SOA_IERR]
+
+    gauss = wt[0]
+    vcen  = gauss['row']
+    ucen  = gauss['col']
+    dcc   = gauss['dcc']
+    drr   = gauss['drr']
+    drc2  = 2.0*gauss['drc']
+    pnorm = gauss['pnorm']
+
+    F = res['F']
+    sums = res['sums']
+    sums_cov = res['sums_cov']
+
+    wsum = 0.0
+
+    n_pixels = v.size
+    for i_pixel in xrange(n_pixels):
+
+        vmod = v[i_pixel]-vcen
+        umod = u[i_pixel]-ucen
+
+        chi2 = dcc*vmod*vmod + drr*umod*umod - drc2*vmod*umod
+
+        if chi2 < 25.0 and chi2 >= 0.0:
+            weight = pnorm*exp3( -0.5*chi2 )
+        else:
+            weight = 0.0
+
+        ierr = ierrs[i_pixel]
+        var = 1.0/(ierr*ierr)
+
+        wdata = weight*vals[i_pixel]
+        w2var = weight*weight*var
+
+        F[0] = v[i_pixel]
+        F[1] = u[i_pixel]
+        F[2] = umod*umod - vmod*vmod
+        F[3] = 2*vmod*umod
+        F[4] = umod*umod + vmod*vmod
+        F[5] = 1.0
+
+        wsum += weight
+
+        for i in xrange(6):
+            sums[i] += wdata*F[i]
+            for j in xrange(6):
+                sums_cov[i,j] += w2var*F[i]*F[j]
+
+    res['wsum'] += wsum
+    res['npix'] += n_pixels
+
 @njit
 def deweight_moments(wt, Irr, Irc, Icc, res):
     """
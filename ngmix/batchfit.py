@@ -0,0 +1,232 @@
+"""
+Fit many objects in a single compiled call
+
+The python overhead of creating a fitter, gaussian mixtures and observation
+lists for each object dominates the run time for small stamps.  The code
+here runs a levenberg-marquardt fit for each object entirely in numba,
+using the analytic jacobian.
+
+The pixels for all objects are packed into a single array, and the objects
+are delimited by an array of offsets; see pack_pixels.  Each object is
+single band and single epoch.  No priors or bounds are supported.
+"""
+from __future__ import print_function, absolute_import, division
+
+import numpy
+
+from .gexceptions import GMixFatalError
+from .gmix import (
+    GMix,
+    get_model_name,
+    get_model_num,
+    get_model_ngauss,
+    get_model_npars,
+    get_coellip_ngauss,
+    _gauss2d_dtype,
+)
+from .gmix_nb import (
+    _gmix_fill_functions,
+    _gmix_fill_derivs_functions,
+)
+from .pixels import _pixels_dtype
+from .fitting import _default_lm_pars
+from . import batchfit_nb
+
+def fit_lm_batch(pixels, offsets, guess, model, psfs=None, lm_pars=None):
+    """
+    run a levenberg-marquardt fit for each object
+
+    parameters
+    ----------
+    pixels: array
+        Array of pixel structures for all objects, e.g. from pack_pixels
+    offsets: array
+        Array of size nobj+1, the pixels for object i are
+        pixels[offsets[i]:offsets[i+1]]
+    guess: array
+        [nobj, npars] array of guesses
+    model: string
+        The model to fit, one of gauss, turb, exp, dev, bdf or coellip.  For
+        bdf TdByTe is fixed at 1, the default for GMixBDF
+    psfs: array, optional
+        [nobj, npsf] array of gaussian mixture data for the psf of each
+        object, e.g. from pack_gmix.  If not sent, the model is not convolved
+    lm_pars: dict, optional
+        can contain maxfev, ftol, xtol.  Defaults are the same as for
+        fitting.LMSimple
+
+    returns
+    -------
+    result: array
+        Result array with fields flags, nfev, njev, ier, pars, pars_err,
+        pars_cov0, pars_cov, with the same meaning as the output of
+        fitting.run_leastsq
+    """
+
+    offsets = numpy.array(offsets, dtype='i8', ndmin=1)
+    guess = numpy.array(guess, dtype='f8', ndmin=2)
+
+    nobj, npars = guess.shape
+    if offsets.size != nobj+1:
+        raise ValueError("offsets should have size nobj+1=%d, "
+                         "got %d" % (nobj+1, offsets.size))
+
+    model_name = get_model_name(model)
+    if model_name == 'coellip':
+        ngauss = get_coellip_ngauss(npars)
+    else:
+        ngauss = get_model_ngauss(get_model_num(model_name))
+        if npars != get_model_npars(model_name):
+            raise ValueError("model '%s' requires %d pars, "
+                             "got %d" % (model_name,
+                                         get_model_npars(model_name),
+                                         npars))
+
+    fill_func, derivs_func = _get_fill_functions(model_name)
+
+    if psfs is None:
+        psfs = _make_delta_psfs(nobj)
+    elif psfs.shape[0] != nobj:
+        raise ValueError("psfs should have %d rows, "
+                         "got %d" % (nobj, psfs.shape[0]))
+
+    if lm_pars is None:
+        lm_pars = _default_lm_pars
+
+    npsf = psfs.shape[1]
+    npix = offsets[1:]-offsets[:-1]
+    wbad, = numpy.where(npix < npars)
+    if wbad.size > 0:
+        raise GMixFatalError("objects must have at least npars=%d pixels, "
+                             "%d do not, e.g. object %d with "
+                             "%d" % (npars, wbad.size, wbad[0], npix[wbad[0]]))
+
+    max_npix = npix.max()
+
+    gm0 = numpy.zeros(ngauss, dtype=_gauss2d_dtype)
+    gm = numpy.zeros(ngauss*npsf, dtype=_gauss2d_dtype)
+    derivs = numpy.zeros( (ngauss, 6, npars) )
+    jacob = numpy.zeros( (npars, max_npix) )
+    fdiff = numpy.zeros(max_npix)
+    fdiff_trial = numpy.zeros(max_npix)
+
+    result = numpy.zeros(nobj, dtype=get_lm_batch_result_dtype(npars))
+
+    batchfit_nb.lm_batch(
+        fill_func,
+        derivs_func,
+        pixels,
+        offsets,
+        psfs,
+        guess,
+        gm0,
+        gm,
+        derivs,
+        jacob,
+        fdiff,
+        fdiff_trial,
+        result,
+        lm_pars.get('maxfev', _default_lm_pars['maxfev']),
+        lm_pars.get('ftol', _default_lm_pars['ftol']),
+        lm_pars.get('xtol', _default_lm_pars['xtol']),
+    )
+
+    return result
+
+def pack_pixels(obs_list):
+    """
+    pack the pixels for a set of observations into a single array
+
+    parameters
+    ----------
+    obs_list: sequence of Observation
+        The observations to pack
+
+    returns
+    -------
+    pixels, offsets: arrays
+        The pixels for observation i are pixels[offsets[i]:offsets[i+1]]
+    """
+
+    nobs = len(obs_list)
+    offsets = numpy.zeros(nobs+1, dtype='i8')
+    for i, obs in enumerate(obs_list):
+        offsets[i+1] = offsets[i] + obs.pixels.size
+
+    pixels = numpy.zeros(offsets[-1], dtype=_pixels_dtype)
+    for i, obs in enumerate(obs_list):
+        pixels[offsets[i]:offsets[i+1]] = obs.pixels
+
+    return pixels, offsets
+
+def pack_gmix(gmix_list):
+    """
+    pack the data for a set of gaussian mixtures, all with the same number of
+    gaussians, into a single [n, ngauss] array
+
+    parameters
+    ----------
+    gmix_list: sequence of GMix
+        The mixtures to pack
+
+    returns
+    -------
+    [n, ngauss] array of gaussian mixture data
+    """
+
+    ngauss = len(gmix_list[0])
+    data = numpy.zeros( (len(gmix_list), ngauss), dtype=_gauss2d_dtype)
+
+    for i, gm in enumerate(gmix_list):
+        assert isinstance(gm, GMix),"gmix should be of type GMix"
+        if len(gm) != ngauss:
+            raise ValueError("all mixtures must have ngauss=%d, "
+                             "got %d" % (ngauss, len(gm)))
+        data[i] = gm.get_data()
+
+    return data
+
+def get_lm_batch_result_dtype(npars):
+    """
+    get the dtype for the result of fit_lm_batch
+    """
+    dt = [
+        ('flags','i4'),
+        ('nfev','i4'),
+        ('njev','i4'),
+        ('ier','i4'),
+        ('pars','f8',npars),
+        ('pars_err','f8',npars),
+        ('pars_cov0','f8',(npars,npars)),
+        ('pars_cov','f8',(npars,npars)),
+    ]
+    return numpy.dtype(dt, align=True)
+
+def _get_fill_functions(model_name):
+    """
+    get the numba functions for filling the model and derivatives
+    """
+    if model_name == 'bdf':
+        return (
+            batchfit_nb.gmix_fill_bdf_fixed,
+            batchfit_nb.gmix_fill_bdf_fixed_derivs,
+        )
+
+    if (model_name not in _gmix_fill_derivs_functions
+            or model_name == 'cm'):
+        raise ValueError("model '%s' not supported for "
+                         "batch fitting" % model_name)
+
+    return (
+        _gmix_fill_functions[model_name],
+        _gmix_fill_derivs_functions[model_name],
+    )
+
+def _make_delta_psfs(nobj):
+    """
+    a psf with zero size, which leaves the model unchanged
+    when convolved
+    """
+    psfs = numpy.zeros( (nobj, 1), dtype=_gauss2d_dtype)
+    psfs['p'] = 1.0
+    return psfs
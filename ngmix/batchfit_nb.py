@@ -0,0 +1,476 @@
+try:
+    xrange
+except NameError:
+    xrange=range
+
+import numpy
+from numba import njit
+
+from .gmix_nb import (
+    gmix_convolve_fill,
+    gmix_get_cen,
+    gmix_fill_bdf,
+    gmix_fill_bdf_derivs,
+)
+from .fitting_nb import (
+    fill_fdiff,
+    fill_fdiff_jacob,
+)
+
+from .fitting import (
+    LM_SINGULAR_MATRIX,
+    LM_NEG_COV_EIG,
+    LM_NEG_COV_DIAG,
+    ZERO_DOF,
+    LM_BAD_GUESS,
+    PDEF,
+    CDEF,
+)
+
+# the damping is not allowed to grow beyond this; at that point no
+# further reduction in chi^2 is possible
+LM_MAX_LAMBDA=1.0e16
+
+@njit
+def gmix_fill_bdf_fixed(gmix, pars):
+    """
+    fill a bdf model with TdByTe=1, the default for GMixBDF
+    """
+    gmix_fill_bdf(gmix, pars, 1.0)
+
+@njit
+def gmix_fill_bdf_fixed_derivs(derivs, pars):
+    """
+    fill derivatives for a bdf model with TdByTe=1
+    """
+    gmix_fill_bdf_derivs(derivs, pars, 1.0)
+
+@njit
+def lm_batch(fill_func,
+             derivs_func,
+             pixels,
+             offsets,
+             psfs,
+             guess,
+             gm0,
+             gm,
+             derivs,
+             jacob,
+             fdiff,
+             fdiff_trial,
+             result,
+             maxfev,
+             ftol,
+             xtol):
+    """
+    run the levenberg-marquardt algorithm for a set of objects
+
+    parameters
+    ----------
+    fill_func: function
+        function to fill the model, e.g. gmix_fill_exp
+    derivs_func: function
+        function to fill the model derivatives, e.g. gmix_fill_exp_derivs
+    pixels: array of pixel structs
+        u,v,val,ierr for all objects
+    offsets: array
+        pixels for object i are pixels[offsets[i]:offsets[i+1]]
+    psfs: array
+        [nobj, npsf] array of gaussian mixtures for the psf of each object
+    guess: array
+        [nobj, npars] array of guesses
+    gm0, gm: gaussian mixtures
+        work space for the model and model convolved with the psf
+    derivs: array
+        work space for the model derivatives, [ngauss, 6, npars]
+    jacob: array
+        work space for the jacobian, [npars, max npix]
+    fdiff, fdiff_trial: arrays
+        work space for (model-data)/err, at least max npix
+    result: array
+        result array to fill, see batchfit.get_lm_batch_result_dtype
+    maxfev: int
+        Maximum number of function evaluations per object
+    ftol: float
+        Relative error desired in sum of squares
+    xtol: float
+        Relative error desired in the solution
+    """
+
+    nobj, npars = guess.shape
+    n_psf = psfs.shape[1]
+
+    psf_pvals = numpy.zeros(n_psf)
+    pars = numpy.zeros(npars)
+    trial = numpy.zeros(npars)
+    step = numpy.zeros(npars)
+    grad = numpy.zeros(npars)
+    alpha = numpy.zeros( (npars, npars) )
+    work = numpy.zeros( (npars, npars) )
+    chol = numpy.zeros( (npars, npars) )
+    parind = numpy.arange(npars)
+
+    for iobj in xrange(nobj):
+        res = result[iobj]
+        psf = psfs[iobj]
+
+        beg = offsets[iobj]
+        end = offsets[iobj+1]
+        obj_pixels = pixels[beg:end]
+        npix = end-beg
+
+        psf_rowcen, psf_colcen, psf_psum = gmix_get_cen(psf)
+        for j in xrange(n_psf):
+            psf_pvals[j] = psf['p'][j]/psf_psum
+
+        pars[:] = guess[iobj]
+
+        nfev = 0
+        njev = 0
+        ier = 0
+
+        ok = lm_eval_jacob(
+            fill_func, derivs_func, pars, psf, psf_pvals, parind,
+            obj_pixels, gm0, gm, derivs, jacob, fdiff,
+        )
+        nfev += 1
+        njev += 1
+
+        if not ok:
+            res['flags'] = LM_BAD_GUESS
+            res['nfev'] = nfev
+            res['njev'] = njev
+            res['ier'] = 0
+            res['pars'][:] = PDEF
+            res['pars_err'][:] = CDEF
+            res['pars_cov0'][:, :] = CDEF
+            res['pars_cov'][:, :] = CDEF
+            continue
+
+        chi2 = lm_sumsq(fdiff, npix)
+
+        lam = 1.0e-3
+        while True:
+
+            lm_fill_alpha(jacob, fdiff, npix, alpha, grad)
+
+            accepted = False
+            while not accepted:
+
+                if nfev >= maxfev:
+                    ier = 5
+                    break
+
+                if lam > LM_MAX_LAMBDA:
+                    # ftol is too small, no further reduction possible
+                    ier = 6
+                    break
+
+                for i in xrange(npars):
+                    for j in xrange(npars):
+                        work[i, j] = alpha[i, j]
+                    work[i, i] += lam*alpha[i, i]
+
+                if not cholesky_solve(work, grad, chol, step):
+                    lam *= 10.0
+                    continue
+
+                for i in xrange(npars):
+                    trial[i] = pars[i] - step[i]
+
+                ok = lm_eval_fdiff(
+                    fill_func, trial, psf, obj_pixels, gm0, gm, fdiff_trial,
+                )
+                nfev += 1
+
+                if not ok:
+                    lam *= 10.0
+                    continue
+
+                chi2_trial = lm_sumsq(fdiff_trial, npix)
+
+                # actual and predicted relative reductions in chi^2
+                actred = 1.0 - chi2_trial/chi2
+                prered = lm_predicted_reduction(alpha, grad, step)/chi2
+
+                xnorm = 0.0
+                snorm = 0.0
+                for i in xrange(npars):
+                    xnorm += pars[i]*pars[i]
+                    snorm += step[i]*step[i]
+
+                if abs(actred) <= ftol and prered <= ftol:
+                    ier |= 1
+
+                if numpy.sqrt(snorm) <= xtol*numpy.sqrt(xnorm):
+                    ier |= 2
+
+                if chi2_trial >= chi2:
+                    if ier != 0:
+                        # converged, keep the current parameters
+                        break
+
+                    lam *= 10.0
+                    continue
+
+                accepted = True
+
+                pars[:] = trial
+                chi2 = chi2_trial
+                lam = max(lam*0.1, 1.0e-12)
+
+                lm_eval_jacob(
+                    fill_func, derivs_func, pars, psf, psf_pvals, parind,
+                    obj_pixels, gm0, gm, derivs, jacob, fdiff,
+                )
+                njev += 1
+
+            if ier != 0:
+                break
+
+        res['nfev'] = nfev
+        res['njev'] = njev
+        res['ier'] = ier
+
+        lm_set_result(
+            pars, jacob, fdiff, npix, chi2, ier,
+            alpha, grad, work, chol, res,
+        )
+
+@njit
+def lm_set_result(pars, jacob, fdiff, npix, chi2, ier,
+                  alpha, grad, work, chol, res):
+    """
+    set the parameters and covariance, following the same
+    rules as fitting.run_leastsq
+    """
+
+    npars = pars.size
+
+    flags = 0
+    if ier > 4:
+        flags = 2**(ier-5)
+        res['flags'] = flags
+        res['pars'][:] = PDEF
+        res['pars_err'][:] = CDEF
+        res['pars_cov0'][:, :] = CDEF
+        res['pars_cov'][:, :] = CDEF
+        return
+
+    res['pars'][:] = pars
+
+    lm_fill_alpha(jacob, fdiff, npix, alpha, grad)
+    if not cholesky_inverse(alpha, chol, work):
+        res['flags'] = LM_SINGULAR_MATRIX
+        res['pars_err'][:] = CDEF
+        res['pars_cov0'][:, :] = CDEF
+        res['pars_cov'][:, :] = CDEF
+        return
+
+    res['pars_cov0'][:, :] = work
+
+    dof = npix - npars
+    if dof == 0:
+        flags |= ZERO_DOF
+        res['flags'] = flags
+        res['pars_err'][:] = CDEF
+        res['pars_cov'][:, :] = CDEF
+        return
+
+    s_sq = chi2/dof
+    for i in xrange(npars):
+        for j in xrange(npars):
+            work[i, j] *= s_sq
+
+    res['pars_cov'][:, :] = work
+
+    # a positive definite matrix has a cholesky decomposition
+    for i in xrange(npars):
+        if work[i, i] < 0.0:
+            flags |= LM_NEG_COV_DIAG
+            break
+
+    if not cholesky_decomp(work, chol):
+        flags |= LM_NEG_COV_EIG
+
+    res['flags'] = flags
+    if flags != 0:
+        res['pars_err'][:] = CDEF
+    else:
+        for i in xrange(npars):
+            res['pars_err'][i] = numpy.sqrt(work[i, i])
+
+@njit
+def lm_eval_fdiff(fill_func, pars, psf, pixels, gm0, gm, fdiff):
+    """
+    fill (model-data)/err for the input parameters
+
+    returns False if the parameters were out of bounds
+    """
+    try:
+        fill_func(gm0, pars)
+        gmix_convolve_fill(gm, gm0, psf)
+        fill_fdiff(gm, pixels, fdiff, 0)
+    except Exception:
+        return False
+
+    return True
+
+@njit
+def lm_eval_jacob(fill_func, derivs_func, pars, psf, psf_pvals, parind,
+                  pixels, gm0, gm, derivs, jacob, fdiff):
+    """
+    fill (model-data)/err and the jacobian for the input parameters
+
+    returns False if the parameters were out of bounds
+    """
+    try:
+        fill_func(gm0, pars)
+        gmix_convolve_fill(gm, gm0, psf)
+        derivs_func(derivs, pars)
+
+        fill_fdiff_jacob(
+            gm, derivs, psf_pvals, parind, pixels, fdiff, jacob, 0,
+        )
+    except Exception:
+        return False
+
+    return True
+
+@njit
+def lm_predicted_reduction(alpha, grad, step):
+    """
+    reduction in chi^2 predicted by the linear model for the
+    parameter change -step
+    """
+    npars = step.size
+
+    pred = 0.0
+    for i in xrange(npars):
+        asum = 0.0
+        for j in xrange(npars):
+            asum += alpha[i, j]*step[j]
+        pred += step[i]*(2.0*grad[i] - asum)
+
+    return pred
+
+@njit
+def lm_sumsq(fdiff, npix):
+    """
+    sum of squares of the first npix elements
+    """
+    chi2 = 0.0
+    for i in xrange(npix):
+        chi2 += fdiff[i]*fdiff[i]
+    return chi2
+
+@njit
+def lm_fill_alpha(jacob, fdiff, npix, alpha, grad):
+    """
+    fill the curvature matrix J J^T and gradient J fdiff, with
+    the derivatives along the rows of the jacobian
+    """
+    npars = alpha.shape[0]
+
+    for i in xrange(npars):
+        gsum = 0.0
+        for ipix in xrange(npix):
+            gsum += jacob[i, ipix]*fdiff[ipix]
+        grad[i] = gsum
+
+        for j in xrange(i, npars):
+            asum = 0.0
+            for ipix in xrange(npix):
+                asum += jacob[i, ipix]*jacob[j, ipix]
+            alpha[i, j] = asum
+            alpha[j, i] = asum
+
+@njit
+def cholesky_decomp(mat, chol):
+    """
+    cholesky decomposition of the symmetric matrix mat into the lower
+    triangle of chol
+
+    returns False if the matrix is not positive definite
+    """
+    n = mat.shape[0]
+    chol[:, :] = 0.0
+
+    for j in xrange(n):
+        dsum = mat[j, j]
+        for k in xrange(j):
+            dsum -= chol[j, k]*chol[j, k]
+
+        if not dsum > 0.0:
+            return False
+
+        chol[j, j] = numpy.sqrt(dsum)
+
+        for i in xrange(j+1, n):
+            osum = mat[i, j]
+            for k in xrange(j):
+                osum -= chol[i, k]*chol[j, k]
+            chol[i, j] = osum/chol[j, j]
+
+    return True
+
+@njit
+def cholesky_solve(mat, vec, chol, out):
+    """
+    solve mat*out = vec for symmetric positive definite mat
+
+    returns False if the matrix is not positive definite
+    """
+    if not cholesky_decomp(mat, chol):
+        return False
+
+    n = mat.shape[0]
+
+    # forward substitution L y = vec
+    for i in xrange(n):
+        dsum = vec[i]
+        for k in xrange(i):
+            dsum -= chol[i, k]*out[k]
+        out[i] = dsum/chol[i, i]
+
+    # back substitution L^T x = y
+    for i in xrange(n-1, -1, -1):
+        dsum = out[i]
+        for k in xrange(i+1, n):
+            dsum -= chol[k, i]*out[k]
+        out[i] = dsum/chol[i, i]
+
+    return True
+
+@njit
+def cholesky_inverse(mat, chol, out):
+    """
+    invert the symmetric positive definite matrix mat
+
+    returns False if the matrix is not positive definite
+    """
+    if not cholesky_decomp(mat, chol):
+        return False
+
+    n = mat.shape[0]
+    col = numpy.zeros(n)
+
+    for j in xrange(n):
+
+        # solve for column j of the inverse
+        for i in xrange(n):
+            dsum = 1.0 if i == j else 0.0
+            for k in xrange(i):
+                dsum -= chol[i, k]*col[k]
+            col[i] = dsum/chol[i, i]
+
+        for i in xrange(n-1, -1, -1):
+            dsum = col[i]
+            for k in xrange(i+1, n):
+                dsum -= chol[k, i]*col[k]
+            col[i] = dsum/chol[i, i]
+
+        for i in xrange(n):
+            out[i, j] = col[i]
+
+    return True
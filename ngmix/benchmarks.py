@@ -0,0 +1,757 @@
+"""
+Benchmarks for the compiled kernels
+
+These are not run as part of the tests; run them by hand, e.g.
+
+    import ngmix.benchmarks
+    ngmix.benchmarks.bench_pixel_layout()
+    ngmix.benchmarks.bench_exp()
+    ngmix.benchmarks.bench_fit_alloc()
+    ngmix.benchmarks.bench_metacal()
+    ngmix.benchmarks.bench_gmix_reuse()
+    ngmix.benchmarks.bench_render_batch()
+    ngmix.benchmarks.bench_em_accel()
+
+Each benchmark runs the kernels once before timing, so compilation is not
+included, and reports the best time per call over several repeats
+"""
+from __future__ import print_function, absolute_import, division
+
+import timeit
+import numpy
+
+from .gmix import GMixModel, make_gmix_model_batch, make_image_batch
+from .jacobian import DiagonalJacobian
+from .observation import Observation
+
+
+def bench_pixel_layout(model='exp',
+                       dim=64,
+                       T=4.0,
+                       scale=0.263,
+                       number=50,
+                       repeat=5,
+                       seed=None):
+    """
+    compare the kernels using the array-of-structs pixel layout with those
+    using the structure-of-arrays layout
+
+    For render and fill_fdiff the soa column is the grid kernel,
+    render_grid or fill_fdiff_grid, which is the soa path for those
+    operations: the coordinates are made along each row by recurrence, so
+    only the val and ierr rows of the soa pixels are read
+
+    parameters
+    ----------
+    model: string, optional
+        The model to render and use for the likelihood
+    dim: int, optional
+        The dimension of the square image
+    T: float, optional
+        T of the model in arcsec^2
+    scale: float, optional
+        The pixel scale
+    number: int, optional
+        Number of calls per timing
+    repeat: int, optional
+        Number of timings, the best is reported
+    seed: int, optional
+        Seed for the noise
+
+    returns
+    -------
+    dict keyed by kernel name, each entry holding a tuple of times per call
+    in seconds for the struct and soa layouts
+    """
+    from .pixels import make_coords
+    from .render_nb import render, render_grid
+    from .fitting_nb import (
+        get_loglike,
+        get_loglike_soa,
+        fill_fdiff,
+        fill_fdiff_grid,
+        FDIFF_MAX_CHI2,
+    )
+    from .fastexp import EXP_TABLE
+    from .admom_nb import admom, admom_soa
+    from .admom import Admom
+    from .em_nb import em_run, em_run_soa
+    from .em import GMixEM
+
+    rng = numpy.random.RandomState(seed)
+
+    gm = GMixModel([0.1, -0.05, 0.2, 0.1, T, 100.0], model)
+    jacob = DiagonalJacobian(row=dim/2.0, col=dim/2.0, scale=scale)
+
+    dims = (dim, dim)
+    image = gm.make_image(dims, jacobian=jacob)
+
+    # EM requires positive pixels, add a sky
+    sky = 0.01*image.max()
+    em_obs = Observation(image + sky, jacobian=jacob)
+    em_fitter = GMixEM(em_obs)
+    em_guess = GMixModel([0.0, 0.0, 0.0, 0.0, T, 1.0], 'turb')
+    em_conf = em_fitter._make_conf()
+    em_conf['tol'] = 0.0
+    em_conf['maxiter'] = 20
+    em_conf['sky_guess'] = sky*image.size
+    em_conf['counts'] = em_fitter._counts
+    em_conf['pixel_scale'] = scale
+
+    noise = 0.01*image.max()
+    image += rng.normal(scale=noise, size=dims)
+    weight = numpy.zeros(dims) + 1.0/noise**2
+
+    obs = Observation(image, weight=weight, jacobian=jacob)
+
+    gmdata = gm.get_data()
+    pixels = obs.pixels
+    pixels_soa = obs.pixels_soa
+    jdata = jacob._data
+
+    coords = make_coords(dims, jacob)
+    rimage = numpy.zeros(dims)
+    fdiff = numpy.zeros(pixels.size)
+
+    am = Admom(obs)
+    am_guess = am._get_guess(T)
+    am_res = am._get_am_result()
+
+    def run_admom(func, pix):
+        wt = am_guess._data.copy()
+        func(am.conf, wt, pix, am_res)
+
+    def run_em(func, pix):
+        gmem = em_guess.copy()
+        sums = em_fitter._make_sums(len(gmem))
+        func(em_conf, pix, sums, gmem.get_data())
+
+    funcs = [
+        ('render',
+         lambda: render(gmdata, coords, rimage.ravel(), 0),
+         lambda: render_grid(gmdata, rimage, jdata, 0)),
+        ('render fast_exp',
+         lambda: render(gmdata, coords, rimage.ravel(), 1),
+         lambda: render_grid(gmdata, rimage, jdata, 1)),
+        ('get_loglike',
+         lambda: get_loglike(gmdata, pixels),
+         lambda: get_loglike_soa(gmdata, pixels_soa)),
+        ('fill_fdiff',
+         lambda: fill_fdiff(gmdata, pixels, fdiff, 0),
+         lambda: fill_fdiff_grid(gmdata, pixels_soa, jdata, dim, dim,
+                                 fdiff, 0, FDIFF_MAX_CHI2, EXP_TABLE)),
+        ('admom',
+         lambda: run_admom(admom, pixels),
+         lambda: run_admom(admom_soa, pixels_soa)),
+        ('em_run',
+         lambda: run_em(em_run, em_obs.pixels),
+         lambda: run_em(em_run_soa, em_obs.pixels_soa)),
+    ]
+
+    print('model: %s dims: %s' % (model, dims))
+    print('%-16s %12s %12s %8s' % ('kernel', 'struct (us)', 'soa (us)', 'speedup'))
+
+    results = {}
+    for name, struct_func, soa_func in funcs:
+        times = []
+        for func in (struct_func, soa_func):
+            # compile
+            func()
+            tm = min(timeit.repeat(func, number=number, repeat=repeat))
+            times.append(tm/number)
+
+        results[name] = tuple(times)
+        print('%-16s %12.1f %12.1f %8.2f' % (
+            name, times[0]*1.0e6, times[1]*1.0e6, times[0]/times[1],
+        ))
+
+    return results
+
+def bench_exp(model='exp',
+              dim=64,
+              T=4.0,
+              scale=0.263,
+              npoints=100000,
+              number=50,
+              repeat=5,
+              seed=None):
+    """
+    compare the methods for evaluating the exponential, both for the
+    exponential alone over [-300,0] and in the fdiff and jacobian kernels
+    used by the LM fitter
+
+    parameters
+    ----------
+    model: string, optional
+        The model for the fitter kernels
+    dim: int, optional
+        The dimension of the square image
+    T: float, optional
+        T of the model in arcsec^2
+    scale: float, optional
+        The pixel scale
+    npoints: int, optional
+        Number of points in [-300,0] at which to evaluate the exponential
+    number: int, optional
+        Number of calls per timing
+    repeat: int, optional
+        Number of timings, the best is reported
+    seed: int, optional
+        Seed for the noise
+
+    returns
+    -------
+    dict keyed by method name, each entry holding a dict with the max
+    relative error and times per call in seconds for each kernel
+    """
+    from .fastexp import get_exp_method
+    from .fastexp_nb import fill_exp
+    from .fitting import LMSimple
+
+    rng = numpy.random.RandomState(seed)
+
+    x = numpy.linspace(-300.0, 0.0, npoints)
+    expected = numpy.exp(x)
+    vals = numpy.zeros(npoints)
+
+    pars = numpy.array([0.1, -0.05, 0.2, 0.1, T, 100.0])
+    gm = GMixModel(pars, model)
+    jacob = DiagonalJacobian(row=dim/2.0, col=dim/2.0, scale=scale)
+
+    dims = (dim, dim)
+    image = gm.make_image(dims, jacobian=jacob)
+
+    noise = 0.01*image.max()
+    image += rng.normal(scale=noise, size=dims)
+    weight = numpy.zeros(dims) + 1.0/noise**2
+
+    obs = Observation(image, weight=weight, jacobian=jacob)
+
+    print('model: %s dims: %s exp points: %d' % (model, dims, npoints))
+    print('%-8s %10s %12s %12s %12s' % (
+        'method', 'max relerr', 'exp (ns)', 'fdiff (us)', 'jacob (us)',
+    ))
+
+    results = {}
+    for method in ['table', 'poly', 'exact']:
+        meth = get_exp_method(method)
+
+        fitter = LMSimple(obs, model, exp_method=method)
+        fitter._setup_data(pars)
+        fitter._make_lists()
+
+        funcs = [
+            lambda: fill_exp(x, vals, meth),
+            lambda: fitter._calc_fdiff(pars),
+            lambda: fitter._calc_jacob(pars),
+        ]
+
+        times = []
+        for func in funcs:
+            # compile
+            func()
+            tm = min(timeit.repeat(func, number=number, repeat=repeat))
+            times.append(tm/number)
+
+        fill_exp(x, vals, meth)
+        relerr = numpy.abs(vals/expected - 1.0).max()
+
+        results[method] = {
+            'max_relerr': relerr,
+            'exp': times[0]/npoints,
+            'fdiff': times[1],
+            'jacob': times[2],
+        }
+        print('%-8s %10.2g %12.2f %12.1f %12.1f' % (
+            method, relerr,
+            times[0]/npoints*1.0e9, times[1]*1.0e6, times[2]*1.0e6,
+        ))
+
+    return results
+
+def bench_fit_alloc(model='exp',
+                    dim=48,
+                    T=4.0,
+                    scale=0.263,
+                    bounds=False,
+                    ncalls=100,
+                    seed=None):
+    """
+    measure the memory allocations made by the fdiff and jacobian callbacks
+    of the LM fitter
+
+    Allocations from python, including numpy arrays, are measured with
+    tracemalloc.  The fdiff callback makes a new fdiff array for each call,
+    since MINPACK keeps references to earlier ones, so its peak is about the
+    size of the fdiff array; for the jacobian callback the peak should be
+    far below that.  Allocations by the numba runtime are counted using its statistics when
+    available.  Each array passed from python to a kernel costs one small
+    allocation for its reference counting record, so the count per call is
+    the number of array arguments, independent of the image size
+
+    parameters
+    ----------
+    model: string, optional
+        The model to fit
+    dim: int, optional
+        The dimension of the square image
+    T: float, optional
+        T of the model in arcsec^2
+    scale: float, optional
+        The pixel scale
+    bounds: bool, optional
+        If True, use a prior with bounds on T and flux, so the fits go
+        through the bounds transform in leastsqbound
+    ncalls: int, optional
+        Number of calls to the callbacks
+    seed: int, optional
+        Seed for the noise
+
+    returns
+    -------
+    dict keyed by callback name, each entry holding a dict with the peak
+    python memory above the starting point in bytes, and the number of numba
+    allocations per call (None if not available).  The size of the fdiff
+    array in bytes is in the 'fdiff_nbytes' entry
+    """
+    import tracemalloc
+    from .fitting import LMSimple
+    from .leastsqbound import (
+        _internal2external_func,
+        _external2internal_func,
+    )
+
+    rng = numpy.random.RandomState(seed)
+
+    pars = numpy.array([0.1, -0.05, 0.2, 0.1, T, 100.0])
+    gm = GMixModel(pars, model)
+    jacob = DiagonalJacobian(row=dim/2.0, col=dim/2.0, scale=scale)
+
+    dims = (dim, dim)
+    image = gm.make_image(dims, jacobian=jacob)
+
+    noise = 0.01*image.max()
+    image += rng.normal(scale=noise, size=dims)
+    weight = numpy.zeros(dims) + 1.0/noise**2
+
+    obs = Observation(image, weight=weight, jacobian=jacob)
+
+    prior = None
+    if bounds:
+        from .joint_prior import PriorSimpleSep
+        from .priors import CenPrior, GPriorBA, Normal
+        prior = PriorSimpleSep(
+            CenPrior(0.0, 0.0, scale, scale),
+            GPriorBA(0.3),
+            Normal(T, T, bounds=[-0.1*T, 100.0*T]),
+            Normal(100.0, 100.0, bounds=[-10.0, 1.0e4]),
+        )
+
+    fitter = LMSimple(obs, model, prior=prior)
+
+    # warm up, including compilation
+    fitter.go(pars)
+    fitter._setup_data(pars)
+    fitter._make_lists()
+
+    if bounds:
+        # call through the internal to external parameter transform
+        i2e = _internal2external_func(prior.bounds)
+        ipars = _external2internal_func(prior.bounds)(pars)
+
+        def calc_fdiff():
+            return fitter._calc_fdiff(i2e(ipars))
+
+        def calc_jacob():
+            return fitter._calc_jacob(i2e(ipars))
+    else:
+        def calc_fdiff():
+            return fitter._calc_fdiff(pars)
+
+        def calc_jacob():
+            return fitter._calc_jacob(pars)
+
+    funcs = [
+        ('fdiff', calc_fdiff),
+        ('jacob', calc_jacob),
+    ]
+
+    nrt = _get_nrt_stats()
+
+    fdiff_nbytes = fitter.fdiff_size*8
+    print('model: %s dims: %s bounds: %s fdiff: %d bytes' % (
+        model, dims, bounds, fdiff_nbytes,
+    ))
+    print('%-8s %18s %20s' % ('call', 'python peak (B)', 'numba allocs/call'))
+
+    results = {'fdiff_nbytes': fdiff_nbytes}
+    for name, func in funcs:
+        func()
+
+        tracemalloc.start()
+        try:
+            nalloc0 = nrt()
+            start, _ = tracemalloc.get_traced_memory()
+
+            for i in range(ncalls):
+                func()
+
+            _, peak = tracemalloc.get_traced_memory()
+            nalloc1 = nrt()
+        finally:
+            tracemalloc.stop()
+
+        if nalloc0 is None:
+            nalloc = None
+        else:
+            nalloc = (nalloc1-nalloc0)/float(ncalls)
+
+        results[name] = {
+            'peak_bytes': peak-start,
+            'numba_allocs': nalloc,
+        }
+        print('%-8s %18d %20s' % (
+            name, peak-start, 'n/a' if nalloc is None else '%.1f' % nalloc,
+        ))
+
+    return results
+
+def bench_metacal(dim=48,
+                  T=0.5,
+                  psf_T=0.6,
+                  scale=0.263,
+                  number=10,
+                  repeat=3,
+                  seed=None):
+    """
+    compare the time to make all the metacal images with the galsim and
+    fft backends, including setting up the metacal object
+
+    parameters
+    ----------
+    dim: int, optional
+        The dimension of the square image and psf image
+    T: float, optional
+        T of the exponential galaxy in arcsec^2
+    psf_T: float, optional
+        T of the gaussian psf in arcsec^2
+    scale: float, optional
+        The pixel scale
+    number: int, optional
+        Number of calls per timing
+    repeat: int, optional
+        Number of timings, the best is reported
+    seed: int, optional
+        Seed for the noise
+
+    returns
+    -------
+    dict keyed by backend, holding the time per object in seconds
+    """
+    from .metacal import Metacal
+    from .metacal_fft import MetacalFFT
+
+    rng = numpy.random.RandomState(seed)
+
+    jacob = DiagonalJacobian(row=(dim-1)/2.0, col=(dim-1)/2.0, scale=scale)
+    dims = (dim, dim)
+
+    psf_gm = GMixModel([0.0, 0.0, 0.0, 0.02, psf_T, 1.0], 'gauss')
+    psf_im = psf_gm.make_image(dims, jacobian=jacob)
+    psf_noise = 1.0e-6
+    psf_obs = Observation(
+        psf_im + rng.normal(scale=psf_noise, size=dims),
+        weight=numpy.zeros(dims) + 1.0/psf_noise**2,
+        jacobian=jacob,
+    )
+
+    gm = GMixModel([0.0, 0.0, 0.2, 0.1, T, 100.0], 'exp').convolve(psf_gm)
+    image = gm.make_image(dims, jacobian=jacob)
+    noise = 0.01*image.max()
+    obs = Observation(
+        image + rng.normal(scale=noise, size=dims),
+        weight=numpy.zeros(dims) + 1.0/noise**2,
+        jacobian=jacob,
+        psf=psf_obs,
+    )
+
+    print('dims: %s' % (dims,))
+    print('%-8s %12s' % ('backend', 'time (ms)'))
+
+    results = {}
+    for name, cls in [('galsim', Metacal), ('fft', MetacalFFT)]:
+
+        def func():
+            return cls(obs).get_all()
+
+        func()
+        tm = min(timeit.repeat(func, number=number, repeat=repeat))
+        results[name] = tm/number
+
+        print('%-8s %12.2f' % (name, results[name]*1.0e3))
+
+    return results
+
+def bench_gmix_reuse(model='exp',
+                     psf_model='turb',
+                     number=10000,
+                     repeat=5):
+    """
+    compare making new mixtures for each set of parameters with filling
+    existing mixtures in place, using fill, copy_into and convolve_into
+
+    parameters
+    ----------
+    model: string, optional
+        The model for the object
+    psf_model: string, optional
+        The model for the psf
+    number: int, optional
+        Number of calls in each timing
+    repeat: int, optional
+        Number of timings; the best is reported
+
+    returns
+    -------
+    dict keyed by operation, each entry holding a dict with the time per
+    call in seconds for making new mixtures ('new') and reusing them
+    ('reuse')
+    """
+
+    pars = numpy.array([0.1, -0.05, 0.2, 0.1, 4.0, 100.0])
+    psf = GMixModel([0.0, 0.0, 0.0, 0.05, 0.6, 1.0], psf_model)
+
+    gm0 = GMixModel(pars, model)
+    gm = gm0.convolve(psf)
+    gm_copy = gm.copy()
+
+    def new_convolve():
+        GMixModel(pars, model).convolve(psf)
+
+    def reuse_convolve():
+        gm0.fill(pars)
+        gm0.convolve_into(psf, gm)
+
+    def new_copy():
+        gm.copy()
+
+    def reuse_copy():
+        gm.copy_into(gm_copy)
+
+    funcs = [
+        ('make+convolve', new_convolve, reuse_convolve),
+        ('copy', new_copy, reuse_copy),
+    ]
+
+    print('model: %s psf: %s' % (model, psf_model))
+    print('%-14s %12s %12s %8s' % ('op', 'new (us)', 'reuse (us)', 'speedup'))
+
+    results = {}
+    for name, new_func, reuse_func in funcs:
+        res = {}
+        for type, func in [('new', new_func), ('reuse', reuse_func)]:
+            func()
+            times = timeit.repeat(func, number=number, repeat=repeat)
+            res[type] = min(times)/number
+
+        results[name] = res
+        print('%-14s %12.3f %12.3f %8.2f' % (
+            name,
+            res['new']*1.0e6,
+            res['reuse']*1.0e6,
+            res['new']/res['reuse'],
+        ))
+
+    return results
+
+def bench_render_batch(model='exp',
+                       psf_model='turb',
+                       nobj=1000,
+                       dim=48,
+                       scale=0.263,
+                       number=5,
+                       repeat=5,
+                       seed=None):
+    """
+    compare making and rendering the mixtures one object at a time with
+    make_gmix_model_batch and make_image_batch
+
+    parameters
+    ----------
+    model: string, optional
+        The model for the objects
+    psf_model: string, optional
+        The model for the psf
+    nobj: int, optional
+        Number of objects
+    dim: int, optional
+        Dimension of the square stamps
+    scale: float, optional
+        Pixel scale
+    number: int, optional
+        Number of calls in each timing
+    repeat: int, optional
+        Number of timings; the best is reported
+    seed: int, optional
+        Seed for the random parameters
+
+    returns
+    -------
+    dict with the time per object in seconds for the loop ('loop') and
+    the batch ('batch')
+    """
+
+    rng = numpy.random.RandomState(seed)
+
+    pars = numpy.zeros( (nobj, 6) )
+    pars[:, 0:2] = rng.uniform(low=-0.5, high=0.5, size=(nobj, 2))
+    pars[:, 2:4] = rng.uniform(low=-0.2, high=0.2, size=(nobj, 2))
+    pars[:, 4] = rng.uniform(low=0.5, high=4.0, size=nobj)
+    pars[:, 5] = 100.0
+
+    psf = GMixModel([0.0, 0.0, 0.0, 0.05, 0.6, 1.0], psf_model)
+    jacob = DiagonalJacobian(row=dim/2.0, col=dim/2.0, scale=scale)
+    dims = [dim, dim]
+
+    def loop():
+        for i in range(nobj):
+            gm = GMixModel(pars[i], model).convolve(psf)
+            gm.make_image(dims, jacobian=jacob, parallel=False)
+
+    def batch():
+        gm = make_gmix_model_batch(pars, model, psf=psf)
+        make_image_batch(gm, dims, jacobian=jacob)
+
+    print('model: %s psf: %s nobj: %d dim: %d' % (model, psf_model, nobj, dim))
+    print('%12s %12s %8s' % ('loop (us)', 'batch (us)', 'speedup'))
+
+    results = {}
+    for type, func in [('loop', loop), ('batch', batch)]:
+        func()
+        times = timeit.repeat(func, number=number, repeat=repeat)
+        results[type] = min(times)/number/nobj
+
+    print('%12.3f %12.3f %8.2f' % (
+        results['loop']*1.0e6,
+        results['batch']*1.0e6,
+        results['loop']/results['batch'],
+    ))
+
+    return results
+
+def bench_em_accel(psf_model='turb',
+                   ngauss=3,
+                   Tvals=(0.3, 0.6, 1.0),
+                   dim=25,
+                   scale=0.263,
+                   ntrial=20,
+                   maxiter=5000,
+                   tol=1.0e-6,
+                   seed=None):
+    """
+    compare the number of passes over the pixels and the time for plain
+    EM and EM with SQUAREM acceleration, fitting psf images
+
+    parameters
+    ----------
+    psf_model: string, optional
+        The model used to make the psf images
+    ngauss: int, optional
+        Number of gaussians for the EM fit
+    Tvals: sequence, optional
+        The T values for the psfs
+    dim: int, optional
+        Dimension of the square stamps
+    scale: float, optional
+        Pixel scale
+    ntrial: int, optional
+        Number of random starting guesses for each psf
+    maxiter: int, optional
+        Maximum number of passes over the pixels
+    tol: float, optional
+        Tolerance for the EM
+    seed: int, optional
+        Seed for the guesses
+
+    returns
+    -------
+    dict keyed by T, each entry holding a dict with the mean number of
+    passes and the mean time per fit in seconds for plain ('plain') and
+    accelerated ('accel') EM
+    """
+    import time
+    from .em import GMixEM, prep_image
+    from .bootstrap import EMRunner
+
+    rng = numpy.random.RandomState(seed)
+    jacob = DiagonalJacobian(row=(dim-1)/2.0, col=(dim-1)/2.0, scale=scale)
+
+    print('model: %s ngauss: %d' % (psf_model, ngauss))
+    print('%6s %12s %12s %12s %12s' % (
+        'T', 'plain npass', 'accel npass', 'plain (us)', 'accel (us)',
+    ))
+
+    results = {}
+    for T in Tvals:
+        gm = GMixModel([0.0, 0.0, 0.02, -0.01, T, 1.0], psf_model)
+        image = gm.make_image([dim, dim], jacobian=jacob)
+        image, sky = prep_image(image)
+        obs = Observation(image, jacobian=jacob)
+
+        runner = EMRunner(obs, T, ngauss, {}, rng=rng)
+        guesses = [runner.get_guess() for i in range(ntrial)]
+
+        fitter = GMixEM(obs)
+
+        res = {}
+        for type, accelerate in [('plain', False), ('accel', True)]:
+            # compile
+            fitter.go(guesses[0], sky, maxiter=maxiter, tol=tol,
+                      parallel=False, accelerate=accelerate)
+
+            npass = []
+            tm0 = time.time()
+            for guess in guesses:
+                fitter.go(guess, sky, maxiter=maxiter, tol=tol,
+                          parallel=False, accelerate=accelerate)
+                fres = fitter.get_result()
+                if fres['flags'] == 0:
+                    npass.append(fres['npass'])
+            tm = time.time()-tm0
+
+            res[type] = {
+                'npass': numpy.mean(npass) if len(npass) > 0 else numpy.nan,
+                'time': tm/ntrial,
+            }
+
+        results[T] = res
+        print('%6.2f %12.1f %12.1f %12.1f %12.1f' % (
+            T,
+            res['plain']['npass'],
+            res['accel']['npass'],
+            res['plain']['time']*1.0e6,
+            res['accel']['time']*1.0e6,
+        ))
+
+    return results
+
+def _get_nrt_stats():
+    """
+    get a function returning the number of allocations made by the numba
+    runtime, which returns None if the statistics are not available
+    """
+    try:
+        from numba.core.runtime import _nrt_python
+        from numba.core.runtime import rtsys
+        if not _nrt_python.memsys_stats_enabled():
+            _nrt_python.memsys_enable_stats()
+
+        def get_nalloc():
+            return rtsys.get_allocation_stats().alloc
+
+        get_nalloc()
+    except Exception:
+        def get_nalloc():
+            return None
+
+    return get_nalloc
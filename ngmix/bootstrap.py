@@ -17,7 +17,7 @@ from numpy.linalg import LinAlgError
 from . import admom
 from . import fitting
 from .gmix import GMix, GMixModel, GMixCM, get_coellip_npars
-from .em import GMixEM, prep_image
+from .em import GMixEM, GMixEMFixedPSF, prep_image, EM_RANGE_ERROR
 from .observation import Observation, ObsList, MultiBandObsList, get_mb_obs
 from .shape import get_round_factor
 from .guessers import (
@@ -51,6 +51,8 @@ class Bootstrapper(object):
     def __init__(self, obs,
                  find_cen=False,
                  verbose=False,
+                 rng=None,
+                 psf_cache=None,
                  **kw):
         """
         The data can be mutated: If a PSF fit is performed, the gmix will be
@@ -64,10 +66,19 @@ class Bootstrapper(object):
 
             If the psf observations already have gmix objects set, there is no
             need to run fit_psfs()
+        rng: numpy.random.RandomState, optional
+            Random number generator for the psf fit guesses and for metacal.
+            If not sent, each psf fitter makes its own
+        psf_cache: psfcache.PSFFitCache, optional
+            If sent, psf fits are looked up in this cache and stored in it,
+            so fits for psf images seen before are reused.  The cache can
+            be shared between bootstrappers
         """
 
         self.find_cen=find_cen
         self.verbose=verbose
+        self.rng=rng
+        self.psf_cache=psf_cache
 
         # this never gets modified in any way
         self.mb_obs_list_orig = get_mb_obs(obs)
@@ -487,19 +498,30 @@ class Bootstrapper(object):
         TODO: add bootstrapping T guess as well, from unweighted moments
         """
 
-        if 'em' in psf_model:
-            runner=self._fit_one_psf_em(psf_obs, psf_model,
-                                        Tguess, ntry, fit_pars)
-        elif 'coellip' in psf_model:
-            runner=self._fit_one_psf_coellip(psf_obs, psf_model,
-                                             Tguess, ntry, fit_pars)
-        elif psf_model=='am':
-            runner=self._fit_one_psf_am(psf_obs, Tguess, ntry)
+        psf_cache=getattr(self, 'psf_cache', None)
+        if psf_cache is not None:
+            key=psf_cache.get_key(psf_obs, psf_model, Tguess, ntry, fit_pars)
+            psf_fitter=psf_cache.get(key)
         else:
-            runner=self._fit_one_psf_max(psf_obs, psf_model,
-                                         Tguess, ntry, fit_pars)
+            psf_fitter=None
+
+        if psf_fitter is None:
+            if 'em' in psf_model:
+                runner=self._fit_one_psf_em(psf_obs, psf_model,
+                                            Tguess, ntry, fit_pars)
+            elif 'coellip' in psf_model:
+                runner=self._fit_one_psf_coellip(psf_obs, psf_model,
+                                                 Tguess, ntry, fit_pars)
+            elif psf_model=='am':
+                runner=self._fit_one_psf_am(psf_obs, Tguess, ntry)
+            else:
+                runner=self._fit_one_psf_max(psf_obs, psf_model,
+                                             Tguess, ntry, fit_pars)
+
+            psf_fitter = runner.fitter
+            if psf_cache is not None:
+                psf_cache.put(key, psf_fitter)
 
-        psf_fitter = runner.fitter
         res=psf_fitter.get_result()
         psf_obs.update_meta_data({'fitter':psf_fitter})
 
@@ -522,13 +544,13 @@ class Bootstrapper(object):
         if fit_pars is not None:
             em_pars.update(fit_pars)
 
-        runner=EMRunner(psf_obs, Tguess, ngauss, em_pars)
+        runner=EMRunner(psf_obs, Tguess, ngauss, em_pars, rng=self.rng)
         runner.go(ntry=ntry)
 
         return runner
 
     def _fit_one_psf_am(self, psf_obs, Tguess, ntry):
-        runner=AMRunner(psf_obs, Tguess)
+        runner=AMRunner(psf_obs, Tguess, rng=self.rng)
         runner.go(ntry=ntry)
         return runner
 
@@ -545,7 +567,8 @@ class Bootstrapper(object):
         if fit_pars is not None:
             lm_pars.update(fit_pars)
 
-        runner=PSFRunnerCoellip(psf_obs, Tguess, ngauss, lm_pars)
+        runner=PSFRunnerCoellip(psf_obs, Tguess, ngauss, lm_pars,
+                                rng=self.rng)
         runner.go(ntry=ntry)
 
         return runner
@@ -561,7 +584,8 @@ class Bootstrapper(object):
         if fit_pars is not None:
             lm_pars.update(fit_pars)
 
-        runner=PSFRunner(psf_obs, psf_model, Tguess, lm_pars)
+        runner=PSFRunner(psf_obs, psf_model, Tguess, lm_pars,
+                         rng=self.rng)
         runner.go(ntry=ntry)
 
         return runner
@@ -900,7 +924,52 @@ class Bootstrapper(object):
                                              scaling=scaling)
         return guesser
 
+    def get_em_guesser(self, ngauss=1, em_pars=None, prior=None, widths=None):
+        """
+        get a guesser centered on an EM fit to the first observation, with
+        the psf deconvolved, see em.GMixEMFixedPSF.  The center, shape and
+        T come from the EM fit and the fluxes from the psf flux fit.  This
+        is for the simple models, e.g. send it to fit_max with guesser=
+
+        You must run fit_psfs() successfully first
+
+        parameters
+        ----------
+        ngauss: int, optional
+            Number of gaussians for the EM fit, default 1
+        em_pars: dict, optional
+            Sent to GMixEMFixedPSF.go, default maxiter=1000, tol=1.0e-4
+        prior: optional
+            If sent, guesses not allowed by the prior are replaced by
+            samples from the prior
+        widths: array, optional
+            Widths for the guesses, see guessers.ParsGuesser
+        """
+
+        tem_pars={'maxiter': 1000, 'tol': 1.0e-4}
+        if em_pars is not None:
+            tem_pars.update(em_pars)
+
+        obs=self.mb_obs_list[0][0]
+        psf_gmix=obs.get_psf_gmix()
+        pres=self.get_psf_flux_result()
+
+        runner=EMRunner(obs, psf_gmix.get_T(), ngauss, {}, rng=self.rng)
 
+        fitter=GMixEMFixedPSF(runner.obs, psf=psf_gmix)
+        fitter.go(runner.get_guess(), runner.sky, **tem_pars)
+
+        res=fitter.get_result()
+        if res['flags'] & EM_RANGE_ERROR:
+            raise BootGalFailure("em guess failed: %s" % res['message'])
+
+        gm=fitter.get_gmix()
+        row, col = gm.get_cen()
+        g1, g2, T = gm.get_g1g2T()
+
+        guess=numpy.hstack( ([row, col, g1, g2, T], pres['psf_flux']) )
+
+        return ParsGuesser(guess, prior=prior, widths=widths)
 
     def try_replace_cov(self, cov_pars, fitter=None):
         """
@@ -1473,6 +1542,9 @@ class MaxMetacalBootstrapper(Bootstrapper):
         if metacal_pars_in is not None:
             metacal_pars.update(metacal_pars_in)
 
+        if self.rng is not None and 'rng' not in metacal_pars:
+            metacal_pars['rng'] = self.rng
+
         return metacal_pars
 
     def _do_metacal_max_fits(self, obs_dict, psf_model, gal_model, pars,
@@ -1485,7 +1557,9 @@ class MaxMetacalBootstrapper(Bootstrapper):
             # run a regular Bootstrapper on these observations
             boot = Bootstrapper(obs_dict[key],
                                 find_cen=self.find_cen,
-                                verbose=self.verbose)
+                                verbose=self.verbose,
+                                rng=self.rng,
+                                psf_cache=self.psf_cache)
 
             if False:
                 import images
@@ -2079,6 +2153,11 @@ class AMRunner(object):
 class EMRunner(object):
     """
     wrapper to generate guesses and run the psf fitter a few times
+
+    If em_pars has multistart=True, all ntry guesses are run in a single
+    compiled call and the one with the best likelihood is kept, see
+    GMixEM.go_multi.  Otherwise the guesses are tried in turn until a
+    fit succeeds
     """
     def __init__(self, obs, Tguess, ngauss, em_pars, rng=None):
 
@@ -2087,6 +2166,8 @@ class EMRunner(object):
         self.sigma_guess = sqrt(Tguess/2)
         self.set_obs(obs)
 
+        em_pars=dict(em_pars)
+        self.multistart=em_pars.pop('multistart', False)
         self.em_pars=em_pars
         self.set_rng(rng)
 
@@ -2105,6 +2186,16 @@ class EMRunner(object):
     def go(self, ntry=1):
 
         fitter=GMixEM(self.obs)
+
+        if self.multistart:
+            guesses=[self.get_guess() for i in xrange(ntry)]
+            fitter.go_multi(guesses, self.sky, **self.em_pars)
+
+            res=fitter.get_result()
+            res['ntry'] = ntry
+            self.fitter=fitter
+            return
+
         for i in xrange(ntry):
             guess=self.get_guess()
 
@@ -21,10 +21,18 @@ from .jacobian import Jacobian, UnitJacobian
 
 from .observation import Observation
 
-from .em_nb import em_run
-
-EM_RANGE_ERROR = 2**0
-EM_MAXITER = 2**1
+from .em_nb import (
+    em_run_soa,
+    em_run_parallel,
+    em_run_multi,
+    em_run_multi_batch,
+    em_run_squarem,
+    em_run_fixpsf,
+    EM_RANGE_ERROR,
+    EM_MAXITER,
+)
+from .parallel import use_parallel
+from .pixels import make_pixels_soa
 
 def fit_em(obs, guess, **keys):
     """
@@ -37,6 +45,54 @@ def fit_em(obs, guess, **keys):
 
     return fitter
 
+def fit_em_fixpsf(obs, guess, psf=None, **keys):
+    """
+    fit the observation with EM, deconvolving the psf
+    """
+    im,sky = prep_image(obs.image)
+    newobs = Observation(im, jacobian=obs.jacobian)
+    if psf is None:
+        psf = obs.get_psf_gmix()
+
+    fitter=GMixEMFixedPSF(newobs, psf)
+    fitter.go(guess, sky, **keys)
+
+    return fitter
+
+def fit_em_batch(images, guesses, jacobian=None, **keys):
+    """
+    fit a stack of images with EM, e.g. a set of psf stamps, in a single
+    compiled call.  Each image is prepared using prep_image
+
+    parameters
+    ----------
+    images: array
+        [nobj, nrow, ncol] stack of images
+    guesses: list
+        A GMix or a list of GMix starting guesses for each image
+    jacobian: Jacobian or list of Jacobian, optional
+        See GMixEMBatch
+    **keys:
+        Sent to GMixEMBatch.go
+
+    returns
+    -------
+    GMixEMBatch fitter
+    """
+    images = numpy.array(images, dtype='f8', copy=True)
+    if images.ndim != 3:
+        raise ValueError("images must be [nobj, nrow, ncol], got "
+                         "shape %s" % str(images.shape))
+
+    skys = numpy.zeros(images.shape[0])
+    for i in xrange(images.shape[0]):
+        images[i], skys[i] = prep_image(images[i])
+
+    fitter=GMixEMBatch(images, jacobian=jacobian)
+    fitter.go(guesses, skys, **keys)
+
+    return fitter
+
 def prep_image(im0):
     """
     Prep an image to fit with EM.  Make sure there are no pixels < 0
@@ -109,10 +165,15 @@ class GMixEM(object):
             im *= (counts/im.sum())
         return im
 
-    def go(self, gmix_guess, sky_guess, maxiter=100, tol=1.e-6):
+    def go(self, gmix_guess, sky_guess, maxiter=100, tol=1.e-6, parallel=None,
+           accelerate=False):
         """
         Run the em algorithm from the input starting guesses
 
+        The result has the number of iterations numiter and the number of
+        passes over the pixels npass.  These are equal unless accelerate
+        is set
+
         parameters
         ----------
         gmix_guess: GMix
@@ -121,10 +182,19 @@ class GMixEM(object):
         sky_guess: number
             A guess at the sky value
         maxiter: number, optional
-            The maximum number of iterations, default 100
+            The maximum number of iterations, default 100.  With
+            accelerate=True this limits the number of passes over
+            the pixels
         tol: number, optional
             The tolerance in the moments that implies convergence,
             default 1.e-6
+        parallel: bool, optional
+            Use the parallel kernel for large images.  Default is
+            the global setting, see ngmix.parallel.  Not used when
+            accelerate is set
+        accelerate: bool, optional
+            Use SQUAREM extrapolation to speed convergence, see
+            em_nb.em_run_squarem.  Default False
         """
 
         if hasattr(self,'_gm'):
@@ -140,26 +210,44 @@ class GMixEM(object):
         gm = gmix_guess.copy()
         sums = self._make_sums(len(gm))
 
+        if accelerate:
+            pixels=self._obs.pixels_soa
+        elif use_parallel(self._obs.pixels.size, parallel):
+            run_func=em_run_parallel
+            pixels=self._obs.pixels
+        else:
+            run_func=em_run_soa
+            pixels=self._obs.pixels_soa
+
         flags=0
         try:
-            numiter, fdiff = em_run(
-                conf,
-                self._obs.pixels,
-                sums,
-                gm.get_data(),
-            )
+            if accelerate:
+                numiter, fdiff, npass = em_run_squarem(
+                    conf,
+                    pixels,
+                    gm.get_data(),
+                )
+            else:
+                numiter, fdiff = run_func(
+                    conf,
+                    pixels,
+                    sums,
+                    gm.get_data(),
+                )
+                npass = numiter
 
             # we have mutated the _data elements, we want to make
             # sure the pars are propagated.  Make a new full gm
             pars=gm.get_full_pars()
             self._gm=GMix(pars=pars)
 
-            if numiter >= maxiter:
+            if npass >= maxiter:
                 flags = EM_MAXITER
 
             result={
                 'flags':flags,
                 'numiter':numiter,
+                'npass':npass,
                 'fdiff':fdiff,
                 'message':'OK',
             }
@@ -177,6 +265,49 @@ class GMixEM(object):
 
     run_em=go
 
+    def go_multi(self, gmix_guesses, sky_guess, maxiter=100, tol=1.e-6):
+        """
+        Run the em algorithm from several starting guesses in a single
+        compiled call, keeping the solution with the best likelihood
+
+        The starts are iterated together, so each pixel is read once per
+        iteration for all starts.  Starts that converge are preferred
+        over those that reach maxiter.  The result has the flags,
+        numiter, fdiff and loglike for the chosen start, its index
+        istart, and the number of starts nstart
+
+        parameters
+        ----------
+        gmix_guesses: list of GMix
+            Starting guesses, all with the same number of gaussians
+        sky_guess: number
+            A guess at the sky value
+        maxiter: number, optional
+            The maximum number of iterations, default 100
+        tol: number, optional
+            The tolerance in the moments that implies convergence,
+            default 1.e-6
+        """
+
+        conf=self._make_conf()
+        conf['tol'] = tol
+        conf['maxiter'] = maxiter
+        conf['sky_guess'] = sky_guess
+        conf['counts'] = self._counts
+        conf['pixel_scale'] = self._obs.jacobian.get_scale()
+
+        gmixes = _get_guess_array(gmix_guesses)
+        results = numpy.zeros(gmixes.shape[0], dtype=_em_result_dtype)
+
+        em_run_multi(
+            conf,
+            self._obs.pixels_soa,
+            gmixes,
+            results,
+        )
+
+        self._gm, self._result = _get_best_multi(gmixes, results)
+
     def _make_sums(self, ngauss):
         """
         make the sum structure
@@ -191,6 +322,365 @@ class GMixEM(object):
         return conf_arr[0]
 
 
+class GMixEMFixedPSF(GMixEM):
+    """
+    Fit an image with a gaussian mixture convolved with a fixed psf using
+    the EM algorithm.  The fitted mixture is the pre-psf mixture
+
+    parameters
+    ----------
+    obs: Observation
+        An Observation object, containing the image and possibly
+        non-trivial jacobian.  see ngmix.observation.Observation
+
+        The image should not have zero or negative pixels. You can
+        use the prep_image() function to ensure this.
+    psf: GMix, optional
+        The psf.  If not sent, the gmix of the observation's psf is used
+    """
+    def __init__(self, obs, psf=None):
+        super(GMixEMFixedPSF,self).__init__(obs)
+
+        if psf is None:
+            psf=obs.get_psf_gmix()
+        else:
+            psf=psf.copy()
+
+        self._psf=psf
+
+    def get_convolved_gmix(self):
+        """
+        Get the gaussian mixture from the final iteration, convolved with
+        the psf
+        """
+        return self._gm.convolve(self._psf)
+
+    def make_image(self, counts=None):
+        """
+        Get an image of the best fit mixture, convolved with the psf
+        """
+        gm=self.get_convolved_gmix()
+        im=gm.make_image(self._obs.image.shape,
+                         jacobian=self._obs.jacobian)
+        if counts is not None:
+            im *= (counts/im.sum())
+        return im
+
+    def go(self, gmix_guess, sky_guess, maxiter=100, tol=1.e-6, parallel=None,
+           accelerate=False):
+        """
+        Run the em algorithm from the input starting guesses
+
+        parameters
+        ----------
+        gmix_guess: GMix
+            A gaussian mixture (GMix or child class) representing
+            a starting guess for the pre-psf mixture
+        sky_guess: number
+            A guess at the sky value
+        maxiter: number, optional
+            The maximum number of iterations, default 100
+        tol: number, optional
+            The tolerance in the moments that implies convergence,
+            default 1.e-6
+        parallel: bool, optional
+            There is no parallel kernel for a fixed psf, so the global
+            setting is not used and parallel=True raises ValueError
+        accelerate: bool, optional
+            Not supported for a fixed psf, accelerate=True raises
+            ValueError
+        """
+
+        if parallel:
+            raise ValueError("parallel is not supported with a fixed psf")
+        if accelerate:
+            raise ValueError("accelerate is not supported with a fixed psf")
+
+        if hasattr(self,'_gm'):
+            del self._gm
+
+        conf=self._make_fixpsf_conf(sky_guess, maxiter, tol)
+
+        gm = gmix_guess.copy()
+        conv = GMix(ngauss=len(gm)*len(self._psf))
+
+        flags=0
+        try:
+            numiter, fdiff, loglike = em_run_fixpsf(
+                conf,
+                self._obs.pixels_soa,
+                self._psf.get_data(),
+                gm.get_data(),
+                conv.get_data(),
+            )
+
+            pars=gm.get_full_pars()
+            self._gm=GMix(pars=pars)
+
+            if numiter >= maxiter:
+                flags = EM_MAXITER
+
+            result={
+                'flags':flags,
+                'numiter':numiter,
+                'npass':numiter,
+                'fdiff':fdiff,
+                'loglike':loglike,
+                'message':'OK',
+            }
+
+        except (GMixRangeError,ZeroDivisionError) as err:
+            # most likely the algorithm reached an invalid gaussian
+            message = str(err)
+            print(message)
+            result={
+                'flags':EM_RANGE_ERROR,
+                'message': message,
+            }
+
+        self._result = result
+
+    run_em=go
+
+    def go_multi(self, gmix_guesses, sky_guess, maxiter=100, tol=1.e-6):
+        """
+        Run the em algorithm from several starting guesses, keeping the
+        solution with the best likelihood
+
+        The starts are run one after the other.  As for GMixEM.go_multi,
+        starts that converge are preferred over those that reach maxiter,
+        and the result has the flags, numiter, fdiff and loglike for the
+        chosen start, its index istart, and the number of starts nstart
+
+        parameters
+        ----------
+        gmix_guesses: list of GMix
+            Starting guesses for the pre-psf mixture, all with the same
+            number of gaussians
+        sky_guess: number
+            A guess at the sky value
+        maxiter: number, optional
+            The maximum number of iterations, default 100
+        tol: number, optional
+            The tolerance in the moments that implies convergence,
+            default 1.e-6
+        """
+
+        conf=self._make_fixpsf_conf(sky_guess, maxiter, tol)
+
+        gmixes = _get_guess_array(gmix_guesses)
+        results = numpy.zeros(gmixes.shape[0], dtype=_em_result_dtype)
+
+        pixels = self._obs.pixels_soa
+        psf = self._psf.get_data()
+        conv = GMix(ngauss=gmixes.shape[1]*len(self._psf))
+
+        for istart in xrange(gmixes.shape[0]):
+            res = results[istart]
+            try:
+                numiter, fdiff, loglike = em_run_fixpsf(
+                    conf,
+                    pixels,
+                    psf,
+                    gmixes[istart],
+                    conv.get_data(),
+                )
+
+                res['numiter'] = numiter
+                res['fdiff'] = fdiff
+                res['loglike'] = loglike
+                if numiter >= maxiter:
+                    res['flags'] = EM_MAXITER
+
+            except (GMixRangeError,ZeroDivisionError):
+                res['flags'] = EM_RANGE_ERROR
+                res['loglike'] = -9999.0e9
+
+        self._gm, self._result = _get_best_multi(gmixes, results)
+
+    def _make_fixpsf_conf(self, sky_guess, maxiter, tol):
+        """
+        make the configuration for em_run_fixpsf
+        """
+        conf=self._make_conf()
+        conf['tol'] = tol
+        conf['maxiter'] = maxiter
+        conf['sky_guess'] = sky_guess
+        conf['counts'] = self._counts
+        conf['pixel_scale'] = self._obs.jacobian.get_scale()
+        return conf
+
+
+class GMixEMBatch(object):
+    """
+    Fit a stack of images with gaussian mixtures using the EM algorithm,
+    e.g. a set of psf stamps, in a single compiled call.  The images are
+    processed in parallel, each from one or more starting guesses as for
+    GMixEM.go_multi
+
+    parameters
+    ----------
+    images: array
+        [nobj, nrow, ncol] stack of images.  The images should not have
+        zero or negative pixels. You can use the prep_image() function to
+        ensure this, or use fit_em_batch
+    jacobian: Jacobian or list of Jacobian, optional
+        A single jacobian for all images or one per image.  Default is a
+        unit jacobian centered in the image
+    """
+    def __init__(self, images, jacobian=None):
+
+        images=numpy.asarray(images, dtype='f8')
+        if images.ndim != 3:
+            raise ValueError("images must be [nobj, nrow, ncol], got "
+                             "shape %s" % str(images.shape))
+
+        nobj, nrow, ncol = images.shape
+
+        if jacobian is None:
+            jacobian=UnitJacobian(row=(nrow-1.0)/2.0, col=(ncol-1.0)/2.0)
+
+        if isinstance(jacobian, Jacobian):
+            jacobians=[jacobian]*nobj
+        else:
+            jacobians=list(jacobian)
+            if len(jacobians) != nobj:
+                raise ValueError("expected %d jacobians, "
+                                 "got %d" % (nobj, len(jacobians)))
+
+        weight=numpy.ones( (nrow, ncol) )
+        self._pixels=numpy.zeros( (nobj, 4, nrow*ncol) )
+        self._confs=numpy.zeros(nobj, dtype=_em_conf_dtype)
+        for i in xrange(nobj):
+            self._pixels[i] = make_pixels_soa(images[i], weight, jacobians[i])
+            self._confs['pixel_scale'][i] = jacobians[i].get_scale()
+
+        self._confs['counts'] = images.sum(axis=(1,2))
+        self._nobj = nobj
+
+        self._gmix_list = None
+        self._result_list = None
+
+    def get_gmix_list(self):
+        """
+        Get the list of fitted mixtures, with None for failed fits
+        """
+        return self._gmix_list
+
+    def get_result_list(self):
+        """
+        Get the list of result dicts, see GMixEM.go_multi
+        """
+        return self._result_list
+
+    def go(self, gmix_guesses, sky_guesses, maxiter=100, tol=1.e-6):
+        """
+        Run the em algorithm for all images
+
+        parameters
+        ----------
+        gmix_guesses: list
+            For each image a GMix or a list of GMix starting guesses.  All
+            must have the same number of gaussians, and each image the
+            same number of starts
+        sky_guesses: number or array
+            Guess at the sky value, a scalar or one per image
+        maxiter: number, optional
+            The maximum number of iterations, default 100
+        tol: number, optional
+            The tolerance in the moments that implies convergence,
+            default 1.e-6
+        """
+
+        nobj = self._nobj
+        if len(gmix_guesses) != nobj:
+            raise ValueError("expected guesses for %d images, "
+                             "got %d" % (nobj, len(gmix_guesses)))
+
+        guess_arrays = [_get_guess_array(g) for g in gmix_guesses]
+        shapes = set([g.shape for g in guess_arrays])
+        if len(shapes) > 1:
+            raise ValueError("all images must have the same number of "
+                             "starts and gaussians, got %s" % sorted(shapes))
+
+        gmixes = numpy.array(guess_arrays)
+        results = numpy.zeros(gmixes.shape[0:2], dtype=_em_result_dtype)
+
+        confs = self._confs
+        if numpy.any(confs['counts'] <= 0.0):
+            raise GMixRangeError("images must have positive counts")
+
+        confs['tol'] = tol
+        confs['maxiter'] = maxiter
+        confs['sky_guess'] = sky_guesses
+
+        em_run_multi_batch(
+            confs,
+            self._pixels,
+            gmixes,
+            results,
+        )
+
+        self._gmix_list = []
+        self._result_list = []
+        for i in xrange(nobj):
+            gm, res = _get_best_multi(gmixes[i], results[i])
+            self._gmix_list.append(gm)
+            self._result_list.append(res)
+
+def _get_guess_array(gmix_guesses):
+    """
+    get an [nstart, ngauss] array holding copies of the guesses
+    """
+    if isinstance(gmix_guesses, GMix):
+        gmix_guesses = [gmix_guesses]
+
+    sizes = set([len(g) for g in gmix_guesses])
+    if len(sizes) != 1:
+        raise ValueError("all guesses must have the same "
+                         "number of gaussians, got %s" % sorted(sizes))
+
+    return numpy.vstack([g.get_data() for g in gmix_guesses])
+
+def _get_best_multi(gmixes, results):
+    """
+    choose the start with the best likelihood, preferring those that
+    converged over those that reached maxiter
+
+    returns
+    -------
+    gmix, result: gmix is None if all starts failed
+    """
+
+    nstart = results.size
+    for flags in [0, EM_MAXITER]:
+        w, = numpy.where(results['flags'] == flags)
+        if w.size > 0:
+            istart = w[results['loglike'][w].argmax()]
+            res = results[istart]
+            result = {
+                'flags': flags,
+                'numiter': int(res['numiter']),
+                'npass': int(res['numiter']),
+                'fdiff': float(res['fdiff']),
+                'loglike': float(res['loglike']),
+                'istart': int(istart),
+                'nstart': nstart,
+                'message': 'OK',
+            }
+
+            pars = gmixes[istart]
+            gm = GMix(ngauss=pars.size)
+            gm.get_data()[:] = pars
+            return gm, result
+
+    result = {
+        'flags': EM_RANGE_ERROR,
+        'nstart': nstart,
+        'message': 'all starts reached an invalid mixture',
+    }
+    return None, result
+
 
 _sums_dtype=[
     ('gi','f8'),
@@ -221,6 +711,14 @@ _em_conf_dtype=[
 ]
 _em_conf_dtype=numpy.dtype(_em_conf_dtype,align=True)
 
+_em_result_dtype=[
+    ('flags','i4'),
+    ('numiter','i4'),
+    ('fdiff','f8'),
+    ('loglike','f8'),
+]
+_em_result_dtype=numpy.dtype(_em_result_dtype,align=True)
+
 def test_1gauss(counts=1.0,
                 noise=0.0,
                 T=4.0,
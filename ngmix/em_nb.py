@@ -1,4 +1,5 @@
-from numba import njit
+import numpy
+from numba import njit, prange
 
 try:
     xrange
@@ -7,12 +8,24 @@ except NameError:
 
 from .gexceptions import GMixRangeError
 from .gmix_nb import (
+    GMIX_LOW_DETVAL,
     gauss2d_set,
     gmix_set_norms,
     gauss2d_set_norm,
     gmix_get_e1e2T,
+    gmix_convolve_fill,
 )
 from .fastexp_nb import exp3
+from .parallel import PIXEL_BLOCKSIZE
+from .pixels import PIXELS_SOA_V, PIXELS_SOA_U, PIXELS_SOA_VAL
+
+EM_RANGE_ERROR = 2**0
+EM_MAXITER = 2**1
+
+# SQUAREM steps are backtracked until |alpha| falls below this value.  The
+# maximum |alpha| starts at one and is changed by the given factor
+SQUAREM_MIN_ALPHA = 1.1
+SQUAREM_STEP_FACTOR = 4.0
 
 @njit
 def em_run(conf, pixels, sums, gmix):
@@ -86,6 +99,1139 @@ def em_run(conf, pixels, sums, gmix):
     numiter=i+1
     return numiter, frac_diff
 
+@njit
+def em_run_soa(conf, pixels, sums, gmix):
+    """
+    run the EM algorithm, with pixels in the structure-of-arrays layout
+
+    The loops over gaussians are outside the loops over pixels, so the inner
+    loops work on contiguous arrays and can be vectorized
+
+    parameters
+    ----------
+    conf: array
+        Should have fields
+
+            sky_guess: guess for the sky
+            counts: counts in the image
+            tol: tolerance for stopping
+            maxiter: maximum number of iterations
+            pixel_scale: pixel scale
+
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    gmix: gaussian mixture
+        Initialized to the starting guess
+    """
+
+    gmix_set_norms(gmix)
+    tol=conf['tol']
+    counts=conf['counts']
+
+    v    = pixels[PIXELS_SOA_V]
+    u    = pixels[PIXELS_SOA_U]
+    vals = pixels[PIXELS_SOA_VAL]
+
+    n_pixels = v.size
+    n_gauss  = gmix.size
+
+    area = n_pixels*conf['pixel_scale']*conf['pixel_scale']
+
+    nsky = conf['sky_guess']/counts
+    psky = conf['sky_guess']/(counts/area)
+
+    # value of each gaussian in each pixel, and the ratio
+    # imnorm/gtot for each pixel
+    gvals = numpy.zeros( (n_gauss, n_pixels) )
+    igrat = numpy.zeros(n_pixels)
+
+    T_last = e1_last = e2_last = -9999.0
+
+    for i in xrange(conf['maxiter']):
+        clear_sums(sums)
+
+        igrat[:] = 0.0
+        for igauss in xrange(n_gauss):
+            gauss = gmix[igauss]
+            gi_vals = gvals[igauss]
+
+            row   = gauss['row']
+            col   = gauss['col']
+            dcc   = gauss['dcc']
+            drr   = gauss['drr']
+            drc2  = 2.0*gauss['drc']
+            pnorm = gauss['pnorm']
+
+            for ipixel in xrange(n_pixels):
+                vdiff = v[ipixel]-row
+                udiff = u[ipixel]-col
+
+                chi2 = (dcc*(vdiff*vdiff) + drr*(udiff*udiff)
+                        - drc2*(udiff*vdiff))
+
+                if chi2 < 25.0 and chi2 >= 0.0:
+                    gi = pnorm*exp3( -0.5*chi2 )
+                else:
+                    gi = 0.0
+
+                gi_vals[ipixel] = gi
+                igrat[ipixel] += gi
+
+        skysum=0.0
+        for ipixel in xrange(n_pixels):
+            gtot = igrat[ipixel] + nsky
+            if gtot==0.0:
+                raise GMixRangeError("gtot == 0")
+
+            imnorm = vals[ipixel]/counts
+            skysum += nsky*imnorm/gtot
+            igrat[ipixel] = imnorm/gtot
+
+        for igauss in xrange(n_gauss):
+            gauss = gmix[igauss]
+            gi_vals = gvals[igauss]
+
+            row = gauss['row']
+            col = gauss['col']
+
+            pnew = rowsum = colsum = u2sum = uvsum = v2sum = 0.0
+            for ipixel in xrange(n_pixels):
+                gi = gi_vals[ipixel]
+                pigrat = igrat[ipixel]
+
+                vdiff = v[ipixel]-row
+                udiff = u[ipixel]-col
+
+                pnew   += gi*pigrat
+                rowsum += (v[ipixel]*gi)*pigrat
+                colsum += (u[ipixel]*gi)*pigrat
+                u2sum  += (udiff*udiff*gi)*pigrat
+                uvsum  += (udiff*vdiff*gi)*pigrat
+                v2sum  += (vdiff*vdiff*gi)*pigrat
+
+            tsums = sums[igauss]
+            tsums['pnew']   = pnew
+            tsums['rowsum'] = rowsum
+            tsums['colsum'] = colsum
+            tsums['u2sum']  = u2sum
+            tsums['uvsum']  = uvsum
+            tsums['v2sum']  = v2sum
+
+        gmix_set_from_sums(gmix, sums)
+
+        psky = skysum
+        nsky = psky/area
+
+        e1,e2,T=gmix_get_e1e2T(gmix)
+
+        frac_diff = abs((T-T_last)/T)
+        e1diff    = abs(e1-e1_last)
+        e2diff    = abs(e2-e2_last)
+
+        if ( frac_diff < tol and e1diff < tol and e2diff < tol ):
+            break
+
+        T_last, e1_last, e2_last = T, e1, e2
+
+    numiter=i+1
+    return numiter, frac_diff
+
+@njit
+def em_run_squarem(conf, pixels, gmix):
+    """
+    run the EM algorithm with SQUAREM acceleration, with pixels in the
+    structure-of-arrays layout
+
+    Each cycle takes two EM steps from the current parameters and
+    extrapolates along the change, using the SqS3 step length alpha of
+    Varadhan & Roland (2008).  The extrapolated mixture is stabilized with
+    one more EM step, and is only kept if all gaussians are positive
+    definite with positive flux, and its likelihood is not below that
+    after the first EM step.  Otherwise the step is backtracked,
+    alpha -> (alpha-1)/2, toward the result of the two plain EM steps,
+    which is kept if no extrapolation is accepted.  As in the SQUAREM
+    package, |alpha| is limited to a maximum that starts at one, and is
+    multiplied by SQUAREM_STEP_FACTOR when the limit is reached and
+    divided by it when a step is backtracked
+
+    As for plain EM, convergence is tested on the change made by a single
+    EM step, here each of the plain steps, the first of which starts from
+    the stabilized mixture.  The steps use the exact exponential, see
+    em_step_soa
+
+    parameters
+    ----------
+    conf: array
+        Should have fields
+
+            sky_guess: guess for the sky
+            counts: counts in the image
+            tol: tolerance for stopping
+            maxiter: maximum number of passes over the pixels
+            pixel_scale: pixel scale
+
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    gmix: gaussian mixture
+        Initialized to the starting guess
+
+    returns
+    -------
+    numiter, frac_diff, npass: the number of cycles, the last fractional
+    change in T, and the number of passes over the pixels
+    """
+
+    tol=conf['tol']
+    counts=conf['counts']
+    maxiter=conf['maxiter']
+
+    n_pixels = pixels.shape[1]
+    n_gauss  = gmix.size
+    npars = 6*n_gauss + 1
+
+    area = n_pixels*conf['pixel_scale']*conf['pixel_scale']
+
+    if not gmix_check_norms(gmix):
+        raise GMixRangeError("invalid starting mixture")
+
+    sums = numpy.zeros( (n_gauss, 6) )
+    gvals = numpy.zeros( (n_gauss, n_pixels) )
+    igrat = numpy.zeros(n_pixels)
+
+    theta0 = numpy.zeros(npars)
+    theta1 = numpy.zeros(npars)
+    theta2 = numpy.zeros(npars)
+    thetap = numpy.zeros(npars)
+    work = gmix.copy()
+
+    # T, e1, e2 before the last EM step
+    last = numpy.zeros(3)
+
+    nsky = conf['sky_guess']/counts
+
+    frac_diff = 9999.0
+    step_max = 1.0
+
+    numiter = 0
+    npass = 0
+    while npass < maxiter:
+        numiter += 1
+
+        em_pack_pars(gmix, nsky, theta0)
+
+        em_set_e1e2T(gmix, last)
+        nsky, loglike0, ok = em_step_soa(
+            pixels, counts, area, gmix, nsky, sums, gvals, igrat,
+        )
+        npass += 1
+        if not ok:
+            raise GMixRangeError("invalid mixture")
+        em_pack_pars(gmix, nsky, theta1)
+
+        converged, frac_diff = em_check_converged(gmix, last, tol)
+        if converged or npass >= maxiter:
+            break
+
+        em_set_e1e2T(gmix, last)
+        nsky, loglike1, ok = em_step_soa(
+            pixels, counts, area, gmix, nsky, sums, gvals, igrat,
+        )
+        npass += 1
+        if not ok:
+            raise GMixRangeError("invalid mixture")
+        em_pack_pars(gmix, nsky, theta2)
+
+        converged, frac_diff = em_check_converged(gmix, last, tol)
+        if converged:
+            break
+
+        rnorm2 = 0.0
+        vnorm2 = 0.0
+        for ipar in xrange(npars):
+            r = theta1[ipar] - theta0[ipar]
+            v = theta2[ipar] - 2.0*theta1[ipar] + theta0[ipar]
+            rnorm2 += r*r
+            vnorm2 += v*v
+
+        if vnorm2 > 0.0:
+            alpha = -numpy.sqrt(rnorm2/vnorm2)
+        else:
+            alpha = -1.0
+
+        if alpha <= -step_max:
+            alpha = -step_max
+            at_max = True
+        else:
+            at_max = False
+
+        # alpha = -1 gives theta2, so only extrapolate further than that.
+        # Each try costs a pass, so stop backtracking once the step is
+        # close to the plain EM result
+        ntry = 0
+        accepted = False
+        while alpha < -SQUAREM_MIN_ALPHA and npass < maxiter:
+            ntry += 1
+            for ipar in xrange(npars):
+                r = theta1[ipar] - theta0[ipar]
+                v = theta2[ipar] - 2.0*theta1[ipar] + theta0[ipar]
+                thetap[ipar] = theta0[ipar] - 2.0*alpha*r + alpha*alpha*v
+
+            nskyp = thetap[npars-1]
+            if nskyp >= 0.0 and em_unpack_pars(thetap, work):
+                nskyp, loglikep, ok = em_step_soa(
+                    pixels, counts, area, work, nskyp, sums, gvals, igrat,
+                )
+                npass += 1
+
+                if ok and loglikep >= loglike1:
+                    em_pack_pars(work, nskyp, thetap)
+                    em_unpack_pars(thetap, gmix)
+                    nsky = nskyp
+                    accepted = True
+                    break
+
+            alpha = 0.5*(alpha-1.0)
+
+        if ntry > 1 or (ntry == 1 and not accepted):
+            step_max = max(1.0, step_max/SQUAREM_STEP_FACTOR)
+        elif at_max:
+            step_max *= SQUAREM_STEP_FACTOR
+
+    return numiter, frac_diff, npass
+
+@njit
+def em_set_e1e2T(gmix, last):
+    """
+    store T, e1, e2 for the mixture, for use in em_check_converged
+    """
+    e1,e2,T=gmix_get_e1e2T(gmix)
+    last[0] = T
+    last[1] = e1
+    last[2] = e2
+
+@njit
+def em_check_converged(gmix, last, tol):
+    """
+    check if the changes in T, e1 and e2 since em_set_e1e2T was called
+    are all below the tolerance
+
+    returns
+    -------
+    converged, frac_diff
+    """
+    e1,e2,T=gmix_get_e1e2T(gmix)
+
+    frac_diff = abs((T-last[0])/T)
+    e1diff    = abs(e1-last[1])
+    e2diff    = abs(e2-last[2])
+
+    converged = frac_diff < tol and e1diff < tol and e2diff < tol
+    return converged, frac_diff
+
+@njit
+def em_run_fixpsf(conf, pixels, psf, gmix, conv):
+    """
+    run the EM algorithm for a mixture convolved with a fixed psf, with
+    pixels in the structure-of-arrays layout
+
+    The sums follow extreme deconvolution (Bovy, Hogg & Roweis 2011): each
+    pixel is assigned to the convolved gaussians, and the expected
+    position and covariance of the pre-psf gaussian given the pixel are
+    summed to update the unconvolved mixture
+
+    parameters
+    ----------
+    conf: array
+        Should have fields
+
+            sky_guess: guess for the sky
+            counts: counts in the image
+            tol: tolerance for stopping
+            maxiter: maximum number of iterations
+            pixel_scale: pixel scale
+
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    psf: gaussian mixture
+        The psf
+    gmix: gaussian mixture
+        The unconvolved mixture, initialized to the starting guess
+    conv: gaussian mixture
+        Holds the convolved mixture, ngauss*npsf gaussians
+
+    returns
+    -------
+    numiter, frac_diff, loglike: the number of cycles, the last fractional
+    change in T, and the log likelihood of the mixture used for the final
+    cycle
+    """
+
+    tol=conf['tol']
+    counts=conf['counts']
+
+    v    = pixels[PIXELS_SOA_V]
+    u    = pixels[PIXELS_SOA_U]
+    vals = pixels[PIXELS_SOA_VAL]
+
+    n_pixels = v.size
+    n_gauss  = gmix.size
+    n_psf    = psf.size
+    n_conv   = conv.size
+
+    area = n_pixels*conf['pixel_scale']*conf['pixel_scale']
+
+    nsky = conf['sky_guess']/counts
+
+    gvals = numpy.zeros( (n_conv, n_pixels) )
+    igrat = numpy.zeros(n_pixels)
+
+    # C T^{-1} and C - C T^{-1} C for each convolved gaussian, where C is
+    # the covariance of the unconvolved gaussian and T that of the
+    # convolved gaussian
+    amat = numpy.zeros( (n_conv, 4) )
+    bmat = numpy.zeros( (n_conv, 3) )
+
+    # W, sum W bv, sum W bu, sum W bv^2, sum W bv bu, sum W bu^2
+    csums = numpy.zeros( (n_conv, 6) )
+
+    T_last = e1_last = e2_last = -9999.0
+
+    for i in xrange(conf['maxiter']):
+
+        gmix_convolve_fill(conv, gmix, psf)
+        gmix_set_norms(conv)
+
+        for igauss in xrange(n_gauss):
+            gauss = gmix[igauss]
+            irr = gauss['irr']
+            irc = gauss['irc']
+            icc = gauss['icc']
+
+            for ipsf in xrange(n_psf):
+                iconv = igauss*n_psf + ipsf
+                cgauss = conv[iconv]
+
+                # inverse of T is [[dcc, -drc], [-drc, drr]]
+                drr = cgauss['drr']
+                drc = cgauss['drc']
+                dcc = cgauss['dcc']
+
+                a00 = irr*dcc - irc*drc
+                a01 = irc*drr - irr*drc
+                a10 = irc*dcc - icc*drc
+                a11 = icc*drr - irc*drc
+
+                amat[iconv, 0] = a00
+                amat[iconv, 1] = a01
+                amat[iconv, 2] = a10
+                amat[iconv, 3] = a11
+
+                bmat[iconv, 0] = irr - (a00*irr + a01*irc)
+                bmat[iconv, 1] = irc - (a00*irc + a01*icc)
+                bmat[iconv, 2] = icc - (a10*irc + a11*icc)
+
+        igrat[:] = 0.0
+        for iconv in xrange(n_conv):
+            cgauss = conv[iconv]
+            gi_vals = gvals[iconv]
+
+            row   = cgauss['row']
+            col   = cgauss['col']
+            dcc   = cgauss['dcc']
+            drr   = cgauss['drr']
+            drc2  = 2.0*cgauss['drc']
+            pnorm = cgauss['pnorm']
+
+            for ipixel in xrange(n_pixels):
+                vdiff = v[ipixel]-row
+                udiff = u[ipixel]-col
+
+                chi2 = (dcc*(vdiff*vdiff) + drr*(udiff*udiff)
+                        - drc2*(udiff*vdiff))
+
+                if chi2 < 25.0 and chi2 >= 0.0:
+                    gi = pnorm*exp3( -0.5*chi2 )
+                else:
+                    gi = 0.0
+
+                gi_vals[ipixel] = gi
+                igrat[ipixel] += gi
+
+        skysum=0.0
+        loglike=0.0
+        for ipixel in xrange(n_pixels):
+            gtot = igrat[ipixel] + nsky
+            if gtot==0.0:
+                raise GMixRangeError("gtot == 0")
+
+            imnorm = vals[ipixel]/counts
+            skysum += nsky*imnorm/gtot
+            igrat[ipixel] = imnorm/gtot
+            if imnorm > 0.0 and gtot > 0.0:
+                loglike += imnorm*numpy.log(gtot)
+
+        for iconv in xrange(n_conv):
+            cgauss = conv[iconv]
+            gi_vals = gvals[iconv]
+
+            # center of the unconvolved gaussian
+            gauss = gmix[iconv//n_psf]
+            grow = gauss['row']
+            gcol = gauss['col']
+
+            row = cgauss['row']
+            col = cgauss['col']
+
+            a00 = amat[iconv, 0]
+            a01 = amat[iconv, 1]
+            a10 = amat[iconv, 2]
+            a11 = amat[iconv, 3]
+
+            wsum = bvsum = busum = bv2sum = bvusum = bu2sum = 0.0
+            for ipixel in xrange(n_pixels):
+                w = gi_vals[ipixel]*igrat[ipixel]
+
+                vdiff = v[ipixel]-row
+                udiff = u[ipixel]-col
+
+                # expected pre-psf position given this pixel
+                bv = grow + a00*vdiff + a01*udiff
+                bu = gcol + a10*vdiff + a11*udiff
+
+                wsum   += w
+                bvsum  += w*bv
+                busum  += w*bu
+                bv2sum += w*bv*bv
+                bvusum += w*bv*bu
+                bu2sum += w*bu*bu
+
+            csums[iconv, 0] = wsum
+            csums[iconv, 1] = bvsum
+            csums[iconv, 2] = busum
+            csums[iconv, 3] = bv2sum
+            csums[iconv, 4] = bvusum
+            csums[iconv, 5] = bu2sum
+
+        for igauss in xrange(n_gauss):
+            pnew = vsum = usum = v2sum = vusum = u2sum = 0.0
+            brr = brc = bcc = 0.0
+            for ipsf in xrange(n_psf):
+                iconv = igauss*n_psf + ipsf
+                w = csums[iconv, 0]
+
+                pnew  += w
+                vsum  += csums[iconv, 1]
+                usum  += csums[iconv, 2]
+                v2sum += csums[iconv, 3]
+                vusum += csums[iconv, 4]
+                u2sum += csums[iconv, 5]
+
+                brr += w*bmat[iconv, 0]
+                brc += w*bmat[iconv, 1]
+                bcc += w*bmat[iconv, 2]
+
+            if pnew <= 0.0:
+                raise GMixRangeError("p <= 0")
+
+            pinv = 1.0/pnew
+            row = vsum*pinv
+            col = usum*pinv
+
+            gauss2d_set(
+                gmix[igauss],
+                pnew,
+                row,
+                col,
+                (v2sum + brr)*pinv - row*row,
+                (vusum + brc)*pinv - row*col,
+                (u2sum + bcc)*pinv - col*col,
+            )
+
+        gmix_set_norms(gmix)
+
+        psky = skysum
+        nsky = psky/area
+
+        e1,e2,T=gmix_get_e1e2T(gmix)
+
+        frac_diff = abs((T-T_last)/T)
+        e1diff    = abs(e1-e1_last)
+        e2diff    = abs(e2-e2_last)
+
+        if ( frac_diff < tol and e1diff < tol and e2diff < tol ):
+            break
+
+        T_last, e1_last, e2_last = T, e1, e2
+
+    numiter=i+1
+    return numiter, frac_diff, loglike
+
+@njit
+def em_step_soa(pixels, counts, area, gmix, nsky, sums, gvals, igrat):
+    """
+    take one EM step, updating the mixture in place
+
+    The exact exponential is used.  The error of exp3 jumps at integer
+    arguments, which makes the step a slightly discontinuous function of
+    the parameters; this spoils the extrapolation in em_run_squarem near
+    convergence
+
+    parameters
+    ----------
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr
+    counts: float
+        Counts in the image
+    area: float
+        Area of the image
+    gmix: gaussian mixture
+        The current mixture, with norms set
+    nsky: float
+        The current normalized sky
+    sums: array
+        [ngauss, 6] work array
+    gvals: array
+        [ngauss, npixels] work array
+    igrat: array
+        [npixels] work array
+
+    returns
+    -------
+    nsky, loglike, ok: the new normalized sky, the log likelihood of the
+    input mixture, and 0 if the new mixture is invalid
+    """
+
+    v    = pixels[PIXELS_SOA_V]
+    u    = pixels[PIXELS_SOA_U]
+    vals = pixels[PIXELS_SOA_VAL]
+
+    n_pixels = v.size
+    n_gauss  = gmix.size
+
+    igrat[:] = 0.0
+    for igauss in xrange(n_gauss):
+        gauss = gmix[igauss]
+        gi_vals = gvals[igauss]
+
+        row   = gauss['row']
+        col   = gauss['col']
+        dcc   = gauss['dcc']
+        drr   = gauss['drr']
+        drc2  = 2.0*gauss['drc']
+        pnorm = gauss['pnorm']
+
+        for ipixel in xrange(n_pixels):
+            vdiff = v[ipixel]-row
+            udiff = u[ipixel]-col
+
+            chi2 = (dcc*(vdiff*vdiff) + drr*(udiff*udiff)
+                    - drc2*(udiff*vdiff))
+
+            if chi2 < 25.0 and chi2 >= 0.0:
+                gi = pnorm*numpy.exp( -0.5*chi2 )
+            else:
+                gi = 0.0
+
+            gi_vals[ipixel] = gi
+            igrat[ipixel] += gi
+
+    skysum = 0.0
+    loglike = 0.0
+    for ipixel in xrange(n_pixels):
+        gtot = igrat[ipixel] + nsky
+        if gtot <= 0.0:
+            return nsky, loglike, 0
+
+        imnorm = vals[ipixel]/counts
+        skysum += nsky*imnorm/gtot
+        if imnorm > 0.0:
+            loglike += imnorm*numpy.log(gtot)
+        igrat[ipixel] = imnorm/gtot
+
+    for igauss in xrange(n_gauss):
+        gauss = gmix[igauss]
+        gi_vals = gvals[igauss]
+
+        row = gauss['row']
+        col = gauss['col']
+
+        pnew = rowsum = colsum = u2sum = uvsum = v2sum = 0.0
+        for ipixel in xrange(n_pixels):
+            wgi = gi_vals[ipixel]*igrat[ipixel]
+
+            vdiff = v[ipixel]-row
+            udiff = u[ipixel]-col
+
+            pnew   += wgi
+            rowsum += v[ipixel]*wgi
+            colsum += u[ipixel]*wgi
+            u2sum  += udiff*udiff*wgi
+            uvsum  += udiff*vdiff*wgi
+            v2sum  += vdiff*vdiff*wgi
+
+        sums[igauss, 0] = pnew
+        sums[igauss, 1] = rowsum
+        sums[igauss, 2] = colsum
+        sums[igauss, 3] = u2sum
+        sums[igauss, 4] = uvsum
+        sums[igauss, 5] = v2sum
+
+    ok = gmix_set_from_sum_array(gmix, sums)
+
+    return skysum/area, loglike, ok
+
+@njit
+def em_pack_pars(gmix, nsky, theta):
+    """
+    pack p,row,col,irr,irc,icc for each gaussian, then the normalized sky,
+    into a parameter array
+    """
+    for igauss in xrange(gmix.size):
+        gauss = gmix[igauss]
+        beg = 6*igauss
+        theta[beg+0] = gauss['p']
+        theta[beg+1] = gauss['row']
+        theta[beg+2] = gauss['col']
+        theta[beg+3] = gauss['irr']
+        theta[beg+4] = gauss['irc']
+        theta[beg+5] = gauss['icc']
+
+    theta[theta.size-1] = nsky
+
+@njit
+def em_unpack_pars(theta, gmix):
+    """
+    fill the mixture from a parameter array made by em_pack_pars,
+    returning 0 if any gaussian is invalid
+    """
+    for igauss in xrange(gmix.size):
+        beg = 6*igauss
+        gauss2d_set(
+            gmix[igauss],
+            theta[beg+0],
+            theta[beg+1],
+            theta[beg+2],
+            theta[beg+3],
+            theta[beg+4],
+            theta[beg+5],
+        )
+
+    return gmix_check_norms(gmix)
+
+@njit(parallel=True)
+def em_run_parallel(conf, pixels, sums, gmix):
+    """
+    run the EM algorithm, processing blocks of pixels in parallel
+
+    The sums for each block are added in order, so the result does not
+    depend on the number of threads
+
+    parameters
+    ----------
+    conf: array
+        Should have fields
+
+            sky_guess: guess for the sky
+            counts: counts in the image
+            tol: tolerance for stopping
+            maxiter: maximum number of iterations
+            pixel_scale: pixel scale
+
+    pixels: pixel array
+        for the image/jacobian
+    gmix: gaussian mixture
+        Initialized to the starting guess
+    """
+
+    gmix_set_norms(gmix)
+    tol=conf['tol']
+    counts=conf['counts']
+
+    area = pixels.size*conf['pixel_scale']*conf['pixel_scale']
+
+    nsky = conf['sky_guess']/counts
+    psky = conf['sky_guess']/(counts/area)
+
+    T_last = e1_last = e2_last = -9999.0
+
+    n_gauss = gmix.size
+    n_pixels = pixels.size
+    n_blocks = (n_pixels + PIXEL_BLOCKSIZE - 1)//PIXEL_BLOCKSIZE
+
+    # pnew, rowsum, colsum, u2sum, uvsum, v2sum for each block
+    block_sums = numpy.zeros( (n_blocks, n_gauss, 6) )
+    block_scratch = numpy.zeros( (n_blocks, n_gauss, 6) )
+    block_skysum = numpy.zeros(n_blocks)
+    block_ok = numpy.zeros(n_blocks, dtype=numpy.int64)
+
+    for i in xrange(conf['maxiter']):
+
+        for iblock in prange(n_blocks):
+            beg = iblock*PIXEL_BLOCKSIZE
+            end = min(beg + PIXEL_BLOCKSIZE, n_pixels)
+
+            block_skysum[iblock], block_ok[iblock] = do_block_sums(
+                pixels[beg:end],
+                gmix,
+                nsky,
+                counts,
+                block_scratch[iblock],
+                block_sums[iblock],
+            )
+
+        clear_sums(sums)
+        skysum=0.0
+        for iblock in xrange(n_blocks):
+            if block_ok[iblock] == 0:
+                raise GMixRangeError("gtot == 0")
+
+            skysum += block_skysum[iblock]
+
+            bsums = block_sums[iblock]
+            for igauss in xrange(n_gauss):
+                tsums = sums[igauss]
+                tsums['pnew']   += bsums[igauss, 0]
+                tsums['rowsum'] += bsums[igauss, 1]
+                tsums['colsum'] += bsums[igauss, 2]
+                tsums['u2sum']  += bsums[igauss, 3]
+                tsums['uvsum']  += bsums[igauss, 4]
+                tsums['v2sum']  += bsums[igauss, 5]
+
+        gmix_set_from_sums(gmix, sums)
+
+        psky = skysum
+        nsky = psky/area
+
+        e1,e2,T=gmix_get_e1e2T(gmix)
+
+        frac_diff = abs((T-T_last)/T)
+        e1diff    = abs(e1-e1_last)
+        e2diff    = abs(e2-e2_last)
+
+        if ( frac_diff < tol and e1diff < tol and e2diff < tol ):
+            break
+
+        T_last, e1_last, e2_last = T, e1, e2
+
+    numiter=i+1
+    return numiter, frac_diff
+
+@njit
+def em_run_multi(conf, pixels, gmixes, results):
+    """
+    run the EM algorithm from several starting guesses at once, with
+    pixels in the structure-of-arrays layout
+
+    The starts are iterated together, so each pixel is read once per
+    iteration for all starts that are still running.  Starts that
+    converge or reach an invalid mixture drop out.  Errors are recorded
+    in the results rather than raised
+
+    parameters
+    ----------
+    conf: array
+        Should have fields
+
+            sky_guess: guess for the sky
+            counts: counts in the image
+            tol: tolerance for stopping
+            maxiter: maximum number of iterations
+            pixel_scale: pixel scale
+
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    gmixes: gaussian mixtures
+        [nstart, ngauss] array, initialized to the starting guesses
+    results: array
+        [nstart] array with fields flags, numiter, fdiff, loglike.  The
+        log likelihood is that of the image as a density for the mixture
+        plus sky, evaluated in the final iteration
+    """
+
+    tol=conf['tol']
+    counts=conf['counts']
+
+    v    = pixels[PIXELS_SOA_V]
+    u    = pixels[PIXELS_SOA_U]
+    vals = pixels[PIXELS_SOA_VAL]
+
+    n_pixels = v.size
+    n_start, n_gauss = gmixes.shape
+
+    area = n_pixels*conf['pixel_scale']*conf['pixel_scale']
+
+    # pnew, rowsum, colsum, u2sum, uvsum, v2sum for each start
+    sums = numpy.zeros( (n_start, n_gauss, 6) )
+    gvals = numpy.zeros(n_gauss)
+    skysum = numpy.zeros(n_start)
+    loglike = numpy.zeros(n_start)
+    nsky = numpy.zeros(n_start)
+    last = numpy.zeros( (n_start, 3) )
+    running = numpy.zeros(n_start, dtype=numpy.int64)
+
+    nrunning = 0
+    for istart in xrange(n_start):
+        res = results[istart]
+        res['flags'] = 0
+        res['numiter'] = 0
+        res['fdiff'] = 9999.0
+        res['loglike'] = -9999.0e9
+
+        nsky[istart] = conf['sky_guess']/counts
+        last[istart, :] = -9999.0
+
+        if gmix_check_norms(gmixes[istart]):
+            running[istart] = 1
+            nrunning += 1
+        else:
+            res['flags'] = EM_RANGE_ERROR
+
+    for i in xrange(conf['maxiter']):
+        if nrunning == 0:
+            break
+
+        sums[:, :, :] = 0.0
+        skysum[:] = 0.0
+        loglike[:] = 0.0
+
+        for ipixel in xrange(n_pixels):
+            vp = v[ipixel]
+            up = u[ipixel]
+            imnorm = vals[ipixel]/counts
+
+            for istart in xrange(n_start):
+                if running[istart] == 0:
+                    continue
+
+                gmix = gmixes[istart]
+                gtot = 0.0
+                for igauss in xrange(n_gauss):
+                    gauss = gmix[igauss]
+
+                    vdiff = vp-gauss['row']
+                    udiff = up-gauss['col']
+
+                    chi2 = (gauss['dcc']*(vdiff*vdiff)
+                            + gauss['drr']*(udiff*udiff)
+                            - 2.0*gauss['drc']*(udiff*vdiff))
+
+                    if chi2 < 25.0 and chi2 >= 0.0:
+                        gi = gauss['pnorm']*exp3( -0.5*chi2 )
+                    else:
+                        gi = 0.0
+
+                    gvals[igauss] = gi
+                    gtot += gi
+
+                gtot += nsky[istart]
+                if gtot <= 0.0:
+                    running[istart] = 0
+                    nrunning -= 1
+                    results[istart]['flags'] = EM_RANGE_ERROR
+                    continue
+
+                igrat = imnorm/gtot
+                skysum[istart] += nsky[istart]*igrat
+                if imnorm > 0.0:
+                    loglike[istart] += imnorm*numpy.log(gtot)
+
+                ssums = sums[istart]
+                for igauss in xrange(n_gauss):
+                    gauss = gmix[igauss]
+                    wgi = gvals[igauss]*igrat
+
+                    vdiff = vp-gauss['row']
+                    udiff = up-gauss['col']
+
+                    ssums[igauss, 0] += wgi
+                    ssums[igauss, 1] += vp*wgi
+                    ssums[igauss, 2] += up*wgi
+                    ssums[igauss, 3] += udiff*udiff*wgi
+                    ssums[igauss, 4] += udiff*vdiff*wgi
+                    ssums[igauss, 5] += vdiff*vdiff*wgi
+
+        for istart in xrange(n_start):
+            if running[istart] == 0:
+                continue
+
+            res = results[istart]
+            res['numiter'] = i+1
+            res['loglike'] = loglike[istart]
+
+            gmix = gmixes[istart]
+            if not gmix_set_from_sum_array(gmix, sums[istart]):
+                running[istart] = 0
+                nrunning -= 1
+                res['flags'] = EM_RANGE_ERROR
+                continue
+
+            nsky[istart] = skysum[istart]/area
+
+            e1,e2,T=gmix_get_e1e2T(gmix)
+
+            slast = last[istart]
+            frac_diff = abs((T-slast[2])/T)
+            e1diff    = abs(e1-slast[0])
+            e2diff    = abs(e2-slast[1])
+
+            res['fdiff'] = frac_diff
+
+            if ( frac_diff < tol and e1diff < tol and e2diff < tol ):
+                running[istart] = 0
+                nrunning -= 1
+            else:
+                slast[0] = e1
+                slast[1] = e2
+                slast[2] = T
+
+    for istart in xrange(n_start):
+        if running[istart] == 1:
+            results[istart]['flags'] = EM_MAXITER
+
+@njit(parallel=True)
+def em_run_multi_batch(confs, pixels, gmixes, results):
+    """
+    run em_run_multi for a stack of images with the same number of pixels,
+    processing the images in parallel
+
+    parameters
+    ----------
+    confs: array
+        [nobj] array of em configurations, see em_run_multi
+    pixels: array
+        [nobj, 4, npixels] array of pixels in the structure-of-arrays layout
+    gmixes: gaussian mixtures
+        [nobj, nstart, ngauss] array, initialized to the starting guesses
+    results: array
+        [nobj, nstart] array of results, see em_run_multi
+    """
+
+    for iobj in prange(pixels.shape[0]):
+        em_run_multi(confs[iobj], pixels[iobj], gmixes[iobj], results[iobj])
+
+@njit
+def gmix_check_norms(gmix):
+    """
+    set the norms for the mixture, returning 0 rather than raising an
+    exception if any gaussian is invalid
+    """
+    for gauss in gmix:
+        if gauss['p'] <= 0.0:
+            return 0
+        if gauss['det'] < GMIX_LOW_DETVAL:
+            return 0
+        if gauss['irr']+gauss['icc'] <= GMIX_LOW_DETVAL:
+            return 0
+
+        gauss2d_set_norm(gauss)
+
+    return 1
+
+@njit
+def gmix_set_from_sum_array(gmix, sums):
+    """
+    fill the gaussian mixture from an [ngauss, 6] array of em sums,
+    returning 0 rather than raising an exception if any gaussian is
+    invalid
+    """
+
+    n_gauss=gmix.size
+    for i in xrange(n_gauss):
+
+        p = sums[i, 0]
+        if p <= 0.0:
+            return 0
+
+        pinv=1.0/p
+
+        gauss2d_set(
+            gmix[i],
+            p,
+            sums[i, 1]*pinv,
+            sums[i, 2]*pinv,
+            sums[i, 5]*pinv,
+            sums[i, 4]*pinv,
+            sums[i, 3]*pinv,
+        )
+
+    return gmix_check_norms(gmix)
+
+@njit
+def do_block_sums(pixels, gmix, nsky, counts, scratch, bsums):
+    """
+    do the sums for a block of pixels
+
+    parameters
+    ----------
+    pixels: pixel array
+        The pixels in this block
+    gmix: gaussian mixture
+        The current mixture
+    nsky: float
+        The current normalized sky
+    counts: float
+        Counts in the image
+    scratch: array
+        [ngauss, 6] scratch space
+    bsums: array
+        [ngauss, 6] array to hold pnew, rowsum, colsum, u2sum, uvsum, v2sum
+
+    returns
+    -------
+    skysum, ok: ok is 0 if the total in any pixel was zero
+    """
+
+    bsums[:, :] = 0.0
+    skysum = 0.0
+
+    n_gauss = gmix.size
+    for pixel in pixels:
+
+        v = pixel['v']
+        u = pixel['u']
+
+        gtot = 0.0
+        for igauss in xrange(n_gauss):
+            gauss = gmix[igauss]
+
+            vdiff = v-gauss['row']
+            udiff = u-gauss['col']
+
+            u2 = udiff*udiff
+            v2 = vdiff*vdiff
+            uv = udiff*vdiff
+
+            chi2 = \
+                gauss['dcc']*v2 + gauss['drr']*u2 - 2.0*gauss['drc']*uv
+
+            if chi2 < 25.0 and chi2 >= 0.0:
+                gi = gauss['pnorm']*exp3( -0.5*chi2 )
+            else:
+                gi = 0.0
+
+            gtot += gi
+
+            scratch[igauss, 0] = gi
+            scratch[igauss, 1] = v*gi
+            scratch[igauss, 2] = u*gi
+            scratch[igauss, 3] = u2*gi
+            scratch[igauss, 4] = uv*gi
+            scratch[igauss, 5] = v2*gi
+
+        gtot += nsky
+        if gtot==0.0:
+            return skysum, 0
+
+        imnorm = pixel['val']/counts
+        skysum += nsky*imnorm/gtot
+        igrat = imnorm/gtot
+
+        for igauss in xrange(n_gauss):
+            for k in xrange(6):
+                bsums[igauss, k] += scratch[igauss, k]*igrat
+
+    return skysum, 1
+
 @njit
 def do_scratch_sums(pixel, gmix, sums):
     """
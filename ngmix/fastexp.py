@@ -1,4 +1,84 @@
+"""
+Exponentials used in the pixel kernels
+
+Three methods are available for evaluating exp(x) in the kernels used by
+the fitters, selected with an integer code
+
+    EXP_TABLE: 'table'
+        A lookup table of exp(n) for integer n in [-300,0], with a cubic
+        polynomial for the fractional part; this is exp3 in fastexp_nb.
+        Max relative error 3.9e-3 over [-300,0].  This is the default and
+        the fastest method.
+
+    EXP_POLY: 'poly'
+        Range reduction x = n*ln(2) + r, a degree 11 polynomial for exp(r)
+        and 2^n constructed directly from the bits of a double.  There are
+        no branches or table lookups, so loops using it can be vectorized.
+        Max relative error 8.8e-15 over [-300,0]; about twice the cost of the
+        table.
+
+    EXP_EXACT: 'exact'
+        numpy.exp, max relative error 2.3e-16 (about one ulp); about 8x the cost
+        of the table.
+
+The errors are measured by test.TestFitting.testExpMethods and are reported by
+get_exp_method_max_relerr.  Timings can be made with
+benchmarks.bench_exp
+"""
 import numpy
+
+EXP_TABLE=0
+EXP_POLY=1
+EXP_EXACT=2
+
+_exp_methods={
+    'table':EXP_TABLE,
+    'poly':EXP_POLY,
+    'exact':EXP_EXACT,
+}
+
+# max relative error over [-300,0]
+_exp_max_relerr={
+    EXP_TABLE:3.9e-3,
+    EXP_POLY:8.8e-15,
+    EXP_EXACT:2.3e-16,
+}
+
+def get_exp_method(method):
+    """
+    get the integer code for an exponential method
+
+    parameters
+    ----------
+    method: string or int
+        'table', 'poly' or 'exact', or one of the codes EXP_TABLE, EXP_POLY,
+        EXP_EXACT
+
+    returns
+    -------
+    the integer code
+    """
+    if method in _exp_max_relerr:
+        return int(method)
+
+    if method not in _exp_methods:
+        raise ValueError("bad exp method '%s', should be "
+                         "one of %s" % (method, list(_exp_methods)))
+
+    return _exp_methods[method]
+
+def get_exp_method_max_relerr(method):
+    """
+    get the maximum relative error for the exponential method
+    over the range [-300,0]
+
+    parameters
+    ----------
+    method: string or int
+        The method, see get_exp_method
+    """
+    return _exp_max_relerr[get_exp_method(method)]
+
 def make_exp_lookup(minval=-100, maxval=100, dtype='f8'):
     """
     lookup array in range [minval,0] inclusive
@@ -1,6 +1,13 @@
-from numba import njit
+import numpy
+from numba import njit, types
+from numba.extending import intrinsic
+from llvmlite import ir
 
-from .fastexp import make_exp_lookup
+from .fastexp import (
+    make_exp_lookup,
+    EXP_TABLE,
+    EXP_POLY,
+)
 
 _exp3_ivals, _exp3_lookup = make_exp_lookup(
     minval=-300,
@@ -25,3 +32,115 @@ def exp3(x):
     expval *= (6+f*(6+f*(3+f)))*0.16666666
 
     return expval
+
+# constants for exp_poly.  ln(2) is split into a high part with trailing
+# zero bits, so n*_LN2_HI is exact, and a low part for the remainder
+_LOG2E=1.4426950408889634
+_LN2_HI=6.93145751953125e-1
+_LN2_LO=1.42860682030941723212e-6
+
+# adding 1.5*2^52 rounds to the nearest integer, which is left in the
+# low bits of the mantissa
+_ROUND_SHIFTER=6755399441055744.0
+
+# below this 2^n is no longer a normal number
+_EXP_POLY_MIN=-700.0
+
+# taylor coefficients 1/k!
+_C2=1.0/2.0
+_C3=1.0/6.0
+_C4=1.0/24.0
+_C5=1.0/120.0
+_C6=1.0/720.0
+_C7=1.0/5040.0
+_C8=1.0/40320.0
+_C9=1.0/362880.0
+_C10=1.0/3628800.0
+_C11=1.0/39916800.0
+
+@intrinsic
+def _int64_as_float64(typingctx, ival):
+    """
+    reinterpret the bits of an int64 as a float64
+    """
+    sig = types.float64(types.int64)
+
+    def codegen(context, builder, signature, args):
+        return builder.bitcast(args[0], ir.DoubleType())
+
+    return sig, codegen
+
+@intrinsic
+def _float64_as_int64(typingctx, fval):
+    """
+    reinterpret the bits of a float64 as an int64
+    """
+    sig = types.int64(types.float64)
+
+    def codegen(context, builder, signature, args):
+        return builder.bitcast(args[0], ir.IntType(64))
+
+    return sig, codegen
+
+@njit
+def exp_poly(x):
+    """
+    branch free exponential, max relative error 8.8e-15 for x in [-300,0]
+
+    x = n*ln(2) + r with |r| <= ln(2)/2, exp(r) is evaluated with a
+    polynomial and 2^n is built from the bits of n.  There are no branches
+    or table lookups, so loops calling it can be vectorized
+
+    Values below -700 are clipped to -700, and x should be <= 700
+
+    x: number
+        any number
+    """
+    x = max(x, _EXP_POLY_MIN)
+
+    shifted = x*_LOG2E + _ROUND_SHIFTER
+    n = shifted - _ROUND_SHIFTER
+    r = (x - n*_LN2_HI) - n*_LN2_LO
+
+    p = 1.0 + r*(1.0 + r*(_C2 + r*(_C3 + r*(_C4 + r*(_C5 + r*(
+        _C6 + r*(_C7 + r*(_C8 + r*(_C9 + r*(_C10 + r*_C11))))))))))
+
+    # the low bits of shifted hold n, shift them into the exponent
+    scale = _int64_as_float64(
+        (_float64_as_int64(shifted) + 1023) << 52
+    )
+    return p*scale
+
+@njit
+def exp_method(x, method):
+    """
+    exponential evaluated with the specified method
+
+    no range checking is done here, do it at the caller
+
+    x: number
+        any number, in [-300,0] for the table method
+    method: int
+        EXP_TABLE, EXP_POLY or EXP_EXACT, see fastexp.py
+    """
+    if method == EXP_TABLE:
+        return exp3(x)
+    elif method == EXP_POLY:
+        return exp_poly(x)
+    else:
+        return numpy.exp(x)
+
+@njit
+def fill_exp(x, out, method):
+    """
+    fill out with the exponential of x, evaluated with the specified method
+
+    x: array
+        The values
+    out: array
+        Array to fill, same size as x
+    method: int
+        EXP_TABLE, EXP_POLY or EXP_EXACT, see fastexp.py
+    """
+    for i in range(x.size):
+        out[i] = exp_method(x[i], method)
@@ -30,7 +30,15 @@ from . import stats
 
 
 from .gmix_nb import gmix_convolve_fill
-from .fitting_nb import fill_fdiff
+from .fitting_nb import (
+    fill_fdiff_culled,
+    fill_fdiff_grid,
+    fill_fdiff_parallel,
+    fill_fdiff_jacob_culled,
+    FDIFF_MAX_CHI2,
+)
+from .parallel import use_parallel
+from .fastexp import get_exp_method
 
 MAX_TAU=0.1
 MIN_ARATE=0.2
@@ -57,6 +65,8 @@ DIV_ZERO = 2**9  # division by zero
 
 ZERO_DOF = 2**10 # dof zero so can't do chi^2/dof
 
+LM_BAD_GUESS = 2**12 # guess was out of range, only used for batch fitting
+
 
 class FitterBase(object):
     """
@@ -84,6 +94,14 @@ class FitterBase(object):
 
         self.prior = keys.get('prior',None)
 
+        # use parallel pixel kernels for large images, None means
+        # use the global setting, see ngmix.parallel
+        self.parallel = keys.get('parallel',None)
+
+        # method for the exponential in the pixel kernels, 'table', 'poly'
+        # or 'exact', see ngmix.fastexp
+        self.exp_method = get_exp_method(keys.get('exp_method','table'))
+
         # in this case, image, weight, jacobian, psf are going to
         # be lists of lists.
 
@@ -253,6 +271,8 @@ class FitterBase(object):
                     res = gm.get_loglike(
                         obs,
                         more=more,
+                        parallel=self.parallel,
+                        exp_method=self.exp_method,
                     )
 
                     if more:
@@ -1651,6 +1671,10 @@ class LMSimple(FitterBase):
 
         self._band_pars=zeros(6)
 
+        # use analytic derivatives for the jacobian when the model
+        # supports them, otherwise leastsq uses finite differences
+        self.use_jacob=keys.get('use_jacob',True)
+
     def _set_n_prior_pars(self):
         # center1 + center2 + shape + T + fluxes
         if self.prior is None:
@@ -1674,12 +1698,18 @@ class LMSimple(FitterBase):
 
         bounds = self._get_bounds()
 
+        lm_pars={}
+        lm_pars.update(self.lm_pars)
+        if self._jacob_data is not None:
+            lm_pars['Dfun']=self._calc_jacob
+            lm_pars['col_deriv']=1
+
         result = run_leastsq(
             self._calc_fdiff,
             guess,
             self.n_prior_pars,
             bounds=bounds,
-            **self.lm_pars
+            **lm_pars
         )
 
 
@@ -1773,7 +1803,11 @@ class LMSimple(FitterBase):
         lists of references.
         """
         pixels_list      = []
+        pixels_soa_list  = []
+        pixel_index_list = []
+        jacobian_list    = []
         gmix_data_list   = []
+        parallel_list    = []
 
         for band in xrange(self.nband):
 
@@ -1784,12 +1818,176 @@ class LMSimple(FitterBase):
 
                 gmdata=gm.get_data()
 
-                pixels_list.append(obs._pixels)
+                pixels_list.append(obs.pixels)
+                pixel_index_list.append(obs.pixel_index)
+
+                # use the grid kernels when there are no missing pixels
+                if obs.has_full_pixels():
+                    pixels_soa_list.append(obs.pixels_soa)
+                else:
+                    pixels_soa_list.append(None)
+
+                jacobian_list.append(obs._jacobian._data)
                 gmix_data_list.append(gmdata)
 
+                parallel_list.append(
+                    use_parallel(obs.pixels.size, self.parallel)
+                )
+
 
         self._pixels_list=pixels_list
+        self._pixels_soa_list=pixels_soa_list
+        self._pixel_index_list=pixel_index_list
+        self._jacobian_list=jacobian_list
         self._gmix_data_list=gmix_data_list
+        self._parallel_list=parallel_list
+
+        self._make_jacob_data()
+
+    def _make_jacob_data(self):
+        """
+        set up the data needed to calculate the analytic jacobian, or
+        set to None if analytic derivatives are not available
+        """
+
+        self._jacob_data=None
+
+        if not self.use_jacob:
+            return
+
+        gmix_all0 = self._gmix_all0 if self.dopsf else self._gmix_all
+        for gmix_list0 in gmix_all0:
+            if not gmix_list0[0].has_derivs():
+                return
+
+        nband_pars = self.npars - self.nband + 1
+
+        derivs_list  = []
+        parind_list  = []
+        psf_pvals_list = []
+
+        for band in xrange(self.nband):
+            ngauss0 = len(gmix_all0[band][0])
+            derivs = zeros( (ngauss0, 6, nband_pars) )
+            derivs_list.append(derivs)
+
+            parind = numpy.arange(nband_pars)
+            parind[-1] += band
+            parind_list.append(parind)
+
+            for obs in self.obs[band]:
+                if self.dopsf:
+                    psf_p = obs.psf.gmix.get_data()['p']
+                    psf_pvals = psf_p/psf_p.sum()
+                else:
+                    psf_pvals = numpy.ones(1)
+
+                psf_pvals_list.append(psf_pvals)
+
+        # the jacobian is copied by MINPACK, so a single array is reused.
+        # Rows for parameters not in a band stay zero for its pixels
+        self._jacob_data = {
+            'gmix_all0':gmix_all0,
+            'derivs_list':derivs_list,
+            'parind_list':parind_list,
+            'psf_pvals_list':psf_pvals_list,
+            'fdiff':zeros(self.fdiff_size),
+            'jacob':zeros( (self.npars, self.fdiff_size) ),
+        }
+
+        if self.prior is not None:
+            nprior = self.n_prior_pars
+            self._jacob_data.update({
+                'prior_fdiff0':zeros(nprior),
+                'prior_fdiff1':zeros(nprior),
+                'prior_pars':zeros(self.npars),
+            })
+
+    def _calc_jacob(self, pars):
+        """
+        jacobian of the vector (model-data)/error, with the derivatives for
+        each parameter along the rows
+
+        The derivatives for the pixels are analytic, those for the priors
+        are calculated using finite differences
+        """
+
+        jd = self._jacob_data
+        jacob = jd['jacob']
+        fdiff = jd['fdiff']
+
+        try:
+
+            # all norms are set after fill
+            self._fill_gmix_all(pars)
+
+            start=self._fill_prior_jacob(pars, jacob)
+
+            iobs=0
+            for band in xrange(self.nband):
+
+                derivs = jd['derivs_list'][band]
+                parind = jd['parind_list'][band]
+
+                jd['gmix_all0'][band][0]._fill_derivs(derivs)
+
+                for i in xrange(len(self.obs[band])):
+                    pixels = self._pixels_list[iobs]
+                    fill_fdiff_jacob_culled(
+                        self._gmix_data_list[iobs],
+                        derivs,
+                        jd['psf_pvals_list'][iobs],
+                        parind,
+                        pixels,
+                        self._pixel_index_list[iobs],
+                        self._jacobian_list[iobs],
+                        fdiff,
+                        jacob,
+                        start,
+                        FDIFF_MAX_CHI2,
+                        self.exp_method,
+                    )
+
+                    start += pixels.size
+                    iobs += 1
+
+        except GMixRangeError:
+            jacob[:,:] = 0.0
+
+        return jacob
+
+    def _fill_prior_jacob(self, pars, jacob, step=1.0e-6):
+        """
+        Fill derivatives of the priors at the beginning of each row
+        of the jacobian, using finite differences
+
+        ret the position after last par
+        """
+
+        if self.prior is None:
+            return 0
+
+        jd = self._jacob_data
+        nprior = self.n_prior_pars
+        fdiff0 = jd['prior_fdiff0']
+        fdiff1 = jd['prior_fdiff1']
+
+        self.prior.fill_fdiff(pars, fdiff0)
+
+        tpars = jd['prior_pars']
+        tpars[:] = pars
+        for i in xrange(self.npars):
+            h = step*max(abs(pars[i]), 1.0)
+
+            tpars[i] = pars[i] + h
+            self.prior.fill_fdiff(tpars, fdiff1)
+            tpars[i] = pars[i]
+
+            row = jacob[i, 0:nprior]
+            numpy.subtract(fdiff1, fdiff0, out=row)
+            row /= h
+
+        return nprior
 
     def _calc_fdiff(self, pars):
         """
@@ -1798,7 +1996,8 @@ class LMSimple(FitterBase):
         The npars elements contain -ln(prior)
         """
 
-        # we cannot keep sending existing array into leastsq, don't know why
+        # a new array is needed each time: MINPACK keeps references to
+        # earlier fdiff arrays when making the finite difference jacobian
         fdiff=zeros(self.fdiff_size)
 
         try:
@@ -1808,13 +2007,44 @@ class LMSimple(FitterBase):
 
             start=self._fill_priors(pars, fdiff)
 
-            for pixels,gm in zip(self._pixels_list,self._gmix_data_list):
-                fill_fdiff(
-                    gm,
-                    pixels,
-                    fdiff,
-                    start,
-                )
+            for iobs,pixels in enumerate(self._pixels_list):
+                gm=self._gmix_data_list[iobs]
+
+                pixels_soa=self._pixels_soa_list[iobs]
+
+                if self._parallel_list[iobs]:
+                    fill_fdiff_parallel(
+                        gm,
+                        pixels,
+                        fdiff,
+                        start,
+                        self.exp_method,
+                    )
+                elif pixels_soa is not None:
+                    nrow, ncol = self._pixel_index_list[iobs].shape
+                    fill_fdiff_grid(
+                        gm,
+                        pixels_soa,
+                        self._jacobian_list[iobs],
+                        nrow,
+                        ncol,
+                        fdiff,
+                        start,
+                        FDIFF_MAX_CHI2,
+                        self.exp_method,
+                    )
+                else:
+                    # only visits pixels near each gaussian
+                    fill_fdiff_culled(
+                        gm,
+                        pixels,
+                        self._pixel_index_list[iobs],
+                        self._jacobian_list[iobs],
+                        fdiff,
+                        start,
+                        FDIFF_MAX_CHI2,
+                        self.exp_method,
+                    )
 
                 start += pixels.size
 
@@ -2121,6 +2351,7 @@ def run_leastsq(func, guess, n_prior_pars, **keys):
 
         res['flags']=flags
         res['nfev'] = infodict['nfev']
+        res['njev'] = infodict.get('njev',0)
         res['ier'] = ier
         res['errmsg'] = errmsg
 
@@ -1,4 +1,5 @@
-from numba import njit
+import numpy
+from numba import njit, prange
 
 try:
     xrange
@@ -8,7 +9,24 @@ except NameError:
 from .gmix_nb import (
     gmix_eval_pixel_fast,
     gmix_set_norms,
+    gauss2d_eval_pixel_fast,
+    gauss2d_get_pixel_box,
+    gauss2d_get_row_chi2,
 )
+from .fastexp_nb import exp3, exp_method
+from .fastexp import EXP_TABLE
+from .parallel import PIXEL_BLOCKSIZE
+from .pixels import (
+    PIXELS_SOA_V,
+    PIXELS_SOA_U,
+    PIXELS_SOA_VAL,
+    PIXELS_SOA_IERR,
+)
+
+# gaussians are only evaluated within this chi^2 in the fdiff kernels.
+# Send it explicitly when calling the culled kernels from python; the
+# dispatcher is very slow when the argument is omitted
+FDIFF_MAX_CHI2=25.0
 
 @njit
 def get_loglike(gmix, pixels):
@@ -87,6 +105,702 @@ def fill_fdiff(gmix, pixels, fdiff, start):
         model_val = gmix_eval_pixel_fast(gmix, pixel)
         fdiff[start+ipixel] = (model_val-pixel['val'])*pixel['ierr']
 
+@njit
+def get_loglike_soa(gmix, pixels, exp_meth=EXP_TABLE):
+    """
+    get the log likelihood, with pixels in the structure-of-arrays layout
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+
+    returns
+    -------
+    a tuple of
+
+    loglike: float
+        log likelihood
+    s2n_numer: float
+        numerator for s/n
+    s2n_demon: float
+        will use sqrt(s2n_denom) for denominator for s/n
+    npix: int
+        number of pixels used
+    """
+
+    n_pixels = pixels.shape[1]
+    model = numpy.zeros(n_pixels)
+
+    fill_model_soa(gmix, pixels, model, 0, FDIFF_MAX_CHI2, exp_meth)
+
+    vals  = pixels[PIXELS_SOA_VAL]
+    ierrs = pixels[PIXELS_SOA_IERR]
+
+    loglike = s2n_numer = s2n_denom = 0.0
+    for ipixel in xrange(n_pixels):
+        model_val = model[ipixel]
+
+        ivar = ierrs[ipixel]*ierrs[ipixel]
+        val  = vals[ipixel]
+        diff = model_val-val
+
+        loglike += diff*diff*ivar
+
+        s2n_numer += val * model_val * ivar
+        s2n_denom += model_val * model_val * ivar
+
+    loglike *= (-0.5)
+
+    return loglike, s2n_numer, s2n_denom, n_pixels
+
+@njit
+def get_loglike_grid(gmix, pixels, jacobian, nrow, ncol,
+                     max_chi2=FDIFF_MAX_CHI2, exp_meth=EXP_TABLE):
+    """
+    get the log likelihood for pixels covering the full image grid,
+    evaluating chi^2 along each row with a recurrence rather than from the
+    pixel coordinates
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array
+        [4, nrow*ncol] array holding v,u,val,ierr for all pixels in the
+        image, see pixels.make_pixels_soa.  Only val and ierr are used
+    jacobian: jacobian structure
+        The jacobian for the image
+    nrow, ncol: int
+        The dimensions of the image
+    max_chi2: float, optional
+        The maximum chi^2 to be evaluated
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+
+    returns
+    -------
+    a tuple of
+
+    loglike: float
+        log likelihood
+    s2n_numer: float
+        numerator for s/n
+    s2n_demon: float
+        will use sqrt(s2n_denom) for denominator for s/n
+    npix: int
+        number of pixels used
+    """
+
+    model = numpy.zeros(ncol)
+
+    vals  = pixels[PIXELS_SOA_VAL]
+    ierrs = pixels[PIXELS_SOA_IERR]
+
+    loglike = s2n_numer = s2n_denom = 0.0
+    for row in xrange(nrow):
+        model[:] = 0.0
+        fill_model_row(gmix, jacobian, row, ncol, model, 0, max_chi2,
+                       exp_meth)
+
+        start = row*ncol
+        for col in xrange(ncol):
+            ipixel = start + col
+            model_val = model[col]
+
+            ivar = ierrs[ipixel]*ierrs[ipixel]
+            val  = vals[ipixel]
+            diff = model_val-val
+
+            loglike += diff*diff*ivar
+
+            s2n_numer += val * model_val * ivar
+            s2n_denom += model_val * model_val * ivar
+
+    loglike *= (-0.5)
+
+    return loglike, s2n_numer, s2n_denom, nrow*ncol
+
+@njit
+def fill_fdiff_grid(gmix, pixels, jacobian, nrow, ncol, fdiff, start,
+                    max_chi2=FDIFF_MAX_CHI2, exp_meth=EXP_TABLE):
+    """
+    fill fdiff array (model-data)/err for pixels covering the full image
+    grid, evaluating chi^2 along each row with a recurrence rather than from
+    the pixel coordinates
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array
+        [4, nrow*ncol] array holding v,u,val,ierr for all pixels in the
+        image, see pixels.make_pixels_soa.  Only val and ierr are used
+    jacobian: jacobian structure
+        The jacobian for the image
+    nrow, ncol: int
+        The dimensions of the image
+    fdiff: array
+        Array to fill, should be same length as pixels
+    start: int
+        Where to start in fdiff
+    max_chi2: float, optional
+        The maximum chi^2 to be evaluated
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+    """
+
+    vals  = pixels[PIXELS_SOA_VAL]
+    ierrs = pixels[PIXELS_SOA_IERR]
+
+    for row in xrange(nrow):
+        rstart = row*ncol
+
+        # the model is accumulated in fdiff
+        fdiff[start+rstart:start+rstart+ncol] = 0.0
+        fill_model_row(gmix, jacobian, row, ncol, fdiff, start+rstart,
+                       max_chi2, exp_meth)
+
+        for col in xrange(ncol):
+            ipixel = rstart + col
+            fdiff[start+ipixel] = (
+                (fdiff[start+ipixel]-vals[ipixel])*ierrs[ipixel]
+            )
+
+@njit
+def fill_model_row(gmix, jacobian, row, ncol, model, start, max_chi2,
+                   exp_meth=EXP_TABLE):
+    """
+    add the model for a row of the image to the input array, evaluating
+    chi^2 along the row as a quadratic in the column
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    jacobian: jacobian structure
+        The jacobian for the image
+    row: int
+        The image row
+    ncol: int
+        Number of columns in the image
+    model: array
+        Array to fill, the model for column col is added to model[start+col]
+    start: int
+        Where to start in the model array
+    max_chi2: float
+        The maximum chi^2 to be evaluated
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    for igauss in xrange(gmix.size):
+        gauss = gmix[igauss]
+        pnorm = gauss['pnorm']
+
+        colmin, colmax, chi2, d1, d2 = gauss2d_get_row_chi2(
+            gauss, jacobian, row, ncol, max_chi2,
+        )
+
+        # chi2 is evaluated in closed form at each column, rather than with
+        # the recurrence, and no cut is made on chi2 since the range of
+        # columns is already limited to chi2 < max_chi2.  There is then no
+        # dependence between iterations and no branch, so the loop can be
+        # vectorized.  Indexing a view from zero also avoids the check for
+        # negative indices, which prevents vectorization
+        ncols = colmax-colmin+1
+        model_row = model[start+colmin:start+colmin+ncols]
+        half_d2 = 0.5*d2
+        for k in xrange(ncols):
+            tchi2 = chi2 + k*(d1 + (k-1)*half_d2)
+
+            # roundoff can give chi2 slightly below zero
+            model_row[k] += pnorm*exp_method(
+                -0.5*max(tchi2, 0.0), exp_meth,
+            )
+
+@njit
+def fill_model_soa(gmix, pixels, model, start, max_chi2=FDIFF_MAX_CHI2,
+                   exp_meth=EXP_TABLE):
+    """
+    add the model to the input array, with pixels in the
+    structure-of-arrays layout
+
+    The loop over gaussians is outside the loop over pixels, so the inner
+    loop works on contiguous arrays and can be vectorized
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array
+        [4, npixels] array holding v,u,val,ierr, see pixels.make_pixels_soa
+    model: array
+        Array to fill
+    start: int
+        Where to start in the model array
+    max_chi2: float, optional
+        The maximum chi^2 to be evaluated
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    v = pixels[PIXELS_SOA_V]
+    u = pixels[PIXELS_SOA_U]
+    n_pixels = v.size
+
+    for igauss in xrange(gmix.size):
+        gauss = gmix[igauss]
+
+        row   = gauss['row']
+        col   = gauss['col']
+        dcc   = gauss['dcc']
+        drr   = gauss['drr']
+        drc2  = 2.0*gauss['drc']
+        pnorm = gauss['pnorm']
+
+        for ipixel in xrange(n_pixels):
+            vdiff = v[ipixel] - row
+            udiff = u[ipixel] - col
+
+            chi2 = dcc*vdiff*vdiff + drr*udiff*udiff - drc2*vdiff*udiff
+
+            if chi2 < max_chi2 and chi2 >= 0.0:
+                model[start+ipixel] += pnorm*exp_method(-0.5*chi2, exp_meth)
+
+@njit(parallel=True)
+def get_loglike_parallel(gmix, pixels, exp_meth=EXP_TABLE):
+    """
+    get the log likelihood, processing blocks of pixels in parallel
+
+    The sums for each block are added in order, so the result does not
+    depend on the number of threads
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array if pixel structs
+        u,v,val,ierr
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+
+    returns
+    -------
+    a tuple of
+
+    loglike: float
+        log likelihood
+    s2n_numer: float
+        numerator for s/n
+    s2n_demon: float
+        will use sqrt(s2n_denom) for denominator for s/n
+    npix: int
+        number of pixels used
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    n_pixels = pixels.shape[0]
+    n_blocks = (n_pixels + PIXEL_BLOCKSIZE - 1)//PIXEL_BLOCKSIZE
+
+    block_loglike = numpy.zeros(n_blocks)
+    block_s2n_numer = numpy.zeros(n_blocks)
+    block_s2n_denom = numpy.zeros(n_blocks)
+
+    for iblock in prange(n_blocks):
+        beg = iblock*PIXEL_BLOCKSIZE
+        end = min(beg + PIXEL_BLOCKSIZE, n_pixels)
+
+        loglike = s2n_numer = s2n_denom = 0.0
+        for ipixel in xrange(beg, end):
+            pixel = pixels[ipixel]
+
+            model_val = gmix_eval_pixel_fast(
+                gmix, pixel, FDIFF_MAX_CHI2, exp_meth,
+            )
+
+            ivar = pixel['ierr']*pixel['ierr']
+            val  = pixel['val']
+            diff = model_val-val
+
+            loglike += diff*diff*ivar
+
+            s2n_numer += val * model_val * ivar
+            s2n_denom += model_val * model_val * ivar
+
+        block_loglike[iblock] = loglike
+        block_s2n_numer[iblock] = s2n_numer
+        block_s2n_denom[iblock] = s2n_denom
+
+    loglike = s2n_numer = s2n_denom = 0.0
+    for iblock in xrange(n_blocks):
+        loglike += block_loglike[iblock]
+        s2n_numer += block_s2n_numer[iblock]
+        s2n_denom += block_s2n_denom[iblock]
+
+    loglike *= (-0.5)
+
+    return loglike, s2n_numer, s2n_denom, n_pixels
+
+@njit(parallel=True)
+def fill_fdiff_parallel(gmix, pixels, fdiff, start, exp_meth=EXP_TABLE):
+    """
+    fill fdiff array (model-data)/err, processing blocks of pixels in
+    parallel
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array if pixel structs
+        u,v,val,ierr
+    fdiff: array
+        Array to fill, should be same length as pixels
+    start: int
+        Where to start in fdiff
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    n_pixels = pixels.shape[0]
+    n_blocks = (n_pixels + PIXEL_BLOCKSIZE - 1)//PIXEL_BLOCKSIZE
+
+    for iblock in prange(n_blocks):
+        beg = iblock*PIXEL_BLOCKSIZE
+        end = min(beg + PIXEL_BLOCKSIZE, n_pixels)
+
+        for ipixel in xrange(beg, end):
+            pixel = pixels[ipixel]
+
+            model_val = gmix_eval_pixel_fast(
+                gmix, pixel, FDIFF_MAX_CHI2, exp_meth,
+            )
+            fdiff[start+ipixel] = (model_val-pixel['val'])*pixel['ierr']
+
+@njit
+def fill_fdiff_jacob(gmix,
+                     derivs,
+                     psf_pvals,
+                     parind,
+                     pixels,
+                     fdiff,
+                     jacob,
+                     start,
+                     max_chi2=25.0):
+    """
+    fill fdiff array (model-data)/err and the derivatives of fdiff
+    with respect to the model parameters, visiting every pixel for every
+    gaussian.  This is used by the batch fitter in batchfit_nb, which has
+    no pixel index or jacobian for the pixels; LMSimple uses
+    fill_fdiff_jacob_culled
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        The convolved mixture, ordered as filled by gmix_convolve_fill.  If
+        there is no psf, this is just the model mixture
+    derivs: array
+        [ngauss, 6, nbandpars] array holding derivatives of the p,row,col,
+        irr,irc,icc of the unconvolved gaussians with respect to the
+        parameters for this band
+    psf_pvals: array
+        p/sum(p) for each psf gaussian, [1.0] if there is no psf
+    parind: array
+        index of each band parameter in the full parameter array
+    pixels: array if pixel structs
+        u,v,val,ierr
+    fdiff: array
+        Array to fill, should be same length as pixels
+    jacob: array
+        [npars, nfdiff] array to fill, derivatives are along the rows
+    start: int
+        Where to start in fdiff and the jacob rows
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    n_gauss0 = derivs.shape[0]
+    n_bpars  = derivs.shape[2]
+    n_psf    = psf_pvals.size
+
+    gsums = numpy.zeros(6)
+    dsums = numpy.zeros(n_bpars)
+
+    n_pixels = pixels.shape[0]
+    for ipixel in xrange(n_pixels):
+        pixel = pixels[ipixel]
+
+        model_val = 0.0
+        dsums[:] = 0.0
+
+        for i in xrange(n_gauss0):
+            gsums[:] = 0.0
+
+            for j in xrange(n_psf):
+                gauss = gmix[i*n_psf + j]
+
+                vdiff = pixel['v'] - gauss['row']
+                udiff = pixel['u'] - gauss['col']
+
+                chi2 = (      gauss['dcc']*vdiff*vdiff
+                        +     gauss['drr']*udiff*udiff
+                        - 2.0*gauss['drc']*vdiff*udiff )
+
+                if chi2 < max_chi2 and chi2 >= 0.0:
+                    nexpval = gauss['norm']*exp3( -0.5*chi2 )
+                    val = gauss['p']*nexpval
+
+                    model_val += val
+
+                    # inverse covariance times the offset
+                    av = gauss['dcc']*vdiff - gauss['drc']*udiff
+                    au = gauss['drr']*udiff - gauss['drc']*vdiff
+
+                    gsums[0] += nexpval*psf_pvals[j]
+                    gsums[1] += val*av
+                    gsums[2] += val*au
+                    gsums[3] += val*0.5*(av*av - gauss['dcc'])
+                    gsums[4] += val*(av*au + gauss['drc'])
+                    gsums[5] += val*0.5*(au*au - gauss['drr'])
+
+            deriv = derivs[i]
+            for k in xrange(n_bpars):
+                for q in xrange(6):
+                    dsums[k] += gsums[q]*deriv[q, k]
+
+        ierr = pixel['ierr']
+        fdiff[start+ipixel] = (model_val-pixel['val'])*ierr
+
+        for k in xrange(n_bpars):
+            jacob[parind[k], start+ipixel] = dsums[k]*ierr
+
+@njit
+def fill_fdiff_culled(gmix,
+                      pixels,
+                      pixel_index,
+                      jacobian,
+                      fdiff,
+                      start,
+                      max_chi2=FDIFF_MAX_CHI2,
+                      exp_meth=EXP_TABLE):
+    """
+    fill fdiff array (model-data)/err, visiting for each gaussian only the
+    pixels in the bounding box of its max_chi2 ellipse
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        See gmix.py
+    pixels: array if pixel structs
+        u,v,val,ierr
+    pixel_index: 2-d array
+        index into the pixels array for each pixel in the image, -1 for
+        pixels not in the array.  See pixels.make_pixel_index
+    jacobian: jacobian structure
+        The jacobian used to make the pixels
+    fdiff: array
+        Array to fill, should be same length as pixels
+    start: int
+        Where to start in fdiff
+    max_chi2: float, optional
+        The maximum chi^2 to be evaluated
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    nrow, ncol = pixel_index.shape
+
+    n_pixels = pixels.shape[0]
+    for ipixel in xrange(n_pixels):
+        fdiff[start+ipixel] = 0.0
+
+    for igauss in xrange(gmix.size):
+        gauss = gmix[igauss]
+
+        rowmin, rowmax, colmin, colmax = gauss2d_get_pixel_box(
+            gauss, jacobian, max_chi2, nrow, ncol,
+        )
+
+        for row in xrange(rowmin, rowmax+1):
+            for col in xrange(colmin, colmax+1):
+                ipixel = pixel_index[row, col]
+                if ipixel < 0:
+                    continue
+
+                fdiff[start+ipixel] += gauss2d_eval_pixel_fast(
+                    gauss,
+                    pixels[ipixel],
+                    max_chi2,
+                    exp_meth,
+                )
+
+    finish_fdiff(pixels, fdiff, start)
+
+@njit
+def fill_fdiff_jacob_culled(gmix,
+                            derivs,
+                            psf_pvals,
+                            parind,
+                            pixels,
+                            pixel_index,
+                            jacobian,
+                            fdiff,
+                            jacob,
+                            start,
+                            max_chi2=FDIFF_MAX_CHI2,
+                            exp_meth=EXP_TABLE):
+    """
+    fill fdiff array (model-data)/err and the derivatives of fdiff
+    with respect to the model parameters, visiting for each model gaussian
+    only the pixels in the bounding box of the max_chi2 ellipses of its
+    convolved gaussians
+
+    parameters
+    ----------
+    gmix: gaussian mixture
+        The convolved mixture, ordered as filled by gmix_convolve_fill.  If
+        there is no psf, this is just the model mixture
+    derivs: array
+        [ngauss, 6, nbandpars] array holding derivatives of the p,row,col,
+        irr,irc,icc of the unconvolved gaussians with respect to the
+        parameters for this band
+    psf_pvals: array
+        p/sum(p) for each psf gaussian, [1.0] if there is no psf
+    parind: array
+        index of each band parameter in the full parameter array
+    pixels: array if pixel structs
+        u,v,val,ierr
+    pixel_index: 2-d array
+        index into the pixels array for each pixel in the image, -1 for
+        pixels not in the array.  See pixels.make_pixel_index
+    jacobian: jacobian structure
+        The jacobian used to make the pixels
+    fdiff: array
+        Array to fill, should be same length as pixels
+    jacob: array
+        [npars, nfdiff] array to fill, derivatives are along the rows
+    start: int
+        Where to start in fdiff and the jacob rows
+    max_chi2: float, optional
+        The maximum chi^2 to be evaluated
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    nrow, ncol = pixel_index.shape
+
+    n_gauss0 = derivs.shape[0]
+    n_bpars  = derivs.shape[2]
+    n_psf    = psf_pvals.size
+
+    n_pixels = pixels.shape[0]
+    for ipixel in xrange(n_pixels):
+        fdiff[start+ipixel] = 0.0
+        for k in xrange(n_bpars):
+            jacob[parind[k], start+ipixel] = 0.0
+
+    for i in xrange(n_gauss0):
+        deriv = derivs[i]
+
+        # union of the boxes of the convolved gaussians
+        rowmin, colmin = nrow, ncol
+        rowmax, colmax = -1, -1
+        for j in xrange(n_psf):
+            trowmin, trowmax, tcolmin, tcolmax = gauss2d_get_pixel_box(
+                gmix[i*n_psf + j], jacobian, max_chi2, nrow, ncol,
+            )
+            if trowmax < trowmin or tcolmax < tcolmin:
+                continue
+
+            rowmin = min(rowmin, trowmin)
+            rowmax = max(rowmax, trowmax)
+            colmin = min(colmin, tcolmin)
+            colmax = max(colmax, tcolmax)
+
+        for row in xrange(rowmin, rowmax+1):
+            for col in xrange(colmin, colmax+1):
+                ipixel = pixel_index[row, col]
+                if ipixel < 0:
+                    continue
+
+                pixel = pixels[ipixel]
+
+                # sums for the derivatives with respect to p,row,col,
+                # irr,irc,icc.  Scalars rather than an array so the kernel
+                # does no allocation
+                model_val = 0.0
+                gs0 = gs1 = gs2 = gs3 = gs4 = gs5 = 0.0
+
+                for j in xrange(n_psf):
+                    gauss = gmix[i*n_psf + j]
+
+                    vdiff = pixel['v'] - gauss['row']
+                    udiff = pixel['u'] - gauss['col']
+
+                    chi2 = (      gauss['dcc']*vdiff*vdiff
+                            +     gauss['drr']*udiff*udiff
+                            - 2.0*gauss['drc']*vdiff*udiff )
+
+                    if chi2 < max_chi2 and chi2 >= 0.0:
+                        nexpval = gauss['norm']*exp_method(
+                            -0.5*chi2, exp_meth,
+                        )
+                        val = gauss['p']*nexpval
+
+                        model_val += val
+
+                        av = gauss['dcc']*vdiff - gauss['drc']*udiff
+                        au = gauss['drr']*udiff - gauss['drc']*vdiff
+
+                        gs0 += nexpval*psf_pvals[j]
+                        gs1 += val*av
+                        gs2 += val*au
+                        gs3 += val*0.5*(av*av - gauss['dcc'])
+                        gs4 += val*(av*au + gauss['drc'])
+                        gs5 += val*0.5*(au*au - gauss['drr'])
+
+                fdiff[start+ipixel] += model_val
+
+                for k in xrange(n_bpars):
+                    jacob[parind[k], start+ipixel] += (
+                          gs0*deriv[0, k]
+                        + gs1*deriv[1, k]
+                        + gs2*deriv[2, k]
+                        + gs3*deriv[3, k]
+                        + gs4*deriv[4, k]
+                        + gs5*deriv[5, k]
+                    )
+
+    for ipixel in xrange(n_pixels):
+        pixel = pixels[ipixel]
+        ierr = pixel['ierr']
+
+        fdiff[start+ipixel] = (fdiff[start+ipixel]-pixel['val'])*ierr
+        for k in xrange(n_bpars):
+            jacob[parind[k], start+ipixel] *= ierr
+
 @njit
 def finish_fdiff(pixels, fdiff, start):
     """
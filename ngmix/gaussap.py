@@ -225,6 +225,10 @@ class GaussAper(object):
         self._set_psf(psf_fwhm)
         self._set_expected_npars()
 
+        # mixtures reused for each set of parameters
+        self._gm0 = None
+        self._gm = None
+
     def get_aper_flux(self, pars):
         """
         get the aperture flux for the specified parameters
@@ -259,9 +263,14 @@ class GaussAper(object):
         """
         get a gmix for the model
         """
-        gm0 = GMixModel(pars, self.model)
-        gm = gm0.convolve(self.psf)
-        return gm
+        if self._gm0 is None:
+            self._gm0 = GMixModel(pars, self.model)
+            self._gm = self._gm0.convolve(self.psf)
+        else:
+            self._gm0.fill(pars)
+            self._gm0.convolve_into(self.psf, self._gm)
+
+        return self._gm
 
     def _set_jacobian(self):
         """
@@ -20,18 +20,35 @@ from .gexceptions import GMixFatalError
 from . import gmix_nb
 from .gmix_nb import (
     _gmix_fill_functions,
+    _gmix_fill_batch_functions,
+    _gmix_fill_derivs_functions,
     gmix_set_norms,
     gmix_convolve_fill,
+    gmix_convolve_fill_batch,
     get_cm_Tfactor,
+    get_weighted_sums_batch,
 )
 from .fitting_nb import (
-    get_loglike,
-    fill_fdiff,
+    get_loglike_soa,
+    get_loglike_grid,
+    get_loglike_parallel,
+    fill_fdiff_culled,
+    fill_fdiff_grid,
+    fill_fdiff_parallel,
     get_model_s2n_sum,
+    FDIFF_MAX_CHI2,
 )
 
-from .render_nb import render
+from .render_nb import (
+    render,
+    render_grid,
+    render_grid_batch,
+    render_parallel,
+    RENDER_MAX_CHI2,
+)
 from .pixels import make_coords
+from .parallel import use_parallel
+from .fastexp import get_exp_method
 
 # this is for backward compatibility
 from .gmix_ndim import GMixND
@@ -51,6 +68,186 @@ def make_gmix_model(pars, model, **kw):
     else:
         return GMixModel(pars, model)
 
+def make_gmix_model_batch(pars, model, psf=None, fracdev=None, TdByTe=1.0):
+    """
+    get the gaussian mixtures for a set of parameter vectors, filled in a
+    single numba call
+
+    parameters
+    ----------
+    pars: array
+        [nobj, npars] array of parameters
+    model: string or gmix type
+        e.g. 'exp' or GMIX_EXP
+    psf: GMix, list of GMix, or array, optional
+        If sent, the mixtures are convolved with the psf.  Send a single
+        GMix to use the same psf for all objects, or a list of nobj GMix
+        or an [nobj, npsf] gaussian array for a psf per object
+    fracdev: number or array, optional
+        fracdev for the cm model, a scalar or one per object
+    TdByTe: number or array, optional
+        TdByTe for the cm and bdf models, default 1.0.  For cm this can
+        be one per object
+
+    returns
+    -------
+    [nobj, ngauss] gaussian array, or [nobj, ngauss*npsf] if psf is sent.
+    Each row can be used where the data of a GMix is expected.  An
+    error in any row, e.g. |g| >= 1, raises GMixRangeError for the batch
+    """
+
+    pars = numpy.atleast_2d( numpy.asarray(pars, dtype='f8') )
+    if pars.ndim != 2:
+        raise ValueError("pars must be [nobj, npars], got "
+                         "shape %s" % str(pars.shape))
+
+    nobj, npars = pars.shape
+
+    model_name = get_model_name(model)
+    if model_name not in _gmix_fill_batch_functions:
+        raise ValueError("bad model: '%s'" % model_name)
+
+    if model_name == 'coellip':
+        ngauss = get_coellip_ngauss(npars)
+        if ngauss < 1 or get_coellip_npars(ngauss) != npars:
+            raise GMixFatalError("bad coellip npars: %d" % npars)
+    elif model_name == 'full':
+        ngauss = npars//6
+        if ngauss < 1 or npars % 6 != 0:
+            raise GMixFatalError("bad full npars: %d" % npars)
+    else:
+        ngauss = get_model_ngauss(get_model_num(model_name))
+        expected = get_model_npars(model_name)
+        if npars != expected:
+            raise GMixFatalError("model '%s' expected %d pars, "
+                                 "got %d" % (model_name, expected, npars))
+
+    gmixes = zeros( (nobj, ngauss), dtype=_gauss2d_dtype)
+
+    fill_func = _gmix_fill_batch_functions[model_name]
+    if model_name == 'cm':
+        if fracdev is None:
+            raise ValueError("send fracdev= for the cm model")
+        fracdev = _get_batch_array(fracdev, nobj, 'fracdev')
+        TdByTe = _get_batch_array(TdByTe, nobj, 'TdByTe')
+        fill_func(gmixes, fracdev, TdByTe, pars)
+    elif model_name == 'bdf':
+        fill_func(gmixes, pars, float(TdByTe))
+    else:
+        fill_func(gmixes, pars)
+
+    if psf is None:
+        return gmixes
+
+    psfs = _get_batch_psfs(psf, nobj)
+    npsf = psfs.shape[1]
+
+    output = zeros( (nobj, ngauss*npsf), dtype=_gauss2d_dtype)
+    gmix_convolve_fill_batch(output, gmixes, psfs)
+
+    return output
+
+def _get_batch_array(vals, nobj, name):
+    """
+    get a [nobj] array from a scalar or array
+    """
+    vals = numpy.atleast_1d( numpy.asarray(vals, dtype='f8') )
+    if vals.size == 1:
+        vals = numpy.zeros(nobj) + vals[0]
+    elif vals.shape != (nobj,):
+        raise ValueError("%s must be a scalar or have %d "
+                         "elements, got %d" % (name, nobj, vals.size))
+    return vals
+
+def _get_batch_psfs(psf, nobj):
+    """
+    get a [nobj, npsf] or [1, npsf] gaussian array for the psf
+    """
+    if isinstance(psf, GMix):
+        psfs = psf.get_data().reshape(1, -1)
+    elif isinstance(psf, numpy.ndarray):
+        psfs = psf
+        if psfs.ndim == 1:
+            psfs = psfs.reshape(1, -1)
+    else:
+        psfs = numpy.vstack([p.get_data() for p in psf])
+
+    if psfs.dtype != numpy.dtype(_gauss2d_dtype):
+        raise ValueError("psf array must have the gaussian dtype")
+
+    if psfs.ndim != 2 or psfs.shape[0] not in (1, nobj):
+        raise ValueError("expected 1 or %d psfs, got "
+                         "shape %s" % (nobj, str(psfs.shape)))
+
+    return psfs
+
+def make_image_batch(gmixes, dims, jacobian=None, fast_exp=False):
+    """
+    Render a set of mixtures into a new [nobj, nrow, ncol] stack of
+    images, processing the objects in parallel
+
+    parameters
+    ----------
+    gmixes: array or list of GMix
+        [nobj, ngauss] gaussian array, e.g. from make_gmix_model_batch, or
+        a list of GMix all with the same number of gaussians
+    dims: 2-element sequence
+        dimensions [nrows, ncols] of each image
+    jacobian: Jacobian or list of Jacobian, optional
+        A single jacobian for all images or one per image.  Default is a
+        unit jacobian centered in the image
+    fast_exp: bool, optional
+        use fast, approximate exp function
+
+    returns
+    -------
+    [nobj, nrow, ncol] array of images
+    """
+
+    dims=numpy.array(dims, ndmin=1, dtype='i8')
+    if dims.size != 2:
+        raise ValueError("images must have two dimensions, "
+                         "got %s" % str(dims))
+
+    if isinstance(gmixes, numpy.ndarray):
+        gm = gmixes
+        if gm.ndim == 1:
+            gm = gm.reshape(1, -1)
+    else:
+        sizes = set([len(g) for g in gmixes])
+        if len(sizes) > 1:
+            raise ValueError("all mixtures must have the same "
+                             "number of gaussians, got %s" % sorted(sizes))
+        gm = numpy.vstack([g.get_data() for g in gmixes])
+
+    if gm.dtype != numpy.dtype(_gauss2d_dtype):
+        raise ValueError("gmixes array must have the gaussian dtype")
+
+    nobj = gm.shape[0]
+
+    if jacobian is None:
+        cen=(dims-1.0)/2.0
+        jacobian=UnitJacobian(row=cen[0], col=cen[1])
+
+    if isinstance(jacobian, Jacobian):
+        jacobs = jacobian._data
+    else:
+        if len(jacobian) != nobj:
+            raise ValueError("expected %d jacobians, "
+                             "got %d" % (nobj, len(jacobian)))
+        jacobs = numpy.hstack([j._data for j in jacobian])
+
+    images=numpy.zeros( (nobj, dims[0], dims[1]), dtype='f8')
+    render_grid_batch(
+        gm,
+        images,
+        jacobs,
+        fast_exp,
+        RENDER_MAX_CHI2,
+    )
+
+    return images
+
 class GMix(object):
     """
     A general two-dimensional gaussian mixture.
@@ -68,8 +265,12 @@ class GMix(object):
     -------
     copy(self):
         make a new copy of this GMix
+    copy_into(dest):
+        copy the gaussians into an existing GMix
     convolve(psf):
         Get a new GMix that is the convolution of the GMix with the input psf
+    convolve_into(psf, dest):
+        fill an existing GMix with the convolution
     get_T():
         get T=sum(p*T_i)/sum(p)
     get_sigma():
@@ -82,7 +283,22 @@ class GMix(object):
         get cen=sum(p*cen_i)/sum(p)
     set_cen(row,col):
         set the overall center to the input.
+
+    The class uses __slots__, so new attributes cannot be added to
+    instances.  In loops, reuse mixtures with copy_into and convolve_into
+    rather than making new ones with copy and convolve
     """
+    __slots__ = (
+        '_model',
+        '_model_name',
+        '_fill_func',
+        '_fill_derivs_func',
+        '_ngauss',
+        '_npars',
+        '_pars',
+        '_data',
+    )
+
     def __init__(self, ngauss=None, pars=None):
 
         self._model      = GMIX_FULL
@@ -403,6 +619,33 @@ class GMix(object):
             self._pars,
         )
 
+    def has_derivs(self):
+        """
+        returns True if analytic derivatives with respect to the model
+        parameters are available for this mixture
+        """
+        return self._fill_derivs_func is not None
+
+    def _fill_derivs(self, derivs):
+        """
+        Fill the derivatives of the gaussian parameters p,row,col,irr,irc,icc
+        with respect to the current model parameters.
+
+        parameters
+        ----------
+        derivs: array
+            [ngauss, 6, npars] array to fill
+        """
+
+        if self._fill_derivs_func is None:
+            raise GMixFatalError("no derivatives available for "
+                                 "model '%s'" % self._model_name)
+
+        self._fill_derivs_func(
+            derivs,
+            self._pars,
+        )
+
     def copy(self):
         """
         Get a new GMix with the same parameters
@@ -411,6 +654,22 @@ class GMix(object):
         gmix._data[:] = self._data[:]
         return gmix
 
+    def copy_into(self, dest):
+        """
+        Copy the gaussians into an existing mixture, with no new arrays
+        made.  The model parameters of dest are not changed
+
+        parameters
+        ----------
+        dest: GMix
+            The mixture to fill, with the same number of gaussians
+        """
+        if len(dest) != len(self):
+            raise GMixFatalError("dest has %d gaussians, "
+                                 "expected %d" % (len(dest), len(self)))
+
+        dest._data[:] = self._data
+
     def get_sheared(self, s1, s2=None):
         """
         Get a sheared version of the gaussian mixture
@@ -477,7 +736,29 @@ class GMix(object):
 
         return output
 
-    def make_image(self, dims, jacobian=None, fast_exp=False):
+    def convolve_into(self, psf, dest):
+        """
+        Fill an existing mixture with the convolution of this GMix with the
+        input psf, with no new arrays made
+
+        parameters
+        ----------
+        psf: GMix object
+        dest: GMix object
+            The mixture to fill, with len(self)*len(psf) gaussians
+        """
+        if not isinstance(psf, GMix):
+            raise TypeError("Can only convolve with another GMix "
+                            " got type %s" % type(psf))
+
+        ng=len(self)*len(psf)
+        if len(dest) != ng:
+            raise GMixFatalError("dest has %d gaussians, "
+                                 "expected %d" % (len(dest), ng))
+
+        gmix_convolve_fill(dest._data, self._data, psf._data)
+
+    def make_image(self, dims, jacobian=None, fast_exp=False, parallel=None):
         """
         Render the mixture into a new image
 
@@ -487,6 +768,9 @@ class GMix(object):
             dimensions [nrows, ncols]
         fast_exp: bool, optional
             use fast, approximate exp function
+        parallel: bool, optional
+            Use the parallel kernel for large images.  Default is
+            the global setting, see ngmix.parallel
         """
 
         dims=numpy.array(dims, ndmin=1, dtype='i8')
@@ -495,7 +779,12 @@ class GMix(object):
                              "got %s" % str(dims))
 
         image=numpy.zeros(dims, dtype='f8')
-        self._fill_image(image, jacobian=jacobian, fast_exp=fast_exp)
+        self._fill_image(
+            image,
+            jacobian=jacobian,
+            fast_exp=fast_exp,
+            parallel=parallel,
+        )
         return image
 
     def make_round(self, preserve_size=False):
@@ -557,7 +846,7 @@ class GMix(object):
         return gm
 
 
-    def _fill_image(self, image, jacobian=None, fast_exp=False):
+    def _fill_image(self, image, jacobian=None, fast_exp=False, parallel=None):
         """
         Internal routine.  Render the mixture into a new image.  No error
         checking on the image!  The data are *added* to the image
@@ -568,6 +857,9 @@ class GMix(object):
             image to render into
         fast_exp: bool, optional
             use fast, approximate exp function
+        parallel: bool, optional
+            Use the parallel kernel for large images.  Default is
+            the global setting, see ngmix.parallel
         """
 
         if jacobian is None:
@@ -578,15 +870,37 @@ class GMix(object):
 
         gm=self.get_data()
 
-        coords=make_coords(image.shape, jacobian)
-        render(
-            gm,
-            coords,
-            image.ravel(),
-            fast_exp,
-        )
+        if use_parallel(image.size, parallel):
+            coords=make_coords(image.shape, jacobian)
+            render_parallel(
+                gm,
+                coords,
+                image.ravel(),
+                fast_exp,
+            )
+        elif not fast_exp:
+            # the exact exponential, evaluated from the coordinates of
+            # every pixel
+            coords=make_coords(image.shape, jacobian)
+            render(
+                gm,
+                coords,
+                image.ravel(),
+                fast_exp,
+            )
+        else:
+            # no coordinates are needed, chi^2 is evaluated along
+            # each row by recurrence
+            render_grid(
+                gm,
+                image,
+                jacobian._data,
+                fast_exp,
+                RENDER_MAX_CHI2,
+            )
 
-    def fill_fdiff(self, obs, fdiff, start=0):
+    def fill_fdiff(self, obs, fdiff, start=0, parallel=None,
+                   exp_method='table'):
         """
         Fill fdiff=(model-data)/err given the input Observation
 
@@ -599,6 +913,12 @@ class GMix(object):
             The fdiff to fill
         start: int, optional
             Where to start in the array, default 0
+        parallel: bool, optional
+            Use the parallel kernel for large images.  Default is
+            the global setting, see ngmix.parallel
+        exp_method: string or int, optional
+            The method for evaluating the exponential, 'table', 'poly' or
+            'exact'.  See ngmix.fastexp
         """
 
         nuse=fdiff.size-start
@@ -609,12 +929,40 @@ class GMix(object):
                              "len >= %d, got %d" % (image.size,nuse))
 
         gm=self.get_data()
-        fill_fdiff(
-            gm,
-            obs._pixels,
-            fdiff,
-            start,
-        )
+        exp_meth=get_exp_method(exp_method)
+
+        if use_parallel(obs.pixels.size, parallel):
+            fill_fdiff_parallel(
+                gm,
+                obs.pixels,
+                fdiff,
+                start,
+                exp_meth,
+            )
+        elif obs.has_full_pixels():
+            nrow, ncol = image.shape
+            fill_fdiff_grid(
+                gm,
+                obs.pixels_soa,
+                obs._jacobian._data,
+                nrow,
+                ncol,
+                fdiff,
+                start,
+                FDIFF_MAX_CHI2,
+                exp_meth,
+            )
+        else:
+            fill_fdiff_culled(
+                gm,
+                obs.pixels,
+                obs.pixel_index,
+                obs._jacobian._data,
+                fdiff,
+                start,
+                FDIFF_MAX_CHI2,
+                exp_meth,
+            )
 
     def get_weighted_moments(self, obs, maxrad):
         """
@@ -717,7 +1065,7 @@ class GMix(object):
         return s2n
 
 
-    def get_loglike(self, obs, more=False):
+    def get_loglike(self, obs, more=False, parallel=None, exp_method='table'):
         """
         Calculate the log likelihood given the input Observation
 
@@ -729,10 +1077,32 @@ class GMix(object):
             The Observation must have a weight map set
         more:
             if True, return a dict with more informatioin
+        parallel: bool, optional
+            Use the parallel kernel for large images.  Default is
+            the global setting, see ngmix.parallel
+        exp_method: string or int, optional
+            The method for evaluating the exponential, 'table', 'poly' or
+            'exact'.  See ngmix.fastexp
         """
 
         gm  = self.get_data()
-        res = get_loglike(gm, obs._pixels)
+        exp_meth = get_exp_method(exp_method)
+
+        if use_parallel(obs.pixels.size, parallel):
+            res = get_loglike_parallel(gm, obs.pixels, exp_meth)
+        elif obs.has_full_pixels():
+            nrow, ncol = obs.image.shape
+            res = get_loglike_grid(
+                gm,
+                obs.pixels_soa,
+                obs._jacobian._data,
+                nrow,
+                ncol,
+                FDIFF_MAX_CHI2,
+                exp_meth,
+            )
+        else:
+            res = get_loglike_soa(gm, obs.pixels_soa, exp_meth)
 
         res = pack_to_dict(res) if more else res[0]
 
@@ -824,6 +1194,29 @@ class GMix(object):
             raise ValueError("bad model: '%s'" % self._model_name)
 
         self._fill_func=_gmix_fill_functions[self._model_name]
+        self._fill_derivs_func=_gmix_fill_derivs_functions.get(
+            self._model_name,
+            None,
+        )
+
+    def __getstate__(self):
+        """
+        the fill functions are not stored; they are set again from the
+        model name when loading
+        """
+        state={}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name in ('_fill_func', '_fill_derivs_func'):
+                    continue
+                if hasattr(self, name):
+                    state[name]=getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._set_fill_func()
 
     def __len__(self):
         return self._ngauss
@@ -904,6 +1297,8 @@ class GMixModel(GMix):
     model: string or gmix type
         e.g. 'exp' or GMIX_EXP
     """
+    __slots__ = ()
+
     def __init__(self, pars, model):
 
         assert model != 'bdf','use GMixBDF for bdf model'
@@ -955,6 +1350,8 @@ class GMixCM(GMixModel):
     pars: array-like
         6-parameters, same as simple models
     """
+    __slots__ = ('_fracdev', '_TdByTe', '_Tfactor')
+
     def __init__(self, fracdev, TdByTe, pars):
 
         self._fracdev = fracdev
@@ -994,6 +1391,24 @@ class GMixCM(GMixModel):
             self._pars,
         )
 
+    def _fill_derivs(self, derivs):
+        """
+        Fill the derivatives of the gaussian parameters with respect
+        to the current model parameters.
+
+        parameters
+        ----------
+        derivs: array
+            [ngauss, 6, npars] array to fill
+        """
+        self._fill_derivs_func(
+            derivs,
+            self._fracdev,
+            self._TdByTe,
+            self._Tfactor,
+            self._pars,
+        )
+
 
     def __repr__(self):
         rep=super(GMixCM,self).__repr__()
@@ -1021,6 +1436,8 @@ class GMixBDF(GMixModel):
         But 1.0 provides much more stable fits generally and does not reduce
         accuracy much.
     """
+    __slots__ = ('_TdByTe',)
+
     def __init__(self, pars=None, TdByTe=1.0):
         assert pars is not None,'send pars='
         assert TdByTe is not None,'send TdByTe='
@@ -1057,6 +1474,22 @@ class GMixBDF(GMixModel):
             self._TdByTe,
         )
 
+    def _fill_derivs(self, derivs):
+        """
+        Fill the derivatives of the gaussian parameters with respect
+        to the current model parameters.
+
+        parameters
+        ----------
+        derivs: array
+            [ngauss, 6, npars] array to fill
+        """
+        self._fill_derivs_func(
+            derivs,
+            self._pars,
+            self._TdByTe,
+        )
+
 
     def __repr__(self):
         rep=super(GMixBDF,self).__repr__()
@@ -1093,7 +1526,7 @@ class GMixCoellip(GMixModel):
         Parameter array. The number of elements will depend
         on the model type.
     """
-
+    __slots__ = ()
 
     def __init__(self, pars):
 
@@ -1431,3 +1864,228 @@ def get_weighted_moments_stats(ares):
             res['flagstr'] = 'zero var'
 
     return res
+
+_weighted_moments_batch_dtype=numpy.dtype([
+    ('flags','i4'),
+    ('nimage','i4'),
+    ('npix','i4'),
+    ('wsum','f8'),
+    ('sums','f8',6),
+    ('sums_cov','f8',(6,6)),
+    ('pars','f8',6),
+    ('flux','f8'),
+    ('flux_err','f8'),
+    ('s2n','f8'),
+    ('T','f8'),
+    ('T_err','f8'),
+    ('e','f8',2),
+    ('e_cov','f8',(2,2)),
+], align=True)
+
+def get_weighted_moments_batch(obs_list, wts, maxrad):
+    """
+    Get weighted moments for many objects, with a fixed weight for each
+    object, in a single compiled call that runs in parallel over objects.
+
+    Each object can be an Observation, ObsList or MultiBandObsList.  The
+    weight for an object is used for all of its observations, and the sums
+    are added over the observations, as when sending res= to
+    GMix.get_weighted_sums for each observation.  The weight center is in
+    the coordinates of each observation's jacobian
+
+    parameters
+    ----------
+    obs_list: sequence
+        Sequence of Observation, ObsList or MultiBandObsList, one per object
+    wts: GMix, list of GMix or array
+        A single weight for all objects, or one per object, all with the
+        same number of gaussians.  Can also be an [nobj, ngauss] gaussian
+        array
+    maxrad: float
+        Only pixels within this radius of the weight center are used
+
+    returns
+    -------
+    [nobj] result array with the sums as well as summary statistics such
+    as flux, T, e and s2n; see get_weighted_moments_stats_batch
+    """
+    from .batchfit import pack_pixels
+
+    nobj = len(obs_list)
+
+    wtarray = _get_weight_array(wts, nobj)
+
+    flat_obs_list = []
+    obs_offsets = numpy.zeros(nobj+1, dtype='i8')
+    for iobj, obj_obs in enumerate(obs_list):
+        tlist = _get_flat_obs_list(obj_obs)
+        flat_obs_list += tlist
+        obs_offsets[iobj+1] = obs_offsets[iobj] + len(tlist)
+
+    pixels, offsets = pack_pixels(flat_obs_list)
+
+    res = numpy.zeros(nobj, dtype=_weighted_moments_batch_dtype)
+
+    get_weighted_sums_batch(
+        wtarray,
+        pixels,
+        offsets,
+        obs_offsets,
+        res,
+        maxrad,
+    )
+
+    get_weighted_moments_stats_batch(res)
+    return res
+
+def get_weighted_moments_stats_batch(res):
+    """
+    fill in the summary statistics from the sums, for an array with
+    dtype _weighted_moments_batch_dtype.  The flags are the same as
+    for get_weighted_moments_stats
+
+    parameters
+    ----------
+    res: array
+        The result array, modified in place
+    """
+
+    sums = res['sums']
+    sums_cov = res['sums_cov']
+
+    res['flux'] = sums[:,5]
+    res['pars'][:,5] = res['flux']
+
+    res['flux_err'] = 9999.0
+    res['T'] = -9999.0
+    res['T_err'] = 9999.0
+    res['s2n'] = -9999.0
+    res['e'] = -9999.0
+    res['e_cov'] = 0.0
+    res['e_cov'][:,0,0] = 9999.0
+    res['e_cov'][:,1,1] = 9999.0
+
+    fvar = sums_cov[:,5,5]
+    w, = numpy.where(fvar > 0.0)
+    if w.size > 0:
+        res['flux_err'][w] = sqrt(fvar[w])
+        res['s2n'][w] = res['flux'][w]/res['flux_err'][w]
+
+    res['flags'][fvar <= 0.0] |= 0x40
+
+    flux = res['flux']
+    res['flags'][flux <= 0.0] |= 0x4
+
+    w, = numpy.where(flux > 0.0)
+    if w.size > 0:
+        finv = 1.0/flux[w]
+        for i in xrange(5):
+            res['pars'][w,i] = sums[w,i]*finv
+
+        T = res['pars'][w,4]
+        res['T'][w] = T
+        res['T_err'][w] = _get_ratio_error_array(
+            sums[w,4],
+            sums[w,5],
+            sums_cov[w,4,4],
+            sums_cov[w,5,5],
+            sums_cov[w,4,5],
+        )
+
+        bad = T <= 0.0
+        res['flags'][w[bad]] |= 0x8
+
+        w = w[~bad]
+        if w.size > 0:
+            T = res['T'][w]
+            res['e'][w,0] = res['pars'][w,2]/T
+            res['e'][w,1] = res['pars'][w,3]/T
+
+            e1_err = _get_ratio_error_array(
+                sums[w,2],
+                sums[w,4],
+                sums_cov[w,2,2],
+                sums_cov[w,4,4],
+                sums_cov[w,2,4],
+            )
+            e2_err = _get_ratio_error_array(
+                sums[w,3],
+                sums[w,4],
+                sums_cov[w,3,3],
+                sums_cov[w,4,4],
+                sums_cov[w,3,4],
+            )
+
+            good = isfinite(e1_err) & isfinite(e2_err)
+            wgood = w[good]
+            res['e_cov'][wgood,0,0] = e1_err[good]**2
+            res['e_cov'][wgood,1,1] = e2_err[good]**2
+
+def _get_ratio_error_array(a, b, var_a, var_b, cov_ab):
+    """
+    error on a/b for arrays, see admom.get_ratio_error.  b must
+    be non-zero
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rsq = (a/b)**2
+        var = rsq * (  var_a/a**2 + var_b/b**2 - 2*cov_ab/(a*b) )
+
+    var = var.clip(min=0.0)
+    return sqrt(var)
+
+def _get_weight_array(wts, nobj):
+    """
+    get the [nobj, ngauss] gaussian array for the weights, with
+    norms set
+    """
+    if isinstance(wts, GMix):
+        wts.set_norms_if_needed()
+        wtarray = numpy.zeros( (nobj, len(wts)), dtype=_gauss2d_dtype)
+        wtarray[:] = wts.get_data()
+    elif isinstance(wts, numpy.ndarray):
+        wtarray = wts
+        if wtarray.ndim == 1:
+            wtarray = wtarray.reshape(1, -1)
+        if wtarray.dtype != numpy.dtype(_gauss2d_dtype):
+            raise ValueError("weight array must have the gaussian dtype")
+
+        for i in xrange(wtarray.shape[0]):
+            if wtarray['norm_set'][i,0] == 0:
+                gmix_set_norms(wtarray[i])
+
+        if wtarray.shape[0] == 1 and nobj > 1:
+            wtarray = numpy.vstack([wtarray]*nobj)
+    else:
+        sizes = set([len(wt) for wt in wts])
+        if len(sizes) > 1:
+            raise ValueError("all weights must have the same "
+                             "number of gaussians, got %s" % sorted(sizes))
+        for wt in wts:
+            wt.set_norms_if_needed()
+        wtarray = numpy.vstack([wt.get_data() for wt in wts])
+
+    if wtarray.shape[0] != nobj:
+        raise ValueError("expected 1 or %d weights, got "
+                         "%d" % (nobj, wtarray.shape[0]))
+
+    return wtarray
+
+def _get_flat_obs_list(obs):
+    """
+    get a list of the Observations in an Observation, ObsList or
+    MultiBandObsList
+    """
+    from .observation import Observation, ObsList, MultiBandObsList
+
+    if isinstance(obs, Observation):
+        return [obs]
+    elif isinstance(obs, ObsList):
+        return list(obs)
+    elif isinstance(obs, MultiBandObsList):
+        flat_list = []
+        for obslist in obs:
+            flat_list += list(obslist)
+        return flat_list
+    else:
+        raise ValueError("expected Observation, ObsList or "
+                         "MultiBandObsList, got %s" % type(obs))
@@ -5,8 +5,9 @@ except NameError:
 
 import numpy
 from numpy import array, nan
-from numba import njit
-from .fastexp_nb import exp3
+from numba import njit, prange
+from .fastexp_nb import exp_method
+from .fastexp import EXP_TABLE
 
 # need to make this a pure python exception
 from .gexceptions import GMixRangeError
@@ -14,7 +15,7 @@ from .gexceptions import GMixRangeError
 GMIX_LOW_DETVAL=1.0e-200
 
 @njit
-def gmix_eval_pixel_fast(gmix, pixel, max_chi2=25.0):
+def gmix_eval_pixel_fast(gmix, pixel, max_chi2=25.0, exp_meth=EXP_TABLE):
     """
     evaluate a single gaussian mixture, using the
     fast exponential
@@ -26,13 +27,14 @@ def gmix_eval_pixel_fast(gmix, pixel, max_chi2=25.0):
             gmix[igauss],
             pixel,
             max_chi2,
+            exp_meth,
         )
 
 
     return model_val
 
 @njit
-def gauss2d_eval_pixel_fast(gauss, pixel, max_chi2=25.0):
+def gauss2d_eval_pixel_fast(gauss, pixel, max_chi2=25.0, exp_meth=EXP_TABLE):
     """
     evaluate a 2-d gaussian at the specified location, using
     the fast exponential
@@ -43,6 +45,10 @@ def gauss2d_eval_pixel_fast(gauss, pixel, max_chi2=25.0):
         row,col,dcc,drr,drc,pnorm... See gmix.py
     v,u: numbers
         location in v,u plane (row,col for simple transforms)
+    max_chi2: float, optional
+        The gaussian is only evaluated within this chi^2
+    exp_meth: int, optional
+        The method for the exponential, see fastexp.py
     """
     model_val=0.0
 
@@ -55,10 +61,146 @@ def gauss2d_eval_pixel_fast(gauss, pixel, max_chi2=25.0):
             - 2.0*gauss['drc']*vdiff*udiff )
 
     if chi2 < max_chi2 and chi2 >= 0.0:
-        model_val = gauss['pnorm']*exp3( -0.5*chi2 )
+        model_val = gauss['pnorm']*exp_method( -0.5*chi2, exp_meth )
 
     return model_val
 
+@njit
+def gauss2d_get_pixel_box(gauss, jacob, max_chi2, nrow, ncol):
+    """
+    get the range of pixels that can be within max_chi2 of the
+    center of the gaussian
+
+    The ellipse chi^2 = max_chi2 is mapped to pixel space using the inverse
+    of the jacobian, and the bounding box of the ellipse is clipped to the
+    image
+
+    parameters
+    ----------
+    gauss: gauss2d structure
+        row,col,irr,irc,icc... See gmix.py
+    jacob: jacobian structure
+        row0,col0,dvdrow,dvdcol,dudrow,dudcol,det
+    max_chi2: float
+        The maximum chi^2 for which the gaussian is evaluated
+    nrow, ncol: int
+        dimensions of the image
+
+    returns
+    -------
+    rowmin, rowmax, colmin, colmax: int
+        The inclusive range of rows and columns.  If the box does not
+        overlap the image, rowmax < rowmin or colmax < colmin
+    """
+
+    det = jacob['det'][0]
+
+    # rows of the inverse jacobian, row = jinv*[v,u]
+    rv =  jacob['dudcol'][0]/det
+    ru = -jacob['dvdcol'][0]/det
+    cv = -jacob['dudrow'][0]/det
+    cu =  jacob['dvdrow'][0]/det
+
+    irr = gauss['irr']
+    irc = gauss['irc']
+    icc = gauss['icc']
+
+    # variance along row and column in pixel space
+    rowvar = rv*rv*irr + 2.0*rv*ru*irc + ru*ru*icc
+    colvar = cv*cv*irr + 2.0*cv*cu*irc + cu*cu*icc
+
+    rowrad = numpy.sqrt(max_chi2*rowvar)
+    colrad = numpy.sqrt(max_chi2*colvar)
+
+    rowcen = jacob['row0'][0] + rv*gauss['row'] + ru*gauss['col']
+    colcen = jacob['col0'][0] + cv*gauss['row'] + cu*gauss['col']
+
+    rowmin = max(int(numpy.ceil(rowcen - rowrad)), 0)
+    rowmax = min(int(numpy.floor(rowcen + rowrad)), nrow-1)
+    colmin = max(int(numpy.ceil(colcen - colrad)), 0)
+    colmax = min(int(numpy.floor(colcen + colrad)), ncol-1)
+
+    return rowmin, rowmax, colmin, colmax
+
+@njit
+def gauss2d_get_row_chi2(gauss, jacob, row, ncol, max_chi2):
+    """
+    get the range of columns in an image row for which chi^2 < max_chi2,
+    and the values needed to evaluate chi^2 along the row by recurrence
+
+    For an affine jacobian chi^2 is quadratic in the column, so
+
+        chi2(col+1) = chi2(col) + d1(col)
+        d1(col+1)   = d1(col) + d2
+
+    parameters
+    ----------
+    gauss: gauss2d structure
+        row,col,dcc,drr,drc... See gmix.py
+    jacob: jacobian structure
+        row0,col0,dvdrow,dvdcol,dudrow,dudcol
+    row: int
+        The image row
+    ncol: int
+        Number of columns in the image
+    max_chi2: float
+        The maximum chi^2, can be inf to get all columns
+
+    returns
+    -------
+    colmin, colmax, chi2, d1, d2
+        colmin, colmax is the inclusive range of columns, empty if
+        colmax < colmin.  chi2 and d1 are evaluated at colmin
+    """
+
+    dcc = gauss['dcc']
+    drr = gauss['drr']
+    drc = gauss['drc']
+
+    # v, u offsets from the center at column zero, and the step per column
+    rowdiff = row - jacob['row0'][0]
+    coldiff = -jacob['col0'][0]
+    dv = jacob['dvdcol'][0]
+    du = jacob['dudcol'][0]
+    vdiff0 = jacob['dvdrow'][0]*rowdiff + dv*coldiff - gauss['row']
+    udiff0 = jacob['dudrow'][0]*rowdiff + du*coldiff - gauss['col']
+
+    # chi2 = A*col^2 + B*col + C, but evaluated about the minimum
+    # rather than using C, for numerical stability
+    A = dcc*dv*dv + drr*du*du - 2.0*drc*dv*du
+    B = 2.0*(dcc*vdiff0*dv + drr*udiff0*du - drc*(vdiff0*du + udiff0*dv))
+
+    colmin = 0
+    colmax = ncol-1
+
+    if A > 0.0:
+        cmid = -B/(2.0*A)
+
+        vdiff = vdiff0 + dv*cmid
+        udiff = udiff0 + du*cmid
+        chi2mid = dcc*vdiff*vdiff + drr*udiff*udiff - 2.0*drc*vdiff*udiff
+
+        if chi2mid >= max_chi2:
+            return 0, -1, 0.0, 0.0, 0.0
+
+        halfwidth = numpy.sqrt( (max_chi2 - chi2mid)/A )
+        cmin = max(cmid - halfwidth, 0.0)
+        cmax = min(cmid + halfwidth, ncol-1.0)
+        if cmax < cmin:
+            return 0, -1, 0.0, 0.0, 0.0
+
+        colmin = int(numpy.ceil(cmin))
+        colmax = int(numpy.floor(cmax))
+
+    vdiff = vdiff0 + dv*colmin
+    udiff = udiff0 + du*colmin
+    chi2 = dcc*vdiff*vdiff + drr*udiff*udiff - 2.0*drc*vdiff*udiff
+
+    d1 = A*(2*colmin + 1) + B
+    d2 = 2.0*A
+
+    return colmin, colmax, chi2, d1, d2
+
 @njit
 def gauss2d_eval_pixel(gauss, pixel):
     """
@@ -579,6 +721,246 @@ def get_cm_Tfactor(fracdev, TdByTe):
 
     return Tfactor
 
+@njit
+def gmix_fill_simple_derivs(derivs, pars, fvals, pvals):
+    """
+    fill the derivatives of the gaussian parameters with respect
+    to the simple (6 parameter) model parameters
+
+    no error checking done here
+
+    parameters
+    ----------
+    derivs: array
+        [ngauss, 6, npars] array to fill.  The second dimension
+        holds derivatives of p,row,col,irr,irc,icc
+    pars: array
+        [cen1,cen2,g1,g2,T,flux]
+    """
+
+    T = pars[4]
+
+    e1, e2, de1dg1, de1dg2, de2dg1, de2dg2 = g1g2_to_e1e2_derivs(
+        pars[2],
+        pars[3],
+    )
+
+    derivs[:, :, :] = 0.0
+
+    n_gauss=derivs.shape[0]
+    for i in xrange(n_gauss):
+
+        deriv = derivs[i]
+
+        dT_i_2 = 0.5*fvals[i]
+        T_i_2 = T*dT_i_2
+
+        deriv[0, 5] = pvals[i]
+        deriv[1, 0] = 1.0
+        deriv[2, 1] = 1.0
+
+        gauss2d_fill_shape_derivs(
+            deriv, T_i_2,
+            de1dg1, de1dg2, de2dg1, de2dg2,
+        )
+        gauss2d_add_size_derivs(deriv, 4, dT_i_2, e1, e2)
+
+@njit
+def gmix_fill_exp_derivs(derivs, pars):
+    """
+    fill derivatives for an exponential model
+    """
+    gmix_fill_simple_derivs(derivs, pars, _fvals_exp, _pvals_exp)
+
+@njit
+def gmix_fill_dev_derivs(derivs, pars):
+    """
+    fill derivatives for a dev model
+    """
+    gmix_fill_simple_derivs(derivs, pars, _fvals_dev, _pvals_dev)
+
+@njit
+def gmix_fill_turb_derivs(derivs, pars):
+    """
+    fill derivatives for a turbulent psf model
+    """
+    gmix_fill_simple_derivs(derivs, pars, _fvals_turb, _pvals_turb)
+
+@njit
+def gmix_fill_gauss_derivs(derivs, pars):
+    """
+    fill derivatives for a gaussian model
+    """
+    gmix_fill_simple_derivs(derivs, pars, _fvals_gauss, _pvals_gauss)
+
+@njit
+def gmix_fill_coellip_derivs(derivs, pars):
+    """
+    fill derivatives for a coelliptical model
+
+    [cen1,cen2,g1,g2,T1,T2,...,F1,F2...]
+    """
+
+    e1, e2, de1dg1, de1dg2, de2dg1, de2dg2 = g1g2_to_e1e2_derivs(
+        pars[2],
+        pars[3],
+    )
+
+    derivs[:, :, :] = 0.0
+
+    n_gauss=derivs.shape[0]
+    for i in xrange(n_gauss):
+
+        deriv = derivs[i]
+
+        T_i_2 = 0.5*pars[4+i]
+
+        deriv[0, 4+n_gauss+i] = 1.0
+        deriv[1, 0] = 1.0
+        deriv[2, 1] = 1.0
+
+        gauss2d_fill_shape_derivs(
+            deriv, T_i_2,
+            de1dg1, de1dg2, de2dg1, de2dg2,
+        )
+        gauss2d_add_size_derivs(deriv, 4+i, 0.5, e1, e2)
+
+@njit
+def gmix_fill_cm_derivs(derivs, fracdev, TdByTe, Tfactor, pars):
+    """
+    fill derivatives for a composite model
+    """
+
+    T    = pars[4] * Tfactor
+
+    ifracdev = 1.0-fracdev
+
+    e1, e2, de1dg1, de1dg2, de2dg1, de2dg2 = g1g2_to_e1e2_derivs(
+        pars[2],
+        pars[3],
+    )
+
+    derivs[:, :, :] = 0.0
+
+    for i in xrange(16):
+        if i < 6:
+            p = _pvals_exp[i] * ifracdev
+            f = _fvals_exp[i]
+        else:
+            p = _pvals_dev[i-6] * fracdev
+            f = _fvals_dev[i-6] * TdByTe
+
+        deriv = derivs[i]
+
+        T_i_2 = 0.5*T*f
+
+        deriv[0, 5] = p
+        deriv[1, 0] = 1.0
+        deriv[2, 1] = 1.0
+
+        gauss2d_fill_shape_derivs(
+            deriv, T_i_2,
+            de1dg1, de1dg2, de2dg1, de2dg2,
+        )
+        gauss2d_add_size_derivs(deriv, 4, 0.5*Tfactor*f, e1, e2)
+
+@njit
+def gmix_fill_bdf_derivs(derivs, pars, TdByTe):
+    """
+    fill derivatives for a composite model with fixed Td/Te but fracdev
+    varying
+
+    [cen1,cen2,g1,g2,T,fracdev,flux]
+    """
+
+    T       = pars[4]
+    fracdev = pars[5]
+    flux    = pars[6]
+
+    Tfactor  = get_cm_Tfactor(fracdev, TdByTe)
+
+    # Tfactor = 1/sum(p_i f_i), which is linear in fracdev
+    sum_exp = 0.0
+    for i in xrange(6):
+        sum_exp += _pvals_exp[i]*_fvals_exp[i]
+    sum_dev = 0.0
+    for i in xrange(10):
+        sum_dev += _pvals_dev[i]*_fvals_dev[i]*TdByTe
+
+    dTfactor = -(sum_dev - sum_exp)*Tfactor*Tfactor
+
+    ifracdev = 1.0-fracdev
+
+    e1, e2, de1dg1, de1dg2, de2dg1, de2dg2 = g1g2_to_e1e2_derivs(
+        pars[2],
+        pars[3],
+    )
+
+    derivs[:, :, :] = 0.0
+
+    for i in xrange(16):
+        if i < 6:
+            pval = _pvals_exp[i]
+            p = pval * ifracdev
+            dp = -pval
+            f = _fvals_exp[i]
+        else:
+            pval = _pvals_dev[i-6]
+            p = pval * fracdev
+            dp = pval
+            f = _fvals_dev[i-6] * TdByTe
+
+        deriv = derivs[i]
+
+        T_i_2 = 0.5*T*Tfactor*f
+
+        deriv[0, 5] = flux*dp
+        deriv[0, 6] = p
+        deriv[1, 0] = 1.0
+        deriv[2, 1] = 1.0
+
+        gauss2d_fill_shape_derivs(
+            deriv, T_i_2,
+            de1dg1, de1dg2, de2dg1, de2dg2,
+        )
+        gauss2d_add_size_derivs(deriv, 4, 0.5*Tfactor*f, e1, e2)
+        gauss2d_add_size_derivs(deriv, 5, 0.5*T*f*dTfactor, e1, e2)
+
+@njit
+def gauss2d_fill_shape_derivs(deriv, T_i_2, de1dg1, de1dg2, de2dg1, de2dg2):
+    """
+    fill the derivatives of irr,irc,icc with respect to g1,g2, which
+    are always parameters 2 and 3
+
+    irr = T_i_2*(1-e1), irc = T_i_2*e2, icc = T_i_2*(1+e1)
+    """
+    deriv[3, 2] = -T_i_2*de1dg1
+    deriv[3, 3] = -T_i_2*de1dg2
+    deriv[4, 2] =  T_i_2*de2dg1
+    deriv[4, 3] =  T_i_2*de2dg2
+    deriv[5, 2] =  T_i_2*de1dg1
+    deriv[5, 3] =  T_i_2*de1dg2
+
+@njit
+def gauss2d_add_size_derivs(deriv, ipar, dT_i_2, e1, e2):
+    """
+    add the derivatives of irr,irc,icc with respect to a parameter
+    ipar, given the derivative of T_i/2 with respect to that parameter
+    """
+    deriv[3, ipar] += dT_i_2*(1-e1)
+    deriv[4, ipar] += dT_i_2*e2
+    deriv[5, ipar] += dT_i_2*(1+e1)
+
+_gmix_fill_derivs_functions={
+    'exp': gmix_fill_exp_derivs,
+    'dev': gmix_fill_dev_derivs,
+    'turb': gmix_fill_turb_derivs,
+    'gauss': gmix_fill_gauss_derivs,
+    'cm': gmix_fill_cm_derivs,
+    'bdf': gmix_fill_bdf_derivs,
+    'coellip': gmix_fill_coellip_derivs,
+}
+
 _gmix_fill_functions={
     'exp': gmix_fill_exp,
     'dev': gmix_fill_dev,
@@ -634,6 +1016,137 @@ def gmix_convolve_fill(self, gmix, psf):
 
             itot += 1
 
+@njit
+def gmix_fill_simple_batch(gmixes, pars, fvals, pvals):
+    """
+    fill a set of simple (6 parameter) gaussian mixture models
+
+    parameters
+    ----------
+    gmixes: array
+        [nobj, ngauss] array of gaussians to fill
+    pars: array
+        [nobj, 6] array of parameters
+    fvals, pvals: arrays
+        The T and flux fractions for the model
+    """
+    for i in xrange(gmixes.shape[0]):
+        gmix_fill_simple(gmixes[i], pars[i], fvals, pvals)
+
+@njit
+def gmix_fill_exp_batch(gmixes, pars):
+    """
+    fill a set of exponential models
+    """
+    gmix_fill_simple_batch(gmixes, pars, _fvals_exp, _pvals_exp)
+
+@njit
+def gmix_fill_dev_batch(gmixes, pars):
+    """
+    fill a set of dev models
+    """
+    gmix_fill_simple_batch(gmixes, pars, _fvals_dev, _pvals_dev)
+
+@njit
+def gmix_fill_turb_batch(gmixes, pars):
+    """
+    fill a set of turbulent psf models
+    """
+    gmix_fill_simple_batch(gmixes, pars, _fvals_turb, _pvals_turb)
+
+@njit
+def gmix_fill_gauss_batch(gmixes, pars):
+    """
+    fill a set of gaussian models
+    """
+    gmix_fill_simple_batch(gmixes, pars, _fvals_gauss, _pvals_gauss)
+
+@njit
+def gmix_fill_coellip_batch(gmixes, pars):
+    """
+    fill a set of coelliptical models
+    """
+    for i in xrange(gmixes.shape[0]):
+        gmix_fill_coellip(gmixes[i], pars[i])
+
+@njit
+def gmix_fill_full_batch(gmixes, pars):
+    """
+    fill a set of full models
+    """
+    for i in xrange(gmixes.shape[0]):
+        gmix_fill_full(gmixes[i], pars[i])
+
+@njit
+def gmix_fill_cm_batch(gmixes, fracdev, TdByTe, pars):
+    """
+    fill a set of composite models
+
+    parameters
+    ----------
+    gmixes: array
+        [nobj, 16] array of gaussians to fill
+    fracdev, TdByTe: arrays
+        [nobj] arrays of fracdev and TdByTe for each object
+    pars: array
+        [nobj, 6] array of parameters
+    """
+    for i in xrange(gmixes.shape[0]):
+        Tfactor = get_cm_Tfactor(fracdev[i], TdByTe[i])
+        gmix_fill_cm(gmixes[i], fracdev[i], TdByTe[i], Tfactor, pars[i])
+
+@njit
+def gmix_fill_bd_batch(gmixes, pars):
+    """
+    fill a set of bulge plus disk models
+    """
+    for i in xrange(gmixes.shape[0]):
+        gmix_fill_bd(gmixes[i], pars[i])
+
+@njit
+def gmix_fill_bdf_batch(gmixes, pars, TdByTe):
+    """
+    fill a set of bdf models, all with the same TdByTe
+    """
+    for i in xrange(gmixes.shape[0]):
+        gmix_fill_bdf(gmixes[i], pars[i], TdByTe)
+
+_gmix_fill_batch_functions={
+    'exp': gmix_fill_exp_batch,
+    'dev': gmix_fill_dev_batch,
+    'turb': gmix_fill_turb_batch,
+    'gauss': gmix_fill_gauss_batch,
+    'cm': gmix_fill_cm_batch,
+    'bd': gmix_fill_bd_batch,
+    'bdf': gmix_fill_bdf_batch,
+    'coellip': gmix_fill_coellip_batch,
+    'full':gmix_fill_full_batch,
+}
+
+@njit
+def gmix_convolve_fill_batch(output, gmixes, psfs):
+    """
+    fill a set of gaussian mixtures with the convolution of each object
+    with its psf
+
+    parameters
+    ----------
+    output: array
+        [nobj, ngauss*npsf] array of gaussians to fill
+    gmixes: array
+        [nobj, ngauss] array of unconvolved mixtures
+    psfs: array
+        [nobj, npsf] array of psf mixtures, or [1, npsf] to use the same
+        psf for all objects
+    """
+    shared = psfs.shape[0] == 1
+    for i in xrange(gmixes.shape[0]):
+        if shared:
+            ipsf = 0
+        else:
+            ipsf = i
+        gmix_convolve_fill(output[i], gmixes[i], psfs[ipsf])
+
 @njit
 def g1g2_to_e1e2(g1, g2):
     """
@@ -662,6 +1175,48 @@ def g1g2_to_e1e2(g1, g2):
 
     return e1, e2
 
+@njit
+def g1g2_to_e1e2_derivs(g1, g2):
+    """
+    convert g to e, also returning the derivatives
+
+    returns
+    -------
+    e1, e2, de1/dg1, de1/dg2, de2/dg1, de2/dg2
+    """
+
+    g=numpy.sqrt(g1*g1 + g2*g2)
+
+    if g >= 1:
+        raise GMixRangeError("g >= 1")
+
+    if g == 0.0:
+        # e = 2 g for small g
+        return 0.0, 0.0, 2.0, 0.0, 0.0, 2.0
+
+    eta = 2*numpy.arctanh(g)
+    e = numpy.tanh(eta)
+    if e >= 1.:
+        e = 0.99999999
+
+    fac = e/g
+
+    # de/dg then d(e/g)/dg
+    dedg = 2*(1-e*e)/(1-g*g)
+    dfac = (dedg - fac)/g
+
+    ig = 1.0/g
+
+    e1 = fac*g1
+    e2 = fac*g2
+
+    de1dg1 = fac + g1*g1*ig*dfac
+    de1dg2 = g1*g2*ig*dfac
+    de2dg1 = de1dg2
+    de2dg2 = fac + g2*g2*ig*dfac
+
+    return e1, e2, de1dg1, de1dg2, de2dg1, de2dg2
+
 
 
 @njit
@@ -709,5 +1264,126 @@ def get_weighted_sums(wt, pixels, res, maxrad):
                 for j in xrange(6):
                     res['sums_cov'][i,j] += w2*var*F[i]*F[j]
 
+@njit
+def get_weighted_sums_accum(wt, pixels, maxrad2, sums, sums_cov):
+    """
+    add the sums for the weighted moments to local arrays in a single pass
+    over the pixels.  Only the upper triangle of sums_cov is filled
+
+    returns
+    -------
+    wsum, npix
+    """
+
+    vcen = wt['row'][0]
+    ucen = wt['col'][0]
+
+    F = numpy.zeros(6)
+    F[5] = 1.0
+
+    wsum = 0.0
+    npix = 0
+
+    n_pixels = pixels.size
+    for i_pixel in xrange(n_pixels):
+
+        pixel = pixels[i_pixel]
+
+        vmod = pixel['v']-vcen
+        umod = pixel['u']-ucen
+
+        rad2 = umod*umod + vmod*vmod
+        if rad2 < maxrad2:
+
+            weight = gmix_eval_pixel(wt, pixel)
+            ierr = pixel['ierr']
+
+            wdata = weight*pixel['val']
+            w2var = weight*weight/(ierr*ierr)
+
+            F[0] = pixel['v']
+            F[1] = pixel['u']
+            F[2] = umod*umod - vmod*vmod
+            F[3] = 2*vmod*umod
+            F[4] = rad2
+
+            wsum += weight
+            npix += 1
+
+            for i in xrange(6):
+                sums[i] += wdata*F[i]
+                w2varF = w2var*F[i]
+                for j in xrange(i, 6):
+                    sums_cov[i,j] += w2varF*F[j]
+
+    return wsum, npix
+
+@njit(parallel=True)
+def get_weighted_sums_batch(wts, pixels, offsets, obs_offsets, resarray, maxrad):
+    """
+    do sums for calculating the weighted moments for many objects, in
+    parallel over objects.  Each object can have multiple observations,
+    which share the weight for that object; the sums are added over the
+    observations
+
+    parameters
+    ----------
+    wts: array
+        [nobj, ngauss] gaussian array holding the weight for each object.
+        The norms must be set
+    pixels: array
+        packed pixels for all observations, the pixels for observation i
+        are pixels[offsets[i]:offsets[i+1]]
+    offsets: array
+        [nobs+1] offsets into the pixels array
+    obs_offsets: array
+        [nobj+1] array, the observations for object i are
+        obs_offsets[i]:obs_offsets[i+1]
+    resarray: array
+        [nobj] result array, sums are added to the wsum, npix, nimage, sums
+        and sums_cov fields
+    maxrad: float
+        only pixels within this radius of the weight center are used
+    """
+
+    maxrad2 = maxrad**2
+
+    nobj = wts.shape[0]
+    for iobj in prange(nobj):
+
+        wt = wts[iobj]
+        res = resarray[iobj]
+
+        sums = numpy.zeros(6)
+        sums_cov = numpy.zeros( (6,6) )
+
+        wsum = 0.0
+        npix = 0
+
+        for iobs in xrange(obs_offsets[iobj], obs_offsets[iobj+1]):
+            start = offsets[iobs]
+            end = offsets[iobs+1]
+
+            twsum, tnpix = get_weighted_sums_accum(
+                wt,
+                pixels[start:end],
+                maxrad2,
+                sums,
+                sums_cov,
+            )
+            wsum += twsum
+            npix += tnpix
+
+        res['wsum'] += wsum
+        res['npix'] += npix
+        res['nimage'] += obs_offsets[iobj+1] - obs_offsets[iobj]
+
+        for i in xrange(6):
+            res['sums'][i] += sums[i]
+            for j in xrange(i, 6):
+                res['sums_cov'][i,j] += sums_cov[i,j]
+                if j != i:
+                    res['sums_cov'][j,i] += sums_cov[i,j]
+
 
 
@@ -299,7 +299,8 @@ def leastsqbound(func, x0, args=(), bounds=None, Dfun=None, full_output=0,
         epsfcn = finfo(dtype).eps
 
     # define a wrapped func which accept internal parameters, converts them
-    # to external parameters and calls func
+    # to external parameters and calls func.  New arrays are returned for
+    # each call, since MINPACK may keep references to earlier results
     def wfunc(x, *args):
         return func(i2e(x), *args)
 
@@ -372,7 +373,7 @@ def leastsqbound(func, x0, args=(), bounds=None, Dfun=None, full_output=0,
                              retval[1]['ipvt'] - 1)).T
         cov_x = None
         if info in [1, 2, 3, 4]:
-            from numpy.dual import inv
+            from numpy.linalg import inv
             from numpy.linalg import LinAlgError
             perm = take(eye(n), retval[1]['ipvt'] - 1, 0)
             r = triu(transpose(retval[1]['fjac'])[:n, :])
@@ -1,4 +1,8 @@
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from meds import MEDS as _MEDS
 
@@ -6,6 +10,16 @@ from .observation import MultiBandObsList, Observation, ObsList
 from .jacobian import Jacobian
 from .gexceptions import GMixFatalError
 
+# numpy types for FITS BITPIX values, for memory mapping cutout HDUs
+_BITPIX_DTYPES = {
+    8: 'u1',
+    16: '>i2',
+    32: '>i4',
+    64: '>i8',
+    -32: '>f4',
+    -64: '>f8',
+}
+
 
 class MultiBandNGMixMEDS(object):
     """Interface to NGMixMEDS objects in more than one band.
@@ -26,6 +40,12 @@ class MultiBandNGMixMEDS(object):
         Get a list of `MultiBandObsList` for all or a set of objects.
     get_mbobs(iobj, weight_type='weight')
         Get a `MultiBandObsList` for a given object.
+    get_mbobs_range(start, stop, weight_type='weight')
+        Get a list of `MultiBandObsList` for a contiguous range of objects,
+        reading the cutouts in bulk.
+    iter_mbobs(indices=None, weight_type='weight', prefetch=8)
+        Iterate over `MultiBandObsList`s, reading ahead on background
+        threads.
     """
     def __init__(self, mlist):
         self.mlist = mlist
@@ -77,6 +97,98 @@ class MultiBandNGMixMEDS(object):
 
         return list_of_obs
 
+    def get_mbobs_range(self, start, stop, weight_type='weight'):
+        """Get a list of `MultiBandObsList` for a contiguous range of
+        objects.  The cutouts for each band are read in bulk, see
+        `NGMixMEDS.get_obs_range`.
+
+        Parameters
+        ----------
+        start : int
+            Index of the first object.
+        stop : int
+            One past the index of the last object.
+        weight_type: string, optional
+            Weight type, see `get_mbobs`.  Default is 'weight'
+
+        Returns
+        -------
+        mbobs_list : list of ngmix.MultiBandObsList
+            The list of `MultiBandObsList`s for the objects.
+        """
+        band_obslists = [
+            m.get_obs_range(start, stop, weight_type=weight_type)
+            for m in self.mlist
+        ]
+
+        list_of_obs = []
+        for obslists in zip(*band_obslists):
+            mbobs = MultiBandObsList()
+            for obslist in obslists:
+                mbobs.append(obslist)
+            list_of_obs.append(mbobs)
+
+        return list_of_obs
+
+    def iter_mbobs(self, indices=None, weight_type='weight', prefetch=8):
+        """Iterate over `MultiBandObsList`s for all or a set of objects.
+
+        The cutouts for the next `prefetch` objects are read on background
+        threads, one per band, while the caller works on the current
+        object, so disk I/O overlaps with processing.  Reads from each file
+        are serialized, since the file handles are not thread safe.
+
+        Parameters
+        ----------
+        indices : array-like, optional
+            The indices of the objects to return. Default of `None` returns
+            all objects.
+        weight_type: string, optional
+            Weight type, see `get_mbobs`.  Default is 'weight'
+        prefetch : int, optional
+            Maximum number of objects to read ahead.  Default 8.
+
+        Yields
+        ------
+        mbobs : ngmix.MultiBandObsList
+            The `MultiBandObsList` for each object, in the order of the
+            indices.  Errors reading an object are raised when it is reached.
+        """
+        if indices is None:
+            indices = np.arange(self.mlist[0].size)
+
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1, "
+                             "got %d" % prefetch)
+
+        locks = [threading.Lock() for m in self.mlist]
+
+        def read_obslist(iband, iobj):
+            with locks[iband]:
+                return self.mlist[iband].get_obslist(
+                    iobj,
+                    weight_type=weight_type,
+                )
+
+        executor = ThreadPoolExecutor(max_workers=self.nband)
+        pending = deque()
+        try:
+            for iobj in indices:
+                pending.append([
+                    executor.submit(read_obslist, iband, iobj)
+                    for iband in range(self.nband)
+                ])
+                if len(pending) > prefetch:
+                    yield _collect_mbobs(pending.popleft())
+
+            while pending:
+                yield _collect_mbobs(pending.popleft())
+        finally:
+            for futures in pending:
+                for future in futures:
+                    future.cancel()
+            executor.shutdown(wait=True)
+
     def get_mbobs(self, iobj, weight_type='weight'):
         """Get a `MultiBandObsList` for a given object.
 
@@ -110,7 +222,51 @@ class MultiBandNGMixMEDS(object):
         return mbobs
 
 
+def _collect_mbobs(futures):
+    """
+    gather the ObsList for each band into a MultiBandObsList
+    """
+    mbobs = MultiBandObsList()
+    for future in futures:
+        mbobs.append(future.result())
+    return mbobs
+
+
 class NGMixMEDS(_MEDS):
+    """A MEDS file reader that produces ngmix observations.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the MEDS file.
+    mmap : bool, optional
+        If True, the cutout HDUs are memory mapped and observations are made
+        from views into the maps rather than reading each cutout.  The maps
+        are copy-on-write, so modifying an array in an observation does not
+        change the file.  The bmask, ormask and noise arrays are held as
+        views with the type stored in the file; the image and weight are
+        converted to native 8 byte floats, which is the only copy made.
+        Compressed or scaled HDUs are read as usual.  Default False.
+
+    The optional bmask, ormask and noise HDUs are looked up once, when the
+    first observation is made.
+    **kw :
+        Other keywords for meds.MEDS.
+    """
+    def __init__(self, filename, mmap=False, **kw):
+        super(NGMixMEDS, self).__init__(filename, **kw)
+        self._filename = filename
+        self._mmap = mmap
+        self._cutout_maps = {}
+        self._hdu_names = None
+        self._file_paths = None
+
+    def close(self):
+        """Close the file and drop any memory maps.
+        """
+        self._cutout_maps.clear()
+        super(NGMixMEDS, self).close()
+
     def get_obslist(self, iobj, weight_type='weight'):
         """Get an ngmix ObsList for all observations.
 
@@ -143,12 +299,7 @@ class NGMixMEDS(_MEDS):
                 print('zero weight observation found, skipping')
 
 
-        if len(obslist) > 0:
-            obs = obslist[0]
-            if 'flux' in obs.meta:
-                obslist.meta['flux'] = obs.meta['flux']
-            if 'T' in obs.meta:
-                obslist.meta['T'] = obs.meta['T']
+        _set_obslist_meta(obslist)
         return obslist
 
     def get_ngmix_jacobian(self, iobj, icutout):
@@ -200,62 +351,15 @@ class NGMixMEDS(_MEDS):
         obs : ngmix.Observation
             An `Observation` for this cutout.
         """
-        im = self.get_cutout(iobj, icutout, type='image')
-
-        try:
-            bmask = self.get_cutout(iobj, icutout, type='bmask')
-        except Exception:
-            bmask = None
+        im = self._get_cutout_data(iobj, icutout, 'image')
+        bmask = self._get_optional_cutout(iobj, icutout, 'bmask')
+        ormask = self._get_optional_cutout(iobj, icutout, 'ormask')
+        noise = self._get_optional_cutout(iobj, icutout, 'noise')
 
-        try:
-            ormask = self.get_cutout(iobj, icutout, type='ormask')
-        except Exception:
-            ormask = None
-
-        try:
-            noise = self.get_cutout(iobj, icutout, type='noise')
-        except Exception:
-            noise = None
-
-        if weight_type == 'uberseg':
-            wt = self.get_uberseg(iobj, icutout)
-        elif weight_type == 'cweight':
-            wt = self.get_cweight_cutout(iobj, icutout, restrict_to_seg=True)
-        elif weight_type == 'weight':
-            wt = self.get_cutout(iobj, icutout, type='weight')
-        elif weight_type == 'cseg':
-            wt = self.get_cseg_weight(iobj, icutout)
-        elif weight_type == 'cseg-canonical':
-            wt = self.get_cseg_weight(iobj, icutout, use_canonical_cen=True)
-        else:
-            raise ValueError("bad weight type '%s'" % weight_type)
+        wt = self._get_weight_cutout(iobj, icutout, weight_type)
 
         jacobian = self.get_ngmix_jacobian(iobj, icutout)
-        c = self._cat
-
-        ii = self.get_image_info()
-        file_id = c['file_id'][iobj, icutout]
-        file_path = os.path.basename(ii['image_path'][file_id]).strip()
-
-        meta = dict(
-            id=c['id'][iobj],
-            index=iobj,
-            icut=icutout,
-            cutout_index=icutout,
-            file_id=file_id,
-            file_path=file_path,
-            orig_row=c['orig_row'][iobj, icutout],
-            orig_col=c['orig_col'][iobj, icutout],
-            orig_start_row=c['orig_start_row'][iobj, icutout],
-            orig_start_col=c['orig_start_col'][iobj, icutout],
-        )
-
-        if 'flux_auto' in c.dtype.names:
-            meta['flux'] = c['flux_auto'][iobj]
-        if 'x2' in c.dtype.names and 'y2' in c.dtype.names:
-            meta['T'] = c['x2'][iobj] + c['y2'][iobj]
-        if 'number' in c.dtype.names:
-            meta['number'] = c['number'][iobj]
+        meta = self._get_meta(self._cat[iobj], iobj, icutout)
 
         if self.has_psf():
             psf_obs = self.get_psf_obs(iobj, icutout)
@@ -274,6 +378,103 @@ class NGMixMEDS(_MEDS):
 
         return obs
 
+    def get_obs_range(self, start, stop, weight_type='weight'):
+        """Get ngmix ObsLists for a contiguous range of objects.
+
+        For each cutout type the span of the file holding all the cutouts
+        for the objects is read in a single call, or taken from the memory
+        map if mmap is set, and the cutouts are views into the span.  This
+        is much faster than get_obslist for sequential scans over a file.
+
+        Parameters
+        ----------
+        start : int
+            Index of the first object.
+        stop : int
+            One past the index of the last object.
+        weight_type: string, optional
+            Weight type, see `get_obs`.  Only 'weight' is read in bulk; the
+            others are made for each cutout.  Default is 'weight'
+
+        Returns
+        -------
+        obslists : list of ngmix.ObsList
+            An `ObsList` for each object, as returned by `get_obslist`.
+        """
+        if weight_type not in ['weight', 'uberseg', 'cweight',
+                               'cseg', 'cseg-canonical']:
+            raise ValueError("bad weight type '%s'" % weight_type)
+
+        cat = self._cat[start:stop]
+
+        # flat start and size of each cutout in the range
+        ncutout = cat['ncutout']
+        cut_starts = np.concatenate(
+            [rec['start_row'][:n] for rec, n in zip(cat, ncutout)]
+            + [np.zeros(0, dtype='i8')]
+        )
+        cut_sizes = np.repeat(cat['box_size']**2, ncutout)
+
+        types = ['image']
+        if weight_type == 'weight':
+            types.append('weight')
+        types += [t for t in ['bmask', 'ormask', 'noise'] if self._has_hdu(t)]
+
+        spans = {}
+        if cut_starts.size > 0:
+            for type in types:
+                spans[type] = self._read_cutout_span(
+                    type, cut_starts, cut_sizes,
+                )
+
+        has_psf = self.has_psf()
+
+        obslists = []
+        for i, rec in enumerate(cat):
+            iobj = start + i
+            box_size = rec['box_size']
+
+            obslist = ObsList()
+            for icut in range(rec['ncutout']):
+
+                cstart = rec['start_row'][icut]
+                cutouts = {}
+                for type, (lo, span) in spans.items():
+                    beg = cstart - lo
+                    cutouts[type] = span[beg:beg + box_size*box_size].reshape(
+                        box_size, box_size,
+                    )
+
+                if weight_type == 'weight':
+                    wt = cutouts['weight']
+                else:
+                    wt = self._get_weight_cutout(iobj, icut, weight_type)
+
+                if has_psf:
+                    psf_obs = self.get_psf_obs(iobj, icut)
+                else:
+                    psf_obs = None
+
+                try:
+                    obs = Observation(
+                        cutouts['image'],
+                        weight=wt,
+                        bmask=cutouts.get('bmask'),
+                        ormask=cutouts.get('ormask'),
+                        noise=cutouts.get('noise'),
+                        meta=self._get_meta(rec, iobj, icut),
+                        jacobian=_get_jacobian_from_rec(rec, icut),
+                        psf=psf_obs,
+                    )
+                    obslist.append(obs)
+                except GMixFatalError:
+                    print('zero weight observation found, skipping')
+
+            _set_obslist_meta(obslist)
+            obslists.append(obslist)
+
+        return obslists
+
     def get_psf_obs(self, iobj, icutout):
         """Get an observation of the PSF for this object.
 
@@ -319,3 +520,188 @@ class NGMixMEDS(_MEDS):
         row = c['psf_cutout_row'][iobj, icutout]
         col = c['psf_cutout_col'][iobj, icutout]
         return row, col
+
+    def _get_weight_cutout(self, iobj, icutout, weight_type):
+        """
+        get the weight map of the requested type
+        """
+        if weight_type == 'uberseg':
+            wt = self.get_uberseg(iobj, icutout)
+        elif weight_type == 'cweight':
+            wt = self.get_cweight_cutout(iobj, icutout, restrict_to_seg=True)
+        elif weight_type == 'weight':
+            wt = self._get_cutout_data(iobj, icutout, 'weight')
+        elif weight_type == 'cseg':
+            wt = self.get_cseg_weight(iobj, icutout)
+        elif weight_type == 'cseg-canonical':
+            wt = self.get_cseg_weight(iobj, icutout, use_canonical_cen=True)
+        else:
+            raise ValueError("bad weight type '%s'" % weight_type)
+
+        return wt
+
+    def _get_meta(self, rec, iobj, icutout):
+        """
+        get the meta data for a cutout from the catalog entry for the object
+        """
+        file_id = rec['file_id'][icutout]
+
+        meta = dict(
+            id=rec['id'],
+            index=iobj,
+            icut=icutout,
+            cutout_index=icutout,
+            file_id=file_id,
+            file_path=self._get_file_paths()[file_id],
+            orig_row=rec['orig_row'][icutout],
+            orig_col=rec['orig_col'][icutout],
+            orig_start_row=rec['orig_start_row'][icutout],
+            orig_start_col=rec['orig_start_col'][icutout],
+        )
+
+        names = rec.dtype.names
+        if 'flux_auto' in names:
+            meta['flux'] = rec['flux_auto']
+        if 'x2' in names and 'y2' in names:
+            meta['T'] = rec['x2'] + rec['y2']
+        if 'number' in names:
+            meta['number'] = rec['number']
+
+        return meta
+
+    def _get_file_paths(self):
+        """
+        base names of the source images, indexed by file_id.  These are
+        made once
+        """
+        if self._file_paths is None:
+            ii = self.get_image_info()
+            self._file_paths = [
+                os.path.basename(path).strip() for path in ii['image_path']
+            ]
+        return self._file_paths
+
+    def _read_cutout_span(self, type, starts, sizes):
+        """
+        get the part of the cutout HDU covering the input cutouts, with a
+        single read or from the memory map
+
+        returns
+        -------
+        lo, span: the flat index of the start of the span, and the data
+        """
+        lo = starts.min()
+        hi = (starts + sizes).max()
+
+        data = self._get_cutout_map(type)
+        if data is not None:
+            span = data[lo:hi]
+        else:
+            span = self._fits['%s_cutouts' % type][lo:hi]
+
+        return lo, span
+
+    def _get_optional_cutout(self, iobj, icutout, type):
+        """
+        get the cutout, or None if it is not in the file
+        """
+        if not self._has_hdu(type):
+            return None
+        return self._get_cutout_data(iobj, icutout, type)
+
+    def _get_cutout_data(self, iobj, icutout, type):
+        """
+        get the cutout, as a view into the memory map if mmap is set and the
+        HDU can be mapped
+        """
+        data = self._get_cutout_map(type)
+        if data is None:
+            return self.get_cutout(iobj, icutout, type=type)
+
+        box_size = self._cat['box_size'][iobj]
+        start = self._cat['start_row'][iobj, icutout]
+        end = start + box_size*box_size
+        return data[start:end].reshape(box_size, box_size)
+
+    def _get_cutout_map(self, type):
+        """
+        get the memory map for the cutout HDU, or None if mmap is not set
+        or the HDU cannot be mapped
+        """
+        if not self._mmap:
+            return None
+
+        if type not in self._cutout_maps:
+            self._cutout_maps[type] = self._map_cutout_hdu(type)
+
+        return self._cutout_maps[type]
+
+    def _has_hdu(self, type):
+        """
+        check if the cutout HDU is in the file.  The HDU names are read once
+        """
+        if self._hdu_names is None:
+            self._hdu_names = set(
+                hdu.get_extname().lower() for hdu in self._fits
+            )
+        return '%s_cutouts' % type in self._hdu_names
+
+    def _map_cutout_hdu(self, type):
+        """
+        memory map the data for the cutout HDU, or return None if the HDU
+        is missing, compressed or scaled
+        """
+        if not self._has_hdu(type):
+            return None
+
+        hdu = self._fits['%s_cutouts' % type]
+        if hdu.is_compressed():
+            return None
+
+        hdr = hdu.read_header()
+        if hdr.get('BSCALE', 1.0) != 1.0 or hdr.get('BZERO', 0.0) != 0.0:
+            return None
+
+        dtype = _BITPIX_DTYPES.get(hdr['BITPIX'])
+        if dtype is None:
+            return None
+
+        naxis = hdr['NAXIS']
+        size = int(np.prod([hdr['NAXIS%d' % i] for i in range(1, naxis+1)]))
+        if size == 0:
+            return None
+
+        data_start = hdu.get_offsets()['data_start']
+        return np.memmap(
+            self._filename,
+            dtype=dtype,
+            mode='c',
+            offset=data_start,
+            shape=(size,),
+        )
+
+
+def _set_obslist_meta(obslist):
+    """
+    copy the flux and T from the first observation to the ObsList meta
+    """
+    if len(obslist) > 0:
+        obs = obslist[0]
+        if 'flux' in obs.meta:
+            obslist.meta['flux'] = obs.meta['flux']
+        if 'T' in obs.meta:
+            obslist.meta['T'] = obs.meta['T']
+
+
+def _get_jacobian_from_rec(rec, icutout):
+    """
+    get the Jacobian for a cutout from the catalog entry for the object
+    """
+    return Jacobian(
+        row=rec['cutout_row'][icutout],
+        col=rec['cutout_col'][icutout],
+        dudrow=rec['dudrow'][icutout],
+        dudcol=rec['dudcol'][icutout],
+        dvdrow=rec['dvdrow'][icutout],
+        dvdcol=rec['dvdcol'][icutout],
+    )
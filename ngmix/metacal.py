@@ -76,6 +76,10 @@ def get_all_metacal(obs,
     fixnoise: bool
         If set to True, add a compensating noise field to cancel the correlated
         noise component.  Default True
+    backend: string, optional
+        'galsim' to use the Metacal classes, or 'fft' to use
+        metacal_fft.MetacalFFT, which uses numpy FFTs and is faster for
+        small stamps.  psf= is not supported for 'fft'.  Default 'galsim'
     **kw:
         other keywords for metacal and simobs.
 
@@ -109,6 +113,133 @@ def get_all_metacal(obs,
     return odict
 
 
+def get_all_metacal_batch(images,
+                          weights,
+                          psf_images,
+                          jacobians,
+                          psf_weights=None,
+                          psf_jacobians=None,
+                          step=0.01,
+                          types=None,
+                          fixnoise=True,
+                          rng=None,
+                          **kw):
+    """
+    Get all combinations of metacal images for a stack of stamps with the
+    same size, using metacal_fft.MetacalFFTStack
+
+    The FFTs are done for the whole stack at once, which is much faster
+    than processing the stamps one at a time.  Memory use scales as
+    nstamp*(pad_factor*dim)**2, so large sets of stamps should be sent in
+    chunks
+
+    parameters
+    ----------
+    images: array
+        [nstamp, nrow, ncol] array of images
+    weights: array
+        [nstamp, nrow, ncol] array of weight maps
+    psf_images: array
+        [nstamp, psf_nrow, psf_ncol] array of psf images
+    jacobians: sequence
+        Jacobian for each stamp.  The psfs must have the same wcs
+    psf_weights: array, optional
+        [nstamp, psf_nrow, psf_ncol] weight maps for the psf observations,
+        default all ones
+    psf_jacobians: sequence, optional
+        Jacobian for each psf.  Default is the image jacobian with the
+        center at the center of the psf image
+    step: float, optional
+        The shear step value to use for metacal.  Default 0.01
+    types: list, optional
+        The types to get, default the full set in METACAL_TYPES
+    fixnoise: bool
+        If set to True, add a compensating noise field to cancel the
+        correlated noise component.  The stamps must be square.  Default True
+    rng: numpy.random.RandomState, optional
+        Random number generator for the fixnoise images
+    **kw:
+        other keywords for MetacalFFTStack, e.g. k_interpolant
+
+    returns
+    -------
+    A dictionary keyed by type, as for get_all_metacal, with
+    metacal_fft.ObservationStack values.  Indexing a stack gives the
+    Observation for that stamp
+    """
+    from .metacal_fft import MetacalFFTStack
+
+    if types is None:
+        types = METACAL_TYPES
+    types = list(types)
+
+    weights = numpy.asarray(weights, dtype='f8')
+
+    mc = MetacalFFTStack(
+        images,
+        psf_images,
+        jacobians,
+        weights=weights,
+        psf_weights=psf_weights,
+        psf_jacobians=psf_jacobians,
+        **kw
+    )
+    odict = mc.get_all(step=step, types=types)
+
+    if fixnoise:
+        if weights.shape[1] != weights.shape[2]:
+            raise ValueError("fixnoise requires square "
+                             "stamps, got %s" % (weights.shape[1:],))
+
+        noise = _get_noise_stack(weights, rng=rng)
+
+        # rotate by 90
+        noise = numpy.rot90(noise, k=1, axes=(1, 2))
+        noise_odict = mc.copy_with_images(noise).get_all(
+            step=step,
+            types=list(types),
+        )
+
+        # the variance is doubled by adding the noise
+        new_weights = weights.copy()
+        new_weights[weights != 0.0] *= 0.5
+
+        for type in odict:
+            ostack = odict[type]
+            nstack = noise_odict[type]
+
+            # rotate back, which is 3 more rotations
+            ostack.images += numpy.rot90(nstack.images, k=3, axes=(1, 2))
+            ostack.weights = new_weights
+
+    return odict
+
+
+def _get_noise_stack(weights, rng=None):
+    """
+    get noise images for a stack of weight maps.  As for
+    simobs.simulate_obs with add_all=True, zero weight pixels get the
+    median noise of the stamp
+    """
+    if rng is None:
+        rng = numpy.random
+
+    err = numpy.full(weights.shape, numpy.nan)
+    w = numpy.where(weights > 0)
+    err[w] = sqrt(1.0/weights[w])
+
+    median_err = numpy.nanmedian(
+        err.reshape(weights.shape[0], -1),
+        axis=1,
+    )
+    median_err[numpy.isnan(median_err)] = simobs.BIGNOISE
+
+    wzero = numpy.where(weights <= 0)
+    err[wzero] = median_err[wzero[0]]
+
+    return rng.normal(size=weights.shape)*err
+
+
 def _get_all_metacal(obs, step=0.01, **kw):
     """
     internal routine
@@ -118,7 +249,20 @@ def _get_all_metacal(obs, step=0.01, **kw):
     if isinstance(obs, Observation):
 
         psf = kw.get('psf', None)
-        if psf is not None:
+        backend = kw.get('backend', 'galsim')
+
+        if backend == 'fft':
+            if psf is not None:
+                raise ValueError("psf= is not supported for backend 'fft'")
+
+            from .metacal_fft import MetacalFFT
+            m = MetacalFFT(obs, **kw)
+
+        elif backend != 'galsim':
+            raise ValueError("backend should be 'galsim' "
+                             "or 'fft', got '%s'" % backend)
+
+        elif psf is not None:
 
             if psf == 'gauss':
                 # we default to only shear terms, not psf shear terms
@@ -262,6 +406,68 @@ def _get_all_metacal_fixnoise(obs, step=0.01, **kw):
     return obsdict
 
 
+def _get_all_types(mc, step=0.01, types=None):
+    """
+    internal routine
+
+    get the requested metacal types using the get_obs_galshear and
+    get_obs_psfshear methods of the input metacal object
+    """
+
+    if types is None:
+        types = [t for t in METACAL_TYPES]
+    else:
+        for t in types:
+            assert t in METACAL_TYPES, 'bad metacal type: %s' % t
+
+    # we add 1p here if we want noshear since we get both of those
+    # at once below
+
+    if 'noshear' in types and '1p' not in types:
+        types.append('1p')
+
+    shdict = {}
+
+    # galshear keys
+    shdict['1m'] = Shape(-step,  0.0)
+    shdict['1p'] = Shape(+step,  0.0)
+
+    shdict['2m'] = Shape(0.0, -step)
+    shdict['2p'] = Shape(0.0, +step)
+
+    # psfshear keys
+    keys = list(shdict.keys())
+    for key in keys:
+        pkey = '%s_psf' % key
+        shdict[pkey] = shdict[key].copy()
+
+    odict = {}
+
+    for type in types:
+        if type == 'noshear':
+            # we get noshear with 1p
+            continue
+
+        sh = shdict[type]
+
+        if 'psf' in type:
+            obs = mc.get_obs_psfshear(sh)
+        else:
+            if type == '1p':
+                # add in noshear from this one
+                obs, obs_noshear = mc.get_obs_galshear(
+                    sh,
+                    get_unsheared=True
+                )
+                odict['noshear'] = obs_noshear
+            else:
+                obs = mc.get_obs_galshear(sh)
+
+        odict[type] = obs
+
+    return odict
+
+
 class Metacal(object):
     """
     Create manipulated images for use in metacalibration
@@ -338,58 +544,7 @@ class Metacal(object):
                 2m -> ( 0, -shear)
         """
 
-        if types is None:
-            types = [t for t in METACAL_TYPES]
-        else:
-            for t in types:
-                assert t in METACAL_TYPES, 'bad metacal type: %s' % t
-
-        # we add 1p here if we want noshear since we get both of those
-        # at once below
-
-        if 'noshear' in types and '1p' not in types:
-            types.append('1p')
-
-        shdict = {}
-
-        # galshear keys
-        shdict['1m'] = Shape(-step,  0.0)
-        shdict['1p'] = Shape(+step,  0.0)
-
-        shdict['2m'] = Shape(0.0, -step)
-        shdict['2p'] = Shape(0.0, +step)
-
-        # psfshear keys
-        keys = list(shdict.keys())
-        for key in keys:
-            pkey = '%s_psf' % key
-            shdict[pkey] = shdict[key].copy()
-
-        odict = {}
-
-        for type in types:
-            if type == 'noshear':
-                # we get noshear with 1p
-                continue
-
-            sh = shdict[type]
-
-            if 'psf' in type:
-                obs = self.get_obs_psfshear(sh)
-            else:
-                if type == '1p':
-                    # add in noshear from this one
-                    obs, obs_noshear = self.get_obs_galshear(
-                        sh,
-                        get_unsheared=True
-                    )
-                    odict['noshear'] = obs_noshear
-                else:
-                    obs = self.get_obs_galshear(sh)
-
-            odict[type] = obs
-
-        return odict
+        return _get_all_types(self, step=step, types=types)
 
     def get_obs_galshear(self, shear, get_unsheared=False):
         """
@@ -470,6 +625,10 @@ class Metacal(object):
         """
         get galsim object for the dilated, possibly sheared, psf
 
+        The target psfs are cached, so each is only drawn once.  For
+        type='gal_shear' the psf only depends on the magnitude of the
+        shear, so the same psf is used for 1p, 1m, 2p and 2m
+
         parameters
         ----------
         shear: ngmix.Shape
@@ -486,6 +645,45 @@ class Metacal(object):
 
         _check_shape(shear)
 
+        key = self._get_target_psf_key(shear, type)
+
+        entry = self._target_psf_cache.get(key)
+        if entry is None or (get_nopix and entry[1] is None):
+            entry = self._make_target_psf(shear, type, get_nopix=get_nopix)
+            self._target_psf_cache[key] = entry
+
+        # copies, since the images end up in observations that may be
+        # modified
+        psf_grown_image, psf_grown_nopix_image, psf_grown = entry
+        if get_nopix:
+            return (
+                psf_grown_image.copy(),
+                psf_grown_nopix_image.copy(),
+                psf_grown,
+            )
+        else:
+            return psf_grown_image.copy(), psf_grown
+
+    def _get_target_psf_key(self, shear, type):
+        """
+        key for the target psf cache.  The psf for gal_shear is only
+        dilated, by an amount that depends on |g|
+        """
+        if type == 'psf_shear':
+            return (type, shear.g1, shear.g2)
+        else:
+            return (type, sqrt(shear.g1**2 + shear.g2**2))
+
+    def _make_target_psf(self, shear, type, get_nopix=False):
+        """
+        draw the target psf
+
+        returns
+        -------
+        psf image, psf image without the pixel (None if get_nopix is False),
+        psf galsim object
+        """
+
         if type == 'psf_shear':
             doshear = True
         else:
@@ -511,14 +709,15 @@ class Metacal(object):
                     image=psf_grown_nopix_image,
                     method='no_pixel'  # pixel is in the psf
                 )
-
-                return psf_grown_image, psf_grown_nopix_image, psf_grown
             else:
-                return psf_grown_image, psf_grown
+                psf_grown_nopix_image = None
+
         except RuntimeError as err:
             # argh, galsim uses generic exceptions
             raise GMixRangeError("galsim error: '%s'" % str(err))
 
+        return psf_grown_image, psf_grown_nopix_image, psf_grown
+
     def _get_dilated_psf(self, shear, doshear=False):
         """
         dilate the psf by the input shear and reconvolve by the pixel.  See
@@ -629,6 +828,8 @@ class Metacal(object):
         if not obs.has_psf():
             raise ValueError("observation must have a psf observation set")
 
+        self._target_psf_cache = {}
+
         self._set_pixel()
         self._set_interp()
 
@@ -832,30 +1033,25 @@ class MetacalGaussPSF(Metacal):
         assert self.shear_pixelized_psf is False,\
             "no shear pixelized psf for GaussPSF"
 
+        # the round gaussian is the same for all shears
+        self.gauss_psf = _get_gauss_target_psf(
+            self.psf_int_nopix,
+            flux=self.psf_flux,
+        )
+
     def _do_dilate(self, psf, shear):
-        newpsf = _get_gauss_target_psf(psf, flux=self.psf_flux)
-        return _do_dilate(newpsf, shear)
+        return _do_dilate(self.gauss_psf, shear)
 
-    def get_target_psf(self, shear, type, get_nopix=False):
+    def _make_target_psf(self, shear, type, get_nopix=False):
         """
-        get galsim object for the dilated, possibly sheared, psf
-
-        parameters
-        ----------
-        shear: ngmix.Shape
-            The applied shear
-        type: string
-            Type of psf target.  For type='gal_shear', the psf is just dilated
-            to deal with noise amplification.  For type='psf_shear' the psf is
-            also sheared for calculating Rpsf
+        draw the target psf
 
         returns
         -------
-        galsim object
+        psf image, psf image without the pixel (None if get_nopix is False),
+        psf galsim object
         """
 
-        _check_shape(shear)
-
         if type == 'psf_shear':
             doshear = True
         else:
@@ -880,14 +1076,15 @@ class MetacalGaussPSF(Metacal):
                     image=psf_grown_nopix_image,
                     method='no_pixel'  # pixel is in the psf
                 )
-
-                return psf_grown_image, psf_grown_nopix_image, psf_grown
             else:
-                return psf_grown_image, psf_grown
+                psf_grown_nopix_image = None
+
         except RuntimeError as err:
             # argh, galsim uses generic exceptions
             raise GMixRangeError("galsim error: '%s'" % str(err))
 
+        return psf_grown_image, psf_grown_nopix_image, psf_grown
+
     def _make_psf_obs(self, gsim):
 
         noise = 1.0e-6
@@ -935,64 +1132,41 @@ class MetacalFitGaussPSF(Metacal):
         assert self.shear_pixelized_psf is False,\
             'no shear pixelized psf for fit gauss psf'
 
-    def get_target_psf(self, shear, type, get_nopix=False):
+    def _make_target_psf(self, shear, type, get_nopix=False):
         """
-        get galsim object for the dilated psf
-
-        parameters
-        ----------
-        shear: ngmix.Shape
-            The applied shear
-        type: string
-            Type of psf target.  Only gal_shear is supported for
-            MetacalFitGaussPSF.
+        draw the dilated psf.  Only gal_shear is supported for
+        MetacalFitGaussPSF.  There is no pixel to remove, so the nopix
+        image is the same as the image
 
         returns
         -------
-        galsim object
+        psf image, psf image without the pixel, psf galsim object
         """
 
-        _check_shape(shear)
-
         assert type == 'gal_shear',\
             'psf_shear is not supported for MetacalFitGaussPSF'
 
-        g = sqrt(shear.g1**2 + shear.g2**2)
-        if g not in self._psf_cache:
-
-            psf_grown = self._get_dilated_psf(shear)
+        psf_grown = self._get_dilated_psf(shear)
 
-            # this should carry over the wcs
-            psf_grown_image = self.psf_image.copy()
-
-            try:
-                # pixel is already in the psf
-                psf_grown_image = psf_grown.drawImage(
-                    image=psf_grown_image,
-                    method='no_pixel',
-                )
-
-            except RuntimeError as err:
-                # argh, galsim uses generic exceptions
-                raise GMixRangeError("galsim error: '%s'" % str(err))
+        # this should carry over the wcs
+        psf_grown_image = self.psf_image.copy()
 
-            psf_grown_image.array[:, :] += self.psf_noise_image
-            self._psf_cache[g] = (
-                psf_grown_image,
-                psf_grown,
+        try:
+            # pixel is already in the psf
+            psf_grown_image = psf_grown.drawImage(
+                image=psf_grown_image,
+                method='no_pixel',
             )
 
-        tpsf_grown_image, psf_grown = self._psf_cache[g]
-        psf_grown_image = tpsf_grown_image.copy()
+        except RuntimeError as err:
+            # argh, galsim uses generic exceptions
+            raise GMixRangeError("galsim error: '%s'" % str(err))
 
-        if get_nopix:
-            return psf_grown_image, psf_grown_image, psf_grown
-        else:
-            return psf_grown_image, psf_grown
+        psf_grown_image.array[:, :] += self.psf_noise_image
 
-    def _setup_psf(self):
-        self._psf_cache = {}
+        return psf_grown_image, psf_grown_image, psf_grown
 
+    def _setup_psf(self):
         self.psf_flux = self.obs.psf.image.sum()
         self._set_psf_noise()
         self._do_psf_fit()
@@ -1150,26 +1324,16 @@ class MetacalAnalyticPSF(Metacal):
 
         self.psf_obj = psf_obj
 
-    def get_target_psf(self, shear, type, get_nopix=False):
+    def _make_target_psf(self, shear, type, get_nopix=False):
         """
-        get galsim object for the dilated, possibly sheared, psf
-
-        parameters
-        ----------
-        shear: ngmix.Shape
-            The applied shear
-        type: string
-            Type of psf target.  For type='gal_shear', the psf is just dilated
-            to deal with noise amplification.  For type='psf_shear' the psf is
-            also sheared for calculating Rpsf
+        draw the target psf.  There is no pixel for the analytic psf, so
+        the nopix image is the same as the image
 
         returns
         -------
-        galsim object
+        psf image, psf image without the pixel, psf galsim object
         """
 
-        _check_shape(shear)
-
         if type == 'psf_shear':
             doshear = True
         else:
@@ -1189,12 +1353,7 @@ class MetacalAnalyticPSF(Metacal):
             # argh, galsim uses generic exceptions
             raise GMixRangeError("galsim error: '%s'" % str(err))
 
-        if get_nopix:
-            # there is no pixel for analytic psf, just return
-            # a copy
-            return psf_grown_image, psf_grown_image.copy(), psf_grown
-        else:
-            return psf_grown_image, psf_grown
+        return psf_grown_image, psf_grown_image, psf_grown
 
     def _get_dilated_psf(self, shear, doshear=False):
         """
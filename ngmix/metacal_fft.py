@@ -0,0 +1,944 @@
+"""
+Metacal using numpy FFTs of the pixel arrays, with no galsim objects
+
+The image and psf are transformed once, and the tables of k-space values are
+kept for the object.  For each shear the deconvolved image is evaluated at
+the sheared k coordinates by interpolating in the tables, multiplied by the
+dilated target psf, and transformed back on the pixel grid.  Everything is
+done in pixel coordinates; shears are mapped from world coordinates using
+the jacobian.
+
+The k-space grids for each stamp size are cached, so the work that only
+depends on the size is done once; see get_fft_grid.
+
+This reproduces the default Metacal: the psf is dilated by 1+2|g|, the psf
+and the image must have the same wcs, and the prepix, symmetrize_psf and
+shear_pixelized_psf options are not supported.  The results agree with
+Metacal to a small fraction of the peak value; the differences come from
+the interpolation, which is done in k-space rather than using a lanczos
+interpolant in real space, and the truncation at high k.
+"""
+from __future__ import print_function, absolute_import, division
+
+try:
+    xrange
+except NameError:
+    xrange=range
+
+import copy
+
+import numpy
+from numpy import sqrt, pi
+
+from .observation import Observation
+from .gexceptions import GMixRangeError
+from .metacal import _get_all_types, _check_shape
+
+K_INTERPOLANTS = ['linear', 'cubic']
+
+# grids keyed by image shape and pad factor
+_grid_cache = {}
+
+
+def get_fft_grid(shape, pad_factor):
+    """
+    get the k-space grid for images of the given shape, zero padded by
+    pad_factor.  The grids are cached
+
+    parameters
+    ----------
+    shape: tuple
+        Shape of the image
+    pad_factor: int
+        The image is zero padded to pad_factor times its size
+
+    returns
+    -------
+    An FFTGrid
+    """
+    key = (tuple(shape), pad_factor)
+    grid = _grid_cache.get(key)
+    if grid is None:
+        grid = FFTGrid(shape, pad_factor)
+        _grid_cache[key] = grid
+
+    return grid
+
+
+class FFTGrid(object):
+    """
+    k-space grid for images of the given shape, zero padded by pad_factor
+
+    The k-space arrays are in fftshifted order, with zero frequency at
+    index pshape//2.  Transforms are taken about the center of the image,
+    (shape-1)/2, which is where galsim puts the origin of an interpolated
+    image.  Images can have leading dimensions, e.g. a stack of images
+    with shape [nstamp, nrow, ncol]
+
+    parameters
+    ----------
+    shape: tuple
+        Shape of the image
+    pad_factor: int
+        The image is zero padded to pad_factor times its size
+    """
+    def __init__(self, shape, pad_factor):
+        self.shape = tuple(shape)
+        self.pshape = tuple(int(pad_factor*n) for n in shape)
+
+        cen = (numpy.array(self.shape) - 1.0)/2.0
+        self.offset = tuple(int(o) for o in numpy.floor(cen))
+        delta = cen - numpy.floor(cen)
+
+        self.dk = tuple(2.0*pi/n for n in self.pshape)
+        self.zero = tuple(n//2 for n in self.pshape)
+
+        ky1 = 2.0*pi*numpy.fft.fftshift(numpy.fft.fftfreq(self.pshape[0]))
+        kx1 = 2.0*pi*numpy.fft.fftshift(numpy.fft.fftfreq(self.pshape[1]))
+        self.ky, self.kx = numpy.meshgrid(ky1, kx1, indexing='ij')
+
+        # phase to shift the transform from the padded array origin to the
+        # image center
+        self.phase = numpy.exp(1j*(self.ky*delta[0] + self.kx*delta[1]))
+
+        self.pixel = get_pixel_response(self.ky, self.kx)
+
+    def get_kimage(self, image):
+        """
+        get the transform of the zero padded image about its center
+
+        parameters
+        ----------
+        image: array
+            The image, which can have leading dimensions
+
+        returns
+        -------
+        complex array of k-space values
+        """
+        nrow, ncol = self.shape
+        lead = image.shape[:-2]
+
+        padded = numpy.zeros(lead + self.pshape)
+        padded[..., :nrow, :ncol] = image
+        padded = numpy.roll(
+            padded,
+            (-self.offset[0], -self.offset[1]),
+            axis=(-2, -1),
+        )
+
+        kimage = numpy.fft.fftshift(
+            numpy.fft.fft2(padded),
+            axes=(-2, -1),
+        )
+        kimage *= self.phase
+        return kimage
+
+    def draw(self, kimage):
+        """
+        transform k-space values back to an image
+
+        parameters
+        ----------
+        kimage: array
+            k-space values on the grid, which can have leading dimensions
+
+        returns
+        -------
+        real array with the image shape
+        """
+        nrow, ncol = self.shape
+
+        padded = numpy.fft.ifft2(
+            numpy.fft.ifftshift(kimage*self.phase.conj(), axes=(-2, -1)),
+        ).real
+        padded = numpy.roll(
+            padded,
+            (self.offset[0], self.offset[1]),
+            axis=(-2, -1),
+        )
+        return padded[..., :nrow, :ncol].copy()
+
+    def interp(self, kimage, ky, kx, k_interpolant='cubic'):
+        """
+        interpolate k-space values on this grid to the input coordinates.
+        Coordinates outside the grid get zero
+
+        parameters
+        ----------
+        kimage: array
+            k-space values on this grid, which can have leading dimensions
+        ky, kx: arrays
+            The coordinates.  If kimage has leading dimensions these must
+            have the same leading dimensions
+        k_interpolant: string, optional
+            'linear' or 'cubic' (Keys a=-0.5), default 'cubic'
+
+        returns
+        -------
+        complex array with the shape of ky
+        """
+        iy = ky*(1.0/self.dk[0]) + self.zero[0]
+        ix = kx*(1.0/self.dk[1]) + self.zero[1]
+        return _interp_kimage(kimage, iy, ix, k_interpolant)
+
+
+class MetacalFFTStack(object):
+    """
+    Create manipulated images for use in metacalibration for a stack of
+    stamps with the same size, using FFTs of the pixel arrays
+
+    The transforms, interpolation and target psfs are computed for all
+    stamps at once, with the stamps along the leading axis.  The
+    get_obs_galshear, get_obs_psfshear and get_all methods are as for
+    metacal.Metacal, but return an ObservationStack rather than an
+    Observation.  Memory use scales as nstamp*(pad_factor*dim)**2, so large
+    sets of stamps should be processed in chunks
+
+    parameters
+    ----------
+    images: array
+        [nstamp, nrow, ncol] array of images
+    psf_images: array
+        [nstamp, psf_nrow, psf_ncol] array of psf images
+    jacobians: sequence
+        Jacobian for each stamp.  The psfs must have the same wcs
+    weights: array, optional
+        [nstamp, nrow, ncol] weight maps for the output observations,
+        default all ones
+    psf_weights: array, optional
+        [nstamp, psf_nrow, psf_ncol] weight maps for the output psf
+        observations, default all ones
+    psf_jacobians: sequence, optional
+        Jacobian for each psf.  Default is the image jacobian with the
+        center at the center of the psf image
+    k_interpolant: string, optional
+        Interpolant for k-space values, 'linear' or 'cubic', default 'cubic'
+    pad_factor: int, optional
+        The images and psfs are zero padded by this factor before
+        transforming.  Larger values give more accurate interpolation.
+        Default 4
+    draw_pad_factor: int, optional
+        The factor by which the output images are padded when transforming
+        back, to prevent wrapping, default 2
+    maxk_threshold: float, optional
+        k-space values are set to zero beyond the k where the psf falls
+        below this fraction of its flux, divided by the dilation.
+        Default 1.0e-3, the galsim default
+    """
+    def __init__(self,
+                 images,
+                 psf_images,
+                 jacobians,
+                 weights=None,
+                 psf_weights=None,
+                 psf_jacobians=None,
+                 k_interpolant='cubic',
+                 pad_factor=4,
+                 draw_pad_factor=2,
+                 maxk_threshold=1.0e-3,
+                 **kw):
+
+        for name in ['prepix', 'symmetrize_psf', 'shear_pixelized_psf']:
+            if kw.get(name, False):
+                raise ValueError("%s is not supported for the fft "
+                                 "metacal" % name)
+
+        if k_interpolant not in K_INTERPOLANTS:
+            raise ValueError("k_interpolant should be one "
+                             "of %s, got '%s'" % (K_INTERPOLANTS,
+                                                  k_interpolant))
+
+        self.k_interpolant = k_interpolant
+        self.pad_factor = pad_factor
+        self.draw_pad_factor = draw_pad_factor
+        self.maxk_threshold = maxk_threshold
+
+        self._set_psf_data(psf_images, jacobians, psf_weights, psf_jacobians)
+        self._set_image_data(images, weights)
+
+    @property
+    def nstamp(self):
+        """
+        number of stamps
+        """
+        return self.images.shape[0]
+
+    def copy_with_images(self, images, weights=None):
+        """
+        get a new MetacalFFTStack for different images with the same psfs
+        and jacobians, e.g. noise images.  The psf transforms and target
+        psfs are shared, so they are not recomputed
+
+        parameters
+        ----------
+        images: array
+            [nstamp, nrow, ncol] array of images
+        weights: array, optional
+            [nstamp, nrow, ncol] weight maps, default those of this stack
+        """
+        new = copy.copy(self)
+        if weights is None:
+            weights = self.weights
+        new._set_image_data(images, weights)
+        return new
+
+    def get_all(self, step=0.01, types=None, **kw):
+        """
+        Get all the "usual" combinations of metacal images in a dict
+
+        See metacal.Metacal.get_all for the parameters.  The values in the
+        dict are ObservationStack
+        """
+        return _get_all_types(self, step=step, types=types)
+
+    def get_obs_galshear(self, shear, get_unsheared=False):
+        """
+        This is the case where we shear the image, for calculating R
+
+        parameters
+        ----------
+        shear: ngmix.Shape
+            The shear to apply
+
+        get_unsheared: bool
+            Get an observation only convolved by the target psf, not
+            sheared
+        """
+
+        _check_shape(shear)
+
+        target = self.get_target_psf(shear, 'gal_shear')
+
+        sheared_images = self.get_target_images(target, shear=shear)
+        newobs = self._make_obs_stack(sheared_images, target['image'])
+
+        if get_unsheared:
+            unsheared_images = self.get_target_images(target)
+            uobs = self._make_obs_stack(
+                unsheared_images,
+                target['image'],
+                psf_nopix_images=target['nopix_image'],
+            )
+            return newobs, uobs
+        else:
+            return newobs
+
+    def get_obs_psfshear(self, shear):
+        """
+        This is the case where we shear the psf image, for calculating Rpsf
+
+        parameters
+        ----------
+        shear: ngmix.Shape
+            The shear to apply
+        """
+
+        _check_shape(shear)
+
+        target = self.get_target_psf(shear, 'psf_shear')
+        conv_images = self.get_target_images(target)
+
+        return self._make_obs_stack(conv_images, target['image'])
+
+    def get_target_psf(self, shear, type):
+        """
+        get the target psf for each stamp, which is cached.  The psf for
+        gal_shear is only dilated, by an amount that depends on |g|
+
+        parameters
+        ----------
+        shear: ngmix.Shape
+            The applied shear
+        type: string
+            Type of psf target.  For type='gal_shear', the psf is just dilated
+            to deal with noise amplification.  For type='psf_shear' the psf is
+            also sheared for calculating Rpsf
+
+        returns
+        -------
+        dict with the k-space values on the image grid in 'kvals', the max k
+        for each stamp in 'maxk', and [nstamp, psf_nrow, psf_ncol] psf images
+        with and without the pixel in 'image' and 'nopix_image'
+        """
+        if type == 'psf_shear':
+            key = (type, shear.g1, shear.g2)
+        else:
+            key = (type, sqrt(shear.g1**2 + shear.g2**2))
+
+        target = self._target_psf_cache.get(key)
+        if target is None:
+            target = self._make_target_psf(shear, type)
+            self._target_psf_cache[key] = target
+
+        return target
+
+    def get_target_images(self, target, shear=None):
+        """
+        get the images, possibly sheared, deconvolved by the psf and
+        convolved by the target psf
+
+        parameters
+        ----------
+        target: dict
+            The target psf from get_target_psf
+        shear: ngmix.Shape, optional
+            The shear to apply
+
+        returns
+        -------
+        [nstamp, nrow, ncol] array of images
+        """
+        grid = self.grid
+
+        qy, qx, psf_inv = self._get_psf_inv(shear=shear)
+
+        kvals = self.table_grid.interp(
+            self.image_kimage, qy, qx, k_interpolant=self.k_interpolant,
+        )
+        kvals *= psf_inv
+        kvals *= target['kvals']
+
+        maxk = target['maxk'][:, numpy.newaxis, numpy.newaxis]
+        w = numpy.where(
+            (numpy.abs(grid.kx) > maxk) | (numpy.abs(grid.ky) > maxk)
+        )
+        kvals[w] = 0.0
+
+        return grid.draw(kvals)
+
+    def _make_target_psf(self, shear, type):
+        """
+        the psf with the pixel removed is dilated, possibly sheared, and
+        reconvolved by the pixel
+        """
+
+        g = sqrt(shear.g1**2 + shear.g2**2)
+        dilation = 1.0 + 2.0*g
+
+        if type == 'psf_shear':
+            mats = _get_shear_matrices(shear, self.jmatrices)
+            mats = dilation*mats.transpose(0, 2, 1)
+        else:
+            mats = numpy.zeros((self.nstamp, 2, 2))
+            mats[:, 0, 0] = dilation
+            mats[:, 1, 1] = dilation
+
+        gal_nopix = self._get_psf_nopix_kvals(self.grid, mats)
+        psf_nopix = self._get_psf_nopix_kvals(self.psf_grid, mats)
+
+        # as for Metacal, the pixel is in the target psf and drawing the
+        # galaxy image convolves by the pixel again
+        return {
+            'kvals': gal_nopix*self.grid.pixel**2,
+            'maxk': self.psf_maxk/dilation,
+            'image': self.psf_grid.draw(psf_nopix*self.psf_grid.pixel),
+            'nopix_image': self.psf_grid.draw(psf_nopix),
+        }
+
+    def _get_psf_nopix_kvals(self, grid, mats):
+        """
+        get k-space values of the psf with the pixel removed, at the
+        transformed k coordinates of the input grid
+        """
+        qy, qx = _transform_k(mats, grid)
+        kvals = self.psf_table_grid.interp(
+            self.psf_kimage, qy, qx, k_interpolant=self.k_interpolant,
+        )
+        return kvals/get_pixel_response(qy, qx)
+
+    def _get_psf_inv(self, shear=None):
+        """
+        get the k coordinates on the image grid, possibly sheared, and the
+        inverse of the psf at those coordinates.  The inverse is set to zero
+        where the psf is very small.  The unsheared version is cached
+        """
+        if shear is None and self._psf_inv_cache:
+            return self._psf_inv_cache['noshear']
+
+        grid = self.grid
+        if shear is None:
+            shape = (self.nstamp,) + grid.pshape
+            qy = numpy.broadcast_to(grid.ky, shape)
+            qx = numpy.broadcast_to(grid.kx, shape)
+        else:
+            mats = _get_shear_matrices(shear, self.jmatrices)
+            qy, qx = _transform_k(mats.transpose(0, 2, 1), grid)
+
+        psf_kvals = self.psf_table_grid.interp(
+            self.psf_kimage, qy, qx, k_interpolant=self.k_interpolant,
+        )
+
+        # avoid dividing by the noise where the psf is very small
+        psf_inv = numpy.zeros(psf_kvals.shape, dtype=psf_kvals.dtype)
+        thresh = self.maxk_threshold*self.psf_flux
+        w = numpy.where(
+            numpy.abs(psf_kvals) > thresh[:, numpy.newaxis, numpy.newaxis]
+        )
+        psf_inv[w] = 1.0/psf_kvals[w]
+
+        if shear is None:
+            self._psf_inv_cache['noshear'] = (qy, qx, psf_inv)
+
+        return qy, qx, psf_inv
+
+    def _set_psf_data(self, psf_images, jacobians, psf_weights,
+                      psf_jacobians):
+        """
+        transform the psfs and set up the jacobians
+        """
+
+        psf_images = _get_stack(psf_images, 'psf_images')
+        nstamp = psf_images.shape[0]
+
+        if len(jacobians) != nstamp:
+            raise ValueError("expected %d jacobians, "
+                             "got %d" % (nstamp, len(jacobians)))
+
+        if psf_jacobians is None:
+            cen = (numpy.array(psf_images.shape[1:]) - 1.0)/2.0
+            psf_jacobians = []
+            for jacobian in jacobians:
+                psf_jacobian = jacobian.copy()
+                psf_jacobian.set_cen(row=cen[0], col=cen[1])
+                psf_jacobians.append(psf_jacobian)
+        elif len(psf_jacobians) != nstamp:
+            raise ValueError("expected %d psf jacobians, "
+                             "got %d" % (nstamp, len(psf_jacobians)))
+
+        self.jacobians = jacobians
+        self.psf_jacobians = psf_jacobians
+
+        self.jmatrices = numpy.array(
+            [_get_jacobian_matrix(j) for j in jacobians]
+        )
+        psf_jmatrices = numpy.array(
+            [_get_jacobian_matrix(j) for j in psf_jacobians]
+        )
+        if not numpy.allclose(self.jmatrices, psf_jmatrices):
+            raise ValueError("the psf and image must have the "
+                             "same wcs for the fft metacal")
+
+        if psf_weights is None:
+            psf_weights = numpy.ones(psf_images.shape)
+        else:
+            psf_weights = _get_stack(psf_weights, 'psf_weights')
+            if psf_weights.shape != psf_images.shape:
+                raise ValueError("psf weights have shape %s, psf "
+                                 "images %s" % (psf_weights.shape,
+                                                psf_images.shape))
+
+        self.psf_images = psf_images
+        self.psf_weights = psf_weights
+
+        psf_shape = psf_images.shape[1:]
+        self.psf_table_grid = get_fft_grid(psf_shape, self.pad_factor)
+        self.psf_grid = get_fft_grid(psf_shape, self.draw_pad_factor)
+
+        self.psf_kimage = self.psf_table_grid.get_kimage(psf_images)
+
+        zero = self.psf_table_grid.zero
+        self.psf_flux = self.psf_kimage[:, zero[0], zero[1]].real
+        if numpy.any(self.psf_flux <= 0.0):
+            raise GMixRangeError("psf flux is not positive for "
+                                 "all stamps")
+
+        self.psf_maxk = _get_maxk(
+            self.psf_kimage,
+            self.psf_table_grid,
+            self.maxk_threshold*self.psf_flux,
+        )
+
+        self._target_psf_cache = {}
+        self._psf_inv_cache = {}
+
+    def _set_image_data(self, images, weights):
+        """
+        transform the images
+        """
+        images = _get_stack(images, 'images')
+        if images.shape[0] != self.psf_images.shape[0]:
+            raise ValueError("got %d images and %d psf "
+                             "images" % (images.shape[0],
+                                         self.psf_images.shape[0]))
+
+        if weights is None:
+            weights = numpy.ones(images.shape)
+        else:
+            weights = _get_stack(weights, 'weights')
+            if weights.shape != images.shape:
+                raise ValueError("weights have shape %s, "
+                                 "images %s" % (weights.shape, images.shape))
+
+        self.images = images
+        self.weights = weights
+
+        image_shape = images.shape[1:]
+        self.table_grid = get_fft_grid(image_shape, self.pad_factor)
+        self.grid = get_fft_grid(image_shape, self.draw_pad_factor)
+
+        self.image_kimage = self.table_grid.get_kimage(images)
+
+    def _make_obs_stack(self, images, psf_images, psf_nopix_images=None):
+        return ObservationStack(
+            images,
+            self.weights,
+            self.jacobians,
+            psf_images,
+            self.psf_weights,
+            self.psf_jacobians,
+            psf_nopix_images=psf_nopix_images,
+        )
+
+
+class MetacalFFT(object):
+    """
+    Create manipulated images for use in metacalibration, using FFTs of the
+    pixel arrays.  Has the same interface as metacal.Metacal for getting
+    the observations.  This is a MetacalFFTStack with a single stamp
+
+    parameters
+    ----------
+    obs: ngmix.Observation
+        The observation must have a psf observation set, holding
+        the psf image.  The psf must have the same wcs as the image
+    **kw:
+        Options for MetacalFFTStack, e.g. k_interpolant, pad_factor
+    """
+    def __init__(self, obs, **kw):
+
+        self.obs = obs
+        if not obs.has_psf():
+            raise ValueError("observation must have a psf observation set")
+
+        self.stack = MetacalFFTStack(
+            obs.image[numpy.newaxis],
+            obs.psf.image[numpy.newaxis],
+            [obs.jacobian],
+            psf_jacobians=[obs.psf.jacobian],
+            **kw
+        )
+
+    def get_all(self, step=0.01, types=None, **kw):
+        """
+        Get all the "usual" combinations of metacal images in a dict
+
+        See metacal.Metacal.get_all for the parameters and output
+        """
+        return _get_all_types(self, step=step, types=types)
+
+    def get_obs_galshear(self, shear, get_unsheared=False):
+        """
+        This is the case where we shear the image, for calculating R
+
+        parameters
+        ----------
+        shear: ngmix.Shape
+            The shear to apply
+
+        get_unsheared: bool
+            Get an observation only convolved by the target psf, not
+            sheared
+        """
+
+        _check_shape(shear)
+
+        stack = self.stack
+        target = stack.get_target_psf(shear, 'gal_shear')
+        psf_image = target['image'][0]
+
+        sheared_image = stack.get_target_images(target, shear=shear)[0]
+        newobs = self._make_obs(sheared_image, psf_image)
+
+        if get_unsheared:
+            unsheared_image = stack.get_target_images(target)[0]
+
+            uobs = self._make_obs(unsheared_image, psf_image)
+            uobs.psf_nopix = self._make_psf_obs(target['nopix_image'][0])
+
+            return newobs, uobs
+        else:
+            return newobs
+
+    def get_obs_psfshear(self, shear):
+        """
+        This is the case where we shear the psf image, for calculating Rpsf
+
+        parameters
+        ----------
+        shear: ngmix.Shape
+            The shear to apply
+        """
+
+        _check_shape(shear)
+
+        stack = self.stack
+        target = stack.get_target_psf(shear, 'psf_shear')
+        conv_image = stack.get_target_images(target)[0]
+
+        return self._make_obs(conv_image, target['image'][0])
+
+    def _make_psf_obs(self, psf_im):
+
+        obs = self.obs
+        psf_obs = Observation(psf_im.copy(),
+                              weight=obs.psf.weight.copy(),
+                              jacobian=obs.psf.jacobian.copy())
+        return psf_obs
+
+    def _make_obs(self, im, psf_im):
+        """
+        Make new Observation objects for the image and psf.
+        Copy out the weight maps and jacobians from the original
+        Observation.
+
+        parameters
+        ----------
+        im: array
+        psf_im: array
+
+        returns
+        -------
+        A new Observation
+        """
+
+        obs = self.obs
+
+        psf_obs = self._make_psf_obs(psf_im)
+        psf_obs.meta.update(obs.psf.meta)
+
+        meta = {}
+        meta.update(obs.meta)
+        newobs = Observation(
+            im,
+            jacobian=obs.jacobian.copy(),
+            weight=obs.weight.copy(),
+            psf=psf_obs,
+            meta=meta,
+        )
+
+        if obs.has_bmask():
+            newobs.bmask = obs.bmask
+
+        return newobs
+
+
+class ObservationStack(object):
+    """
+    A stack of observations with the same image sizes, holding the images in
+    arrays with the stamps along the leading axis
+
+    Observations are created when indexed, with images and weights that are
+    views into the arrays.  The weight, psf weight and jacobian arrays may be
+    shared with other stacks, so they should not be modified in place
+
+    parameters
+    ----------
+    images: array
+        [nstamp, nrow, ncol] array of images
+    weights: array
+        [nstamp, nrow, ncol] array of weight maps
+    jacobians: sequence
+        Jacobian for each stamp
+    psf_images: array
+        [nstamp, psf_nrow, psf_ncol] array of psf images
+    psf_weights: array
+        [nstamp, psf_nrow, psf_ncol] array of psf weight maps
+    psf_jacobians: sequence
+        Jacobian for each psf
+    psf_nopix_images: array, optional
+        [nstamp, psf_nrow, psf_ncol] array of psf images without the
+        pixel.  If sent, the observations have a psf_nopix attribute
+    """
+    def __init__(self,
+                 images,
+                 weights,
+                 jacobians,
+                 psf_images,
+                 psf_weights,
+                 psf_jacobians,
+                 psf_nopix_images=None):
+
+        self.images = images
+        self.weights = weights
+        self.jacobians = jacobians
+        self.psf_images = psf_images
+        self.psf_weights = psf_weights
+        self.psf_jacobians = psf_jacobians
+        self.psf_nopix_images = psf_nopix_images
+
+    def __len__(self):
+        return self.images.shape[0]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        """
+        get an Observation for stamp i
+        """
+
+        psf_obs = Observation(
+            self.psf_images[i],
+            weight=self.psf_weights[i],
+            jacobian=self.psf_jacobians[i],
+        )
+
+        obs = Observation(
+            self.images[i],
+            weight=self.weights[i],
+            jacobian=self.jacobians[i],
+            psf=psf_obs,
+        )
+
+        if self.psf_nopix_images is not None:
+            obs.psf_nopix = Observation(
+                self.psf_nopix_images[i],
+                weight=self.psf_weights[i],
+                jacobian=self.psf_jacobians[i],
+            )
+
+        return obs
+
+
+def _get_stack(data, name):
+    """
+    get a [nstamp, nrow, ncol] array of 8 byte floats, converting only if
+    needed.  A single [nrow, ncol] stamp is allowed
+    """
+    data = numpy.asarray(data, dtype='f8')
+    if data.ndim == 2:
+        data = data[numpy.newaxis]
+    elif data.ndim != 3:
+        raise ValueError("%s should be [nstamp, nrow, ncol], got "
+                         "shape %s" % (name, data.shape,))
+    return data
+
+def get_pixel_response(ky, kx):
+    """
+    transform of the unit square pixel
+    """
+    # numpy.sinc is sin(pi x)/(pi x)
+    return numpy.sinc(ky*(0.5/pi))*numpy.sinc(kx*(0.5/pi))
+
+
+def _get_jacobian_matrix(jacobian):
+    """
+    matrix taking pixel coordinates (col, row) to world (u, v)
+    """
+    return numpy.array([
+        [jacobian.dudcol, jacobian.dudrow],
+        [jacobian.dvdcol, jacobian.dvdrow],
+    ])
+
+
+def _get_shear_matrices(shear, jmatrices):
+    """
+    get the matrix for the input shear in pixel coordinates (col, row), for
+    each of the [nstamp, 2, 2] jacobian matrices
+
+    For the world shear matrix S this is J^-1 S J, where J takes pixel
+    coordinates to world coordinates.  A profile sheared by this matrix has
+    k-space values f(A^T k)
+    """
+    g1, g2 = shear.g1, shear.g2
+    gsq = g1**2 + g2**2
+    if gsq >= 1.0:
+        raise GMixRangeError("g out of range: %g" % sqrt(gsq))
+
+    smat = numpy.array([
+        [1.0 + g1, g2],
+        [g2, 1.0 - g1],
+    ])
+    smat *= 1.0/sqrt(1.0 - gsq)
+
+    return numpy.linalg.solve(jmatrices, numpy.matmul(smat, jmatrices))
+
+
+def _transform_k(mats, grid):
+    """
+    get the k coordinates mat.dot([kx, ky]) for each point on the grid, for
+    each of the [nstamp, 2, 2] matrices
+
+    returns
+    -------
+    ky, kx with shape [nstamp] + grid.pshape
+    """
+    m = mats[:, :, :, numpy.newaxis, numpy.newaxis]
+    kx = m[:, 0, 0]*grid.kx + m[:, 0, 1]*grid.ky
+    ky = m[:, 1, 0]*grid.kx + m[:, 1, 1]*grid.ky
+    return ky, kx
+
+
+def _get_maxk(kimages, grid, thresholds):
+    """
+    get the largest |kx| or |ky| for which the amplitude is above the
+    threshold, for each of the [nstamp, ny, nx] k-space images
+    """
+    kmax = numpy.maximum(numpy.abs(grid.kx), numpy.abs(grid.ky))
+    above = numpy.abs(kimages) > thresholds[:, numpy.newaxis, numpy.newaxis]
+    return numpy.where(above, kmax, 0.0).max(axis=(1, 2))
+
+
+def _keys_cubic(s):
+    """
+    Keys cubic convolution kernel with a=-0.5
+    """
+    a = -0.5
+    s = numpy.abs(s)
+    return numpy.where(
+        s < 1.0,
+        ((a + 2.0)*s - (a + 3.0))*s*s + 1.0,
+        numpy.where(
+            s < 2.0,
+            ((a*s - 5.0*a)*s + 8.0*a)*s - 4.0*a,
+            0.0,
+        ),
+    )
+
+
+def _interp_kimage(kimage, iy, ix, k_interpolant):
+    """
+    interpolate the k-space values to the input fractional indices.  Points
+    that need values outside the array get zero for those values
+
+    kimage can have leading dimensions, in which case iy and ix must have
+    the same leading dimensions
+    """
+    ny, nx = kimage.shape[-2:]
+    lead = kimage.shape[:-2]
+    flat = kimage.reshape(lead + (ny*nx,))
+
+    y0 = numpy.floor(iy).astype('i8')
+    x0 = numpy.floor(ix).astype('i8')
+    ty = iy - y0
+    tx = ix - x0
+
+    if k_interpolant == 'linear':
+        offsets = [0, 1]
+        wy = [1.0 - ty, ty]
+        wx = [1.0 - tx, tx]
+    else:
+        offsets = [-1, 0, 1, 2]
+        wy = [_keys_cubic(ty - o) for o in offsets]
+        wx = [_keys_cubic(tx - o) for o in offsets]
+
+    res = numpy.zeros(iy.shape, dtype=kimage.dtype)
+
+    for oy, twy in zip(offsets, wy):
+        yy = y0 + oy
+        ygood = (yy >= 0) & (yy < ny)
+        yy = yy.clip(0, ny-1)
+
+        for ox, twx in zip(offsets, wx):
+            xx = x0 + ox
+            good = ygood & (xx >= 0) & (xx < nx)
+            xx = xx.clip(0, nx-1)
+
+            ind = (yy*nx + xx).reshape(lead + (-1,))
+            vals = numpy.take_along_axis(flat, ind, axis=-1)
+
+            res += (twy*twx*good)*vals.reshape(iy.shape)
+
+    return res
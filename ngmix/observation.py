@@ -5,7 +5,14 @@ from .jacobian import Jacobian, UnitJacobian, DiagonalJacobian
 from .gmix import GMix
 import copy
 
-from .pixels import make_pixels
+from .pixels import (
+    make_pixels,
+    make_pixel_index,
+    pixels_to_soa,
+    update_pixels_val,
+    update_pixels_coords,
+)
+from .gexceptions import GMixFatalError
 
 DEFAULT_XINTERP='lanczos15'
 
@@ -34,6 +41,11 @@ class Observation(object):
         Optional psf Observation
     meta: dict
         Optional dictionary
+
+    The pixels array is created when it is first used, and after that is
+    refreshed when the image, weight or jacobian are changed.  Changing only
+    the image refreshes only the values, and changing only the jacobian
+    refreshes only the coordinates
     """
 
     def __init__(self,
@@ -47,8 +59,12 @@ class Observation(object):
                  psf=None,
                  meta=None):
 
-        # pixels depends on image, weight and jacobian, so delay until all are
-        # set
+        # pixels depends on image, weight and jacobian, and is created
+        # when first used
+        self._pixels = None
+        self._pixel_index = None
+        self._pixels_soa = None
+        self._pixels_dirty = set()
 
         self.set_image(image, update_pixels=False)
 
@@ -57,8 +73,7 @@ class Observation(object):
         self.set_weight(weight, update_pixels=False)
         self.set_jacobian(jacobian, update_pixels=False)
 
-        # now image, weight, and jacobian are set, create
-        # the pixel array
+        # now image, weight, and jacobian are set
         self.update_pixels()
 
         self.set_meta(meta)
@@ -113,11 +128,55 @@ class Observation(object):
         """
         getter for pixels
 
-        currently this simply returns a reference.  Do not modify
+        The array is created the first time it is accessed, and refreshed
+        if the image, weight or jacobian have been set since.  Do not modify
         the pixels array!
         """
+        if self._pixels is None:
+            self._pixels = make_pixels(
+                self._image,
+                self._weight,
+                self._jacobian,
+            )
+        elif self._pixels_dirty:
+            if 'val' in self._pixels_dirty:
+                update_pixels_val(self._pixels, self._image, self.pixel_index)
+            if 'coords' in self._pixels_dirty:
+                update_pixels_coords(
+                    self._pixels,
+                    self.pixel_index,
+                    self._jacobian,
+                )
+
+        self._pixels_dirty.clear()
         return self._pixels
 
+    @property
+    def pixels_soa(self):
+        """
+        getter for the pixels in the structure-of-arrays layout, a [4,
+        npixels] array with rows v,u,val,ierr.  See pixels.make_pixels_soa
+
+        This is created from the pixels array the first time it is accessed.
+        Do not modify the array!
+        """
+        if self._pixels_soa is None:
+            self._pixels_soa = pixels_to_soa(self.pixels)
+        return self._pixels_soa
+
+    @property
+    def pixel_index(self):
+        """
+        getter for the pixel index, a 2-d array holding the index into the
+        pixels array for each pixel in the image, or -1 for pixels with zero
+        weight
+
+        This is created the first time it is accessed.  Do not modify
+        the pixel index array!
+        """
+        if self._pixel_index is None:
+            self._pixel_index = make_pixel_index(self._weight)
+        return self._pixel_index
 
     @property
     def bmask(self):
@@ -240,6 +299,10 @@ class Observation(object):
         parameters
         ----------
         image: ndarray (or None)
+        update_pixels: bool, optional
+            If True, the pixels array is marked for refreshing.  Only the
+            values are refreshed, the next time the pixels are used.
+            Default True
         """
 
         if hasattr(self,'_image'):
@@ -261,7 +324,7 @@ class Observation(object):
         self._image=image
 
         if update_pixels:
-            self.update_pixels()
+            self._set_pixels_dirty('val')
 
     def set_weight(self, weight, update_pixels=True):
         """
@@ -270,6 +333,9 @@ class Observation(object):
         parameters
         ----------
         weight: ndarray (or None)
+        update_pixels: bool, optional
+            If True, the pixels array is marked for rebuilding the next time
+            it is used.  Default True
         """
 
         image=self.image
@@ -288,6 +354,13 @@ class Observation(object):
         if update_pixels:
             self.update_pixels()
 
+    def has_full_pixels(self):
+        """
+        returns True if the pixels array holds every pixel in the image, in
+        row major order.  This is the case if all weights are positive
+        """
+        return self.pixels.size == self.image.size
+
     def set_bmask(self, bmask):
         """
         Set the bitmask
@@ -395,6 +468,10 @@ class Observation(object):
         parameters
         ----------
         jacobian: Jacobian (or None)
+        update_pixels: bool, optional
+            If True, the pixels array is marked for refreshing.  Only the
+            coordinates are refreshed, the next time the pixels are used.
+            Default True
         """
         if jacobian is None:
             cen=(numpy.array(self.image.shape)-1.0)/2.0
@@ -408,7 +485,7 @@ class Observation(object):
         self._jacobian=jac
 
         if update_pixels:
-            self.update_pixels()
+            self._set_pixels_dirty('coords')
 
     def get_jacobian(self):
         """
@@ -605,14 +682,28 @@ class Observation(object):
 
     def update_pixels(self):
         """
-        create the pixel struct array, for efficient cache usage
+        mark the pixel struct array for rebuilding the next time it is used.
+        Call this after modifying the image or weight in place
         """
 
-        self._pixels = make_pixels(
-            self.image,
-            self.weight,
-            self._jacobian,
-        )
+        if not numpy.any(self._weight > 0.0):
+            raise GMixFatalError('no weights > 0')
+
+        self._set_pixels_dirty('all')
+
+    def _set_pixels_dirty(self, part):
+        """
+        mark part of the pixels array as out of date, 'val', 'coords' or
+        'all'.  The derived soa array is always dropped
+        """
+        if part == 'all':
+            self._pixels = None
+            self._pixel_index = None
+            self._pixels_dirty.clear()
+        elif self._pixels is not None:
+            self._pixels_dirty.add(part)
+
+        self._pixels_soa = None
 
 class ObsList(list):
     """
@@ -0,0 +1,74 @@
+"""
+Control the use of the multi-threaded pixel kernels
+
+The render, likelihood, fdiff and EM kernels have parallel variants that
+split the pixels into fixed size blocks and process the blocks on multiple
+threads using numba.prange.  Sums are accumulated per block and then added
+in block order, so the results do not depend on the number of threads.
+
+The parallel kernels are only worth using for large images, such as big
+coadd psf stamps or images of blended groups; for small stamps the
+threading overhead dominates.  By default the serial kernels are used.  To
+turn on the parallel kernels globally for images with at least min_pixels
+pixels use
+
+    ngmix.parallel.set_parallel(True, min_pixels=10000)
+
+Most methods that use the kernels also accept parallel=True/False to
+override the global setting for a single call.  The number of threads is
+controlled by numba, e.g. with numba.set_num_threads or the
+NUMBA_NUM_THREADS environment variable.
+"""
+
+# number of pixels in each block processed by a thread.  This is fixed
+# so that the order of the sums is independent of the number of threads
+PIXEL_BLOCKSIZE=1024
+
+_parallel_conf={
+    'parallel': False,
+    'min_pixels': 10000,
+}
+
+def set_parallel(parallel, min_pixels=None):
+    """
+    set the global default for using the parallel kernels
+
+    parameters
+    ----------
+    parallel: bool
+        If True, use parallel kernels for images with at least
+        min_pixels pixels
+    min_pixels: int, optional
+        Minimum number of pixels for which the parallel kernels are used.
+        If not sent, the current value is kept, default 10000
+    """
+    _parallel_conf['parallel'] = bool(parallel)
+    if min_pixels is not None:
+        _parallel_conf['min_pixels'] = int(min_pixels)
+
+def get_parallel():
+    """
+    get a copy of the global parallel configuration
+    """
+    return _parallel_conf.copy()
+
+def use_parallel(npixels, parallel=None):
+    """
+    determine if the parallel kernels should be used
+
+    parameters
+    ----------
+    npixels: int
+        The number of pixels to be processed
+    parallel: bool, optional
+        If sent, overrides the global setting.  Even when True, the serial
+        kernels are used if there are fewer than min_pixels pixels
+
+    returns
+    -------
+    True if the parallel kernels should be used
+    """
+    if parallel is None:
+        parallel = _parallel_conf['parallel']
+
+    return parallel and npixels >= _parallel_conf['min_pixels']
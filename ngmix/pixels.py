@@ -49,6 +49,131 @@ def make_pixels(image, weight, jacob, ignore_zero_weight=True):
 
     return pixels
 
+def make_pixels_soa(image, weight, jacob, ignore_zero_weight=True):
+    """
+    make a pixel array from the image and weight, using the
+    structure-of-arrays layout
+
+    The returned array has shape [4, npixels], with rows v,u,val,ierr given
+    by PIXELS_SOA_V, PIXELS_SOA_U, PIXELS_SOA_VAL, PIXELS_SOA_IERR.  Each row
+    is contiguous, which lets the compiler vectorize the loops over pixels
+    in the *_soa kernels
+
+    parameters
+    ----------
+    image: 2-d array
+        2-d image array
+    weight: 2-d array
+        2-d image array same shape as image
+    jacob: jacobian structure
+        row0,col0,dvdrow,dvdcol,dudrow,dudcol,...
+    ignore_zero_weight: bool
+        If set, zero or negative weight pixels are ignored.  Default True.
+
+    returns
+    -------
+    [4, npixels] pixels array
+    """
+
+    pixels = make_pixels(
+        image,
+        weight,
+        jacob,
+        ignore_zero_weight=ignore_zero_weight,
+    )
+    return pixels_to_soa(pixels)
+
+def pixels_to_soa(pixels):
+    """
+    convert an array of pixel structs to the structure-of-arrays layout
+
+    parameters
+    ----------
+    pixels: array
+        1-d array of pixel structures, u,v,val,ierr
+
+    returns
+    -------
+    [4, npixels] pixels array, see make_pixels_soa
+    """
+
+    soa = numpy.zeros( (4, pixels.size) )
+    soa[PIXELS_SOA_V]    = pixels['v']
+    soa[PIXELS_SOA_U]    = pixels['u']
+    soa[PIXELS_SOA_VAL]  = pixels['val']
+    soa[PIXELS_SOA_IERR] = pixels['ierr']
+
+    return soa
+
+def make_pixel_index(weight, ignore_zero_weight=True):
+    """
+    make a 2-d array holding the index into the pixels array for each
+    pixel in the image, as created by make_pixels
+
+    parameters
+    ----------
+    weight: 2-d array
+        The weight image
+    ignore_zero_weight: bool
+        Should match the value sent to make_pixels.  If set, zero or negative
+        weight pixels are not in the pixels array and have index -1.
+        Default True.
+
+    returns
+    -------
+    2-d index array, same shape as the weight
+    """
+
+    pixel_index = numpy.zeros(weight.shape, dtype='i4')
+
+    if ignore_zero_weight:
+        w = weight > 0.0
+        pixel_index[:,:] = -1
+        pixel_index[w] = numpy.arange(w.sum(), dtype='i4')
+    else:
+        pixel_index[:,:] = numpy.arange(
+            weight.size, dtype='i4',
+        ).reshape(weight.shape)
+
+    return pixel_index
+
+def update_pixels_val(pixels, image, pixel_index):
+    """
+    refresh the image values in a pixels array in place, for when only the
+    image has changed
+
+    parameters
+    ----------
+    pixels: array
+        1-d array of pixel structures, as created by make_pixels
+    image: 2-d array
+        The new image
+    pixel_index: 2-d array
+        Index into the pixels array for each image pixel, as created by
+        make_pixel_index
+    """
+    pixels['val'] = image[pixel_index >= 0]
+
+def update_pixels_coords(pixels, pixel_index, jacob):
+    """
+    refresh the v,u coordinates in a pixels array in place, for when only
+    the jacobian has changed
+
+    parameters
+    ----------
+    pixels: array
+        1-d array of pixel structures, as created by make_pixels
+    pixel_index: 2-d array
+        Index into the pixels array for each image pixel, as created by
+        make_pixel_index
+    jacob: Jacobian
+        The new jacobian
+    """
+    rows, cols = numpy.where(pixel_index >= 0)
+    v, u = jacob.get_vu(rows.astype('f8'), cols.astype('f8'))
+    pixels['v'] = v
+    pixels['u'] = u
+
 def make_coords(dims, jacob):
     """
     make a coords array
@@ -68,6 +193,12 @@ def make_coords(dims, jacob):
 
     return coords
 
+# rows of the structure-of-arrays pixel layout
+PIXELS_SOA_V=0
+PIXELS_SOA_U=1
+PIXELS_SOA_VAL=2
+PIXELS_SOA_IERR=3
+
 _pixels_dtype=[
     ('u','f8'),
     ('v','f8'),
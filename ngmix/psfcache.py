@@ -0,0 +1,218 @@
+"""
+Cache psf fits for reuse across objects that share the same psf image
+
+Psf cutouts often repeat, e.g. for neighbours in a dense field drawn from
+the same psf model position.  A PSFFitCache stores the fitted gmix and the
+result for each psf fit, keyed by a hash of the psf image and weight, the
+jacobian and the fit configuration.  Send the same cache to each
+Bootstrapper to reuse fits across objects
+
+    cache = ngmix.psfcache.PSFFitCache(maxsize=10000)
+    boot = ngmix.bootstrap.Bootstrapper(obs, psf_cache=cache)
+
+Failed fits are cached too, so a psf that fails is not refit.  The fit for
+a given key is done once, so with a cache the results no longer depend on
+the random guesses for later objects with the same psf.
+
+The least recently used entries are dropped when the cache is full.  If
+cache_dir is sent, each entry is also written to a file in that directory,
+and entries not in memory are looked for there, so fits can be shared
+between runs or processes.
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import copy
+import hashlib
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class PSFFitCache(object):
+    """
+    Least recently used cache of psf fits
+
+    parameters
+    ----------
+    maxsize: int, optional
+        Maximum number of fits held in memory, default 1000
+    cache_dir: string, optional
+        If sent, fits are also stored as files in this directory
+    """
+    def __init__(self, maxsize=1000, cache_dir=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1, got %d" % maxsize)
+
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.nhit = 0
+        self.nmiss = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_key(self, psf_obs, psf_model, Tguess, ntry, fit_pars):
+        """
+        get the key for a psf fit
+
+        parameters
+        ----------
+        psf_obs: Observation
+            The psf observation
+        psf_model: string
+            The model being fit
+        Tguess: float
+            The guess for T
+        ntry: int
+            Number of tries
+        fit_pars: dict or None
+            The fitting parameters
+
+        returns
+        -------
+        string key
+        """
+        if fit_pars is None:
+            fit_pars_str = 'None'
+        else:
+            fit_pars_str = repr(sorted(fit_pars.items()))
+
+        config = '%s %r %r %s' % (psf_model, Tguess, ntry, fit_pars_str)
+
+        h = hashlib.sha1()
+        h.update(repr(psf_obs.image.shape).encode('ascii'))
+        h.update(psf_obs.image.tobytes())
+        h.update(psf_obs.weight.tobytes())
+        h.update(psf_obs.jacobian._data.tobytes())
+        h.update(config.encode('ascii'))
+
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        get the fit for the key
+
+        returns
+        -------
+        A CachedPSFFit, or None if the key is not in the cache
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                # put back as the most recently used
+                self._data[key] = entry
+
+        if entry is None and self.cache_dir is not None:
+            entry = self._read_entry(key)
+            if entry is not None:
+                self._store(key, entry)
+
+        if entry is None:
+            self.nmiss += 1
+            return None
+
+        self.nhit += 1
+
+        gmix, result = entry
+        return CachedPSFFit(gmix, copy.deepcopy(result))
+
+    def put(self, key, fitter):
+        """
+        store the fit for the key
+
+        parameters
+        ----------
+        key: string
+            The key from get_key
+        fitter: fitter
+            The psf fitter.  The result is stored, and the gmix if the fit
+            succeeded
+        """
+        result = copy.deepcopy(fitter.get_result())
+        if result['flags'] == 0:
+            # some fitters, e.g. GMixEM, return their own gmix, which the
+            # caller may then modify
+            gmix = fitter.get_gmix().copy()
+        else:
+            gmix = None
+
+        entry = (gmix, result)
+        self._store(key, entry)
+
+        if self.cache_dir is not None:
+            self._write_entry(key, entry)
+
+    def clear(self):
+        """
+        remove all entries from memory.  Files in the cache_dir are kept
+        """
+        with self._lock:
+            self._data.clear()
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = entry
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _get_fname(self, key):
+        return os.path.join(self.cache_dir, '%s.pkl' % key)
+
+    def _read_entry(self, key):
+        fname = self._get_fname(key)
+        if not os.path.exists(fname):
+            return None
+
+        with open(fname, 'rb') as fobj:
+            return pickle.load(fobj)
+
+    def _write_entry(self, key, entry):
+        """
+        write to a temporary file and rename, so readers never see a
+        partial file
+        """
+        fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fobj:
+            pickle.dump(entry, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.rename(tmpname, self._get_fname(key))
+
+
+class CachedPSFFit(object):
+    """
+    Stands in for the psf fitter when the fit came from a PSFFitCache
+
+    parameters
+    ----------
+    gmix: GMix or None
+        The fitted gmix, None if the fit failed
+    result: dict
+        The fit result
+    """
+    def __init__(self, gmix, result):
+        self._gmix = gmix
+        self._result = result
+
+    def get_result(self):
+        """
+        get the result dict
+        """
+        return self._result
+
+    def get_gmix(self):
+        """
+        get a copy of the fitted gmix
+        """
+        if self._gmix is None:
+            raise RuntimeError("the psf fit failed, there is no gmix")
+        return self._gmix.copy()
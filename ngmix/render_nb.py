@@ -1,8 +1,12 @@
-from numba import njit
+import numpy
+from numba import njit, prange
+from .parallel import PIXEL_BLOCKSIZE
+from .fastexp_nb import exp3
 from .gmix_nb import (
     gmix_eval_pixel,
     gmix_eval_pixel_fast,
     gmix_set_norms,
+    gauss2d_get_row_chi2,
 )
 
 try:
@@ -10,6 +14,10 @@ try:
 except NameError:
     xrange=range
 
+# gaussians are only evaluated within this chi^2 when using the fast
+# exponential
+RENDER_MAX_CHI2=300.0
+
 @njit
 def render(gmix, coords, image, fast_exp=0, max_chi2=300.0):
     """
@@ -45,3 +53,146 @@ def render(gmix, coords, image, fast_exp=0, max_chi2=300.0):
     else:
         for icoord in xrange(n_coords):
             image[icoord] += gmix_eval_pixel(gmix, coords[icoord])
+
+@njit
+def render_grid(gmix, image, jacob, fast_exp=0, max_chi2=RENDER_MAX_CHI2):
+    """
+    render the gaussian mixture in the image, evaluating chi^2 along each
+    row with a recurrence rather than from stored coordinates
+
+    When using the fast exponential, only the columns within max_chi2 of
+    each gaussian are visited
+
+    parameters
+    ----------
+    gmix:
+        The gaussian mixture.  norm is not checked
+    image:
+        the 2-d image to fill
+    jacob: jacobian structure
+        The jacobian for the image
+    fast_exp: integer, optional
+        1 for fast
+    max_chi2: float, optional
+        If fast_exp is 1, this is the maximum chi^2 to
+        be evaluated
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    nrow, ncol = image.shape
+
+    if not fast_exp:
+        max_chi2 = numpy.inf
+
+    for row in xrange(nrow):
+        for igauss in xrange(gmix.size):
+            gauss = gmix[igauss]
+            pnorm = gauss['pnorm']
+
+            colmin, colmax, chi2, d1, d2 = gauss2d_get_row_chi2(
+                gauss, jacob, row, ncol, max_chi2,
+            )
+
+            if fast_exp:
+                for col in xrange(colmin, colmax+1):
+                    # the recurrence can give chi2 slightly below zero
+                    if chi2 < max_chi2:
+                        image[row, col] += pnorm*exp3( -0.5*max(chi2, 0.0) )
+                    chi2 += d1
+                    d1 += d2
+            else:
+                for col in xrange(colmin, colmax+1):
+                    image[row, col] += pnorm*numpy.exp( -0.5*chi2 )
+                    chi2 += d1
+                    d1 += d2
+
+@njit(parallel=True)
+def render_grid_batch(gmixes, images, jacobs, fast_exp=0,
+                      max_chi2=RENDER_MAX_CHI2):
+    """
+    render a set of gaussian mixtures into a stack of images, one object
+    per image, processing the objects in parallel
+
+    parameters
+    ----------
+    gmixes:
+        [nobj, ngauss] array of gaussian mixtures.  norms are set if needed
+    images:
+        [nobj, nrow, ncol] stack of images to fill
+    jacobs: array of jacobian structures
+        [nobj] jacobians, or a single jacobian for all images
+    fast_exp: integer, optional
+        1 for fast
+    max_chi2: float, optional
+        If fast_exp is 1, this is the maximum chi^2 to
+        be evaluated
+    """
+
+    nobj = images.shape[0]
+
+    # set norms outside the parallel loop, so range errors are raised
+    # in the usual way
+    for iobj in xrange(nobj):
+        gm = gmixes[iobj]
+        if gm['norm_set'][0] == 0:
+            gmix_set_norms(gm)
+
+    shared = jacobs.shape[0] == 1
+
+    for iobj in prange(nobj):
+        if shared:
+            ijac = 0
+        else:
+            ijac = iobj
+
+        render_grid(
+            gmixes[iobj],
+            images[iobj],
+            jacobs[ijac:ijac+1],
+            fast_exp,
+            max_chi2,
+        )
+
+@njit(parallel=True)
+def render_parallel(gmix, coords, image, fast_exp=0, max_chi2=300.0):
+    """
+    render the gaussian mixture in the image, processing blocks of pixels in
+    parallel
+
+    parameters
+    ----------
+    gmix:
+        The gaussian mixture.  norm is not checked
+    coords:  array of coords
+        The coords, holding location information
+    image:
+        the image to fill, should be unraveled
+    fast_exp: integer, optional
+        1 for fast
+    max_chi2: float, optional
+        If fast_exp is 1, this is the maximum chi^2 to
+        be evaluated
+    """
+
+    if gmix['norm_set'][0] == 0:
+        gmix_set_norms(gmix)
+
+    n_coords = coords.shape[0]
+    n_blocks = (n_coords + PIXEL_BLOCKSIZE - 1)//PIXEL_BLOCKSIZE
+
+    for iblock in prange(n_blocks):
+        beg = iblock*PIXEL_BLOCKSIZE
+        end = min(beg + PIXEL_BLOCKSIZE, n_coords)
+
+        if fast_exp:
+            for icoord in xrange(beg, end):
+                image[icoord] += gmix_eval_pixel_fast(
+                    gmix,
+                    coords[icoord],
+                    max_chi2=max_chi2,
+                )
+        else:
+            for icoord in xrange(beg, end):
+                image[icoord] += gmix_eval_pixel(gmix, coords[icoord])
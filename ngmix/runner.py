@@ -0,0 +1,404 @@
+"""
+Run the metacal bootstrapper over a range of objects in a set of MEDS files
+
+The objects are split into chunks of contiguous indices, and the chunks are
+processed by a pool of worker processes.  Each worker opens its own MEDS
+handles once, when it starts, and reuses them for all of its chunks.
+Results are gathered into a single structured array, with a row for each
+object in index order.
+
+Failures are isolated to the object: an exception raised while processing
+one object sets flags for that object and processing continues.
+
+Each object gets its own random number generator seeded from the run seed
+and the object index, and it is used for the psf guesses, metacal noise and
+the priors.  The results for an object are therefore the same no matter
+how the objects are split into chunks or which worker processes them.
+
+For the best scaling use one worker process per core, and leave the
+multi-threaded pixel kernels off (see ngmix.parallel) so the workers do not
+compete for cores.
+"""
+from __future__ import print_function, absolute_import, division
+
+import copy
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy
+
+from .bootstrap import MaxMetacalBootstrapper
+from .gexceptions import BootPSFFailure, BootGalFailure, GMixRangeError
+from .gmix import get_model_npars
+from .metacal import METACAL_MINIMAL_TYPES
+from .psfcache import PSFFitCache
+
+try:
+    xrange
+except NameError:
+    xrange=range
+
+logger = logging.getLogger(__name__)
+
+RUNNER_NO_DATA = 2**0
+RUNNER_PSF_FAILURE = 2**1
+RUNNER_GAL_FAILURE = 2**2
+RUNNER_EXCEPTION = 2**3
+
+DEFVAL = -9999.0
+
+_default_config = {
+    'weight_type': 'weight',
+    'find_cen': False,
+    'psf_fit_pars': None,
+    'psf_ntry': 5,
+    'ntry': 1,
+    'metacal_pars': None,
+    'prior': None,
+    'mmap': False,
+    'psf_cache': None,
+}
+_required_config = ['psf_model', 'gal_model', 'max_pars', 'psf_Tguess']
+
+# state for the current worker process, set by _init_worker
+_worker_state = {}
+
+
+def run_meds(meds_files,
+             config,
+             start=0,
+             end=None,
+             nproc=1,
+             chunksize=100,
+             seed=None):
+    """
+    run MaxMetacalBootstrapper.fit_metacal on each object in the range
+
+    parameters
+    ----------
+    meds_files: list of strings
+        Paths to the MEDS files, one for each band
+    config: dict
+        Configuration for the pipeline.  Required entries are psf_model,
+        gal_model, max_pars and psf_Tguess, with the same meaning as the
+        arguments to MaxMetacalBootstrapper.fit_metacal.  Optional entries
+        are psf_fit_pars, psf_ntry, ntry, metacal_pars, prior, find_cen
+        (default False), weight_type (default 'weight', see
+        medsreaders.NGMixMEDS.get_obs), mmap (default False, see
+        medsreaders.NGMixMEDS) and psf_cache, a dict of keywords for
+        psfcache.PSFFitCache; if sent each worker keeps a cache of psf
+        fits, and the psf fits then depend on which objects the worker
+        processed before.  The metacal types default to
+        noshear, 1p, 1m, 2p, 2m and can be set with the types entry of
+        metacal_pars
+    start: int, optional
+        First object to process, default 0
+    end: int, optional
+        One past the last object to process, default the number of objects
+    nproc: int, optional
+        Number of worker processes.  If 1, the objects are processed in
+        this process.  Default 1
+    chunksize: int, optional
+        Number of objects in each unit of work sent to a worker, default 100
+    seed: int, optional
+        Seed for the run.  Each object is seeded from this seed and its
+        index.  If not sent, a seed is drawn from the global numpy generator
+
+    returns
+    -------
+    output: array
+        Structured array with a row for each object, see get_output_dtype
+    """
+
+    from .medsreaders import NGMixMEDS
+
+    config = _get_config(config)
+    if seed is None:
+        seed = numpy.random.randint(0, 2**30)
+
+    nband = len(meds_files)
+    if end is None:
+        m = NGMixMEDS(meds_files[0])
+        end = m.size
+        m.close()
+
+    if end <= start:
+        raise ValueError("end must be greater than start, "
+                         "got %d,%d" % (start, end))
+
+    output = numpy.zeros(
+        end-start,
+        dtype=get_output_dtype(config, nband),
+    )
+
+    chunks = [
+        (cstart, min(cstart+chunksize, end))
+        for cstart in xrange(start, end, chunksize)
+    ]
+
+    if nproc == 1:
+        _init_worker(meds_files, config)
+        try:
+            for cstart, cend in chunks:
+                coutput = _process_chunk(cstart, cend, seed)
+                output[cstart-start:cend-start] = coutput
+        finally:
+            for m in _worker_state.pop('mbmeds').mlist:
+                m.close()
+            _worker_state.clear()
+    else:
+        with ProcessPoolExecutor(
+            max_workers=nproc,
+            initializer=_init_worker,
+            initargs=(meds_files, config),
+        ) as executor:
+
+            futures = {
+                executor.submit(_process_chunk, cstart, cend, seed): cstart
+                for cstart, cend in chunks
+            }
+            for future in as_completed(futures):
+                chunk_output = future.result()
+                cstart = futures[future]-start
+                output[cstart:cstart+chunk_output.size] = chunk_output
+
+    return output
+
+
+def get_output_dtype(config, nband):
+    """
+    get the dtype for the output of run_meds
+
+    Fields for each metacal type have the type appended, e.g. mcal_g_1p
+
+    parameters
+    ----------
+    config: dict
+        Configuration, see run_meds
+    nband: int
+        Number of bands
+
+    returns
+    -------
+    list of dtype descriptors
+    """
+    npars = get_model_npars(config['gal_model']) + nband - 1
+
+    dt = [
+        ('id', 'i8'),
+        ('index', 'i8'),
+        ('flags', 'i4'),
+        ('mcal_flags', 'i4'),
+    ]
+    for type in _get_types(config):
+        dt += [
+            ('mcal_flags_%s' % type, 'i4'),
+            ('mcal_pars_%s' % type, 'f8', npars),
+            ('mcal_pars_cov_%s' % type, 'f8', (npars, npars)),
+            ('mcal_g_%s' % type, 'f8', 2),
+            ('mcal_g_cov_%s' % type, 'f8', (2, 2)),
+            ('mcal_T_%s' % type, 'f8'),
+            ('mcal_T_err_%s' % type, 'f8'),
+            ('mcal_s2n_r_%s' % type, 'f8'),
+            ('mcal_T_r_%s' % type, 'f8'),
+            ('mcal_psf_T_r_%s' % type, 'f8'),
+            ('mcal_gpsf_%s' % type, 'f8', 2),
+            ('mcal_Tpsf_%s' % type, 'f8'),
+        ]
+
+    return dt
+
+
+def _get_config(config_in):
+    """
+    check the config and fill in defaults
+
+    The prior is copied, since the random number generators it holds are
+    reseeded for each object
+    """
+    for key in _required_config:
+        if key not in config_in:
+            raise ValueError("config must contain '%s'" % key)
+
+    config = {}
+    config.update(_default_config)
+    config.update(config_in)
+
+    metacal_pars = {}
+    if config['metacal_pars'] is not None:
+        metacal_pars.update(config['metacal_pars'])
+
+    # the types must be known to set up the output
+    metacal_pars['types'] = list(
+        metacal_pars.get('types', METACAL_MINIMAL_TYPES)
+    )
+    config['metacal_pars'] = metacal_pars
+
+    if config['prior'] is not None:
+        config['prior'] = copy.deepcopy(config['prior'])
+
+    return config
+
+
+def _get_types(config):
+    return config['metacal_pars']['types']
+
+
+def _copy_metacal_pars(config):
+    """
+    metacal can add to the types list, so send a copy
+    """
+    metacal_pars = config['metacal_pars'].copy()
+    metacal_pars['types'] = list(metacal_pars['types'])
+    return metacal_pars
+
+
+def _init_worker(meds_files, config):
+    """
+    open the MEDS files for this process
+    """
+    from .medsreaders import NGMixMEDS, MultiBandNGMixMEDS
+
+    mlist = [NGMixMEDS(fname, mmap=config['mmap']) for fname in meds_files]
+
+    _worker_state['mbmeds'] = MultiBandNGMixMEDS(mlist)
+    _worker_state['config'] = config
+
+    if config['psf_cache'] is not None:
+        _worker_state['psf_cache'] = PSFFitCache(**config['psf_cache'])
+    else:
+        _worker_state['psf_cache'] = None
+
+
+def _process_chunk(start, end, seed):
+    """
+    process objects [start, end) using the MEDS files opened for this process
+    """
+    mbmeds = _worker_state['mbmeds']
+    config = _worker_state['config']
+
+    output = numpy.zeros(
+        end-start,
+        dtype=get_output_dtype(config, mbmeds.nband),
+    )
+    for name in output.dtype.names:
+        if output.dtype[name].base.kind == 'f':
+            output[name] = DEFVAL
+
+    for iobj in xrange(start, end):
+        _process_object(
+            mbmeds,
+            config,
+            iobj,
+            seed,
+            output[iobj-start],
+            psf_cache=_worker_state['psf_cache'],
+        )
+
+    return output
+
+
+def _process_object(mbmeds, config, iobj, seed, output, psf_cache=None):
+    """
+    process a single object, filling the output row.  Exceptions are caught
+    and recorded in the flags
+    """
+
+    output['index'] = iobj
+    output['id'] = mbmeds.mlist[0]['id'][iobj]
+
+    rng = numpy.random.RandomState([seed, iobj])
+
+    # some code still uses the global generator.  Seed it for this object,
+    # and restore the caller's state afterwards
+    global_state = numpy.random.get_state()
+    numpy.random.seed(rng.randint(0, 2**30))
+
+    try:
+        _fit_object(mbmeds, config, iobj, rng, output, psf_cache=psf_cache)
+    finally:
+        numpy.random.set_state(global_state)
+
+
+def _fit_object(mbmeds, config, iobj, rng, output, psf_cache=None):
+    """
+    run the bootstrapper for the object, filling the output row
+    """
+
+    prior = config['prior']
+    if prior is not None:
+        _seed_rngs(prior, rng)
+
+    try:
+        mbobs = mbmeds.get_mbobs(iobj, weight_type=config['weight_type'])
+        if any(len(obslist) == 0 for obslist in mbobs):
+            output['flags'] = RUNNER_NO_DATA
+            return
+
+        boot = MaxMetacalBootstrapper(
+            mbobs,
+            find_cen=config['find_cen'],
+            rng=rng,
+            psf_cache=psf_cache,
+        )
+        boot.fit_metacal(
+            config['psf_model'],
+            config['gal_model'],
+            config['max_pars'],
+            config['psf_Tguess'],
+            psf_fit_pars=config['psf_fit_pars'],
+            metacal_pars=_copy_metacal_pars(config),
+            prior=prior,
+            psf_ntry=config['psf_ntry'],
+            ntry=config['ntry'],
+        )
+    except BootPSFFailure as err:
+        logger.debug('object %d: %s' % (iobj, str(err)))
+        output['flags'] = RUNNER_PSF_FAILURE
+        return
+    except (BootGalFailure, GMixRangeError) as err:
+        logger.debug('object %d: %s' % (iobj, str(err)))
+        output['flags'] = RUNNER_GAL_FAILURE
+        return
+    except Exception as err:
+        logger.warning('object %d: unexpected error: %s' % (iobj, str(err)))
+        output['flags'] = RUNNER_EXCEPTION
+        return
+
+    res = boot.get_metacal_result()
+    output['mcal_flags'] = res['mcal_flags']
+
+    for type in _get_types(config):
+        tres = res[type]
+
+        output['mcal_flags_%s' % type] = tres['flags']
+        if tres['flags'] != 0:
+            continue
+
+        for name in ['pars', 'pars_cov', 'g', 'g_cov', 'T', 'T_err',
+                     's2n_r', 'T_r', 'psf_T_r', 'gpsf', 'Tpsf']:
+            output['mcal_%s_%s' % (name, type)] = tres[name]
+
+
+def _seed_rngs(obj, rng, visited=None):
+    """
+    seed each random number generator held by the object, or by the ngmix
+    objects it holds, from the input generator.  Used to give priors a
+    deterministic state for each object
+    """
+    if visited is None:
+        visited = set()
+
+    if id(obj) in visited:
+        return
+    visited.add(id(obj))
+
+    if isinstance(obj, numpy.random.RandomState):
+        obj.seed(rng.randint(0, 2**30))
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _seed_rngs(item, rng, visited=visited)
+    elif (hasattr(obj, '__dict__')
+            and type(obj).__module__.startswith('ngmix')):
+        for name in sorted(obj.__dict__):
+            _seed_rngs(obj.__dict__[name], rng, visited=visited)
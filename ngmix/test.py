@@ -4,11 +4,15 @@ import numpy as np
 
 from . import joint_prior
 from . import gmix
-from .jacobian import UnitJacobian
+from .jacobian import UnitJacobian, DiagonalJacobian
 from . import bootstrap
+from . import em
 from .observation import Observation
+from .shape import Shape
 from .fitting import print_pars
 from . import metacal
+from . import parallel
+from .gexceptions import GMixFatalError
 
 def test():
     suite = unittest.TestLoader().loadTestsFromTestCase(TestFitting)
@@ -142,6 +146,447 @@ class TestFitting(unittest.TestCase):
             print_pars(res['pars_err'], front='pars err:  ')
             print('s2n:',res['s2n_w'])
 
+    def testLMJacob(self):
+        """
+        test the analytic jacobian gives the same answer as
+        finite differences
+        """
+        from .fitting import LMSimple
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+
+        obs=mdict['obs']
+        obs.set_psf(mdict['psf_obs'])
+
+        boot=bootstrap.Bootstrapper(obs)
+        boot.fit_psfs('gauss', 4.0)
+
+        guess=mdict['pars'].copy()
+        guess[4] *= 1.1
+        guess[5] *= 0.9
+
+        reslist=[]
+        for use_jacob in [False,True]:
+            fitter=LMSimple(obs, 'exp', use_jacob=use_jacob)
+            fitter.go(guess)
+            res=fitter.get_result()
+            self.assertEqual(res['flags'],0)
+            reslist.append(res)
+
+        self.assertTrue(reslist[1]['nfev'] < reslist[0]['nfev'])
+        pdiff=np.abs(reslist[1]['pars']-reslist[0]['pars'])
+        self.assertTrue(np.all(pdiff < 0.1*reslist[0]['pars_err']))
+
+    def testLMBatch(self):
+        """
+        test the batch fitter agrees with LMSimple
+        """
+        from .fitting import LMSimple
+        from . import batchfit
+
+        noise=0.001
+
+        obslist=[]
+        guesses=[]
+        psf_gmixes=[]
+        reslist=[]
+        for i in range(3):
+            mdict=self.get_obs_data('exp',noise)
+            obs=mdict['obs']
+            obs.set_psf(mdict['psf_obs'])
+
+            boot=bootstrap.Bootstrapper(obs)
+            boot.fit_psfs('gauss', 4.0)
+
+            guess=mdict['pars'].copy()
+            guess[4] *= 1.1
+            guess[5] *= 0.9
+
+            fitter=LMSimple(obs, 'exp')
+            fitter.go(guess)
+            reslist.append(fitter.get_result())
+
+            obslist.append(obs)
+            guesses.append(guess)
+            psf_gmixes.append(obs.psf.gmix)
+
+        pixels, offsets = batchfit.pack_pixels(obslist)
+        psfs = batchfit.pack_gmix(psf_gmixes)
+        bres = batchfit.fit_lm_batch(pixels, offsets, guesses, 'exp', psfs=psfs)
+
+        for res, tbres in zip(reslist, bres):
+            self.assertEqual(tbres['flags'],0)
+            pdiff=np.abs(tbres['pars']-res['pars'])
+            self.assertTrue(np.all(pdiff < 0.1*res['pars_err']))
+            self.assertTrue(np.allclose(tbres['pars_err'], res['pars_err'], rtol=0.01))
+
+        # an object with no pixels
+        offsets = np.array([0, offsets[1], offsets[1], offsets[2]])
+        with self.assertRaises(GMixFatalError):
+            batchfit.fit_lm_batch(pixels, offsets, guesses, 'exp', psfs=psfs)
+
+    def testParallel(self):
+        """
+        test the parallel kernels agree with the serial ones
+        """
+        from .fitting_nb import fill_fdiff
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+        obs=mdict['obs']
+
+        gm=gmix.GMixModel(mdict['pars'], 'exp')
+
+        # make sure the parallel kernels are used for this small image
+        conf=parallel.get_parallel()
+        parallel.set_parallel(conf['parallel'], min_pixels=0)
+
+        try:
+            im=gm.make_image(obs.image.shape, jacobian=obs.jacobian,
+                             parallel=False)
+            pim=gm.make_image(obs.image.shape, jacobian=obs.jacobian,
+                              parallel=True)
+            self.assertTrue(np.allclose(im, pim))
+
+            loglike=gm.get_loglike(obs, parallel=False)
+            ploglike=gm.get_loglike(obs, parallel=True)
+            self.assertTrue(np.allclose(loglike, ploglike))
+
+            # the serial kernel that visits every pixel, as the parallel
+            # one does
+            fdiff=np.zeros(obs.pixels.size+3)
+            fill_fdiff(gm.get_data(), obs.pixels, fdiff, 3)
+            pfdiff=np.zeros(fdiff.size)
+            gm.fill_fdiff(obs, pfdiff, start=3, parallel=True)
+            self.assertTrue(np.all(pfdiff == fdiff))
+
+            psf_gm=gmix.GMixModel([0.0, 0.0, 0.01, -0.02, self.Tpsf, 1.0],
+                                  'turb')
+            im, sky = em.prep_image(
+                psf_gm.make_image(obs.image.shape, jacobian=obs.jacobian),
+            )
+            em_obs=Observation(im, jacobian=obs.jacobian)
+            guess=gmix.GMixModel([0.1, -0.1, 0.0, 0.0, self.Tpsf*1.2, 1.0],
+                                 'turb')
+
+            results=[]
+            for use_parallel in [False, True]:
+                fitter=em.GMixEM(em_obs)
+                fitter.go(guess, sky, maxiter=2000, tol=1.0e-6,
+                          parallel=use_parallel)
+                res=fitter.get_result()
+                self.assertEqual(res['flags'], 0)
+                results.append((res, fitter.get_gmix().get_full_pars()))
+
+            (res, pars), (pres, ppars) = results
+            self.assertEqual(pres['numiter'], res['numiter'])
+            self.assertTrue(np.allclose(ppars, pars, rtol=1.0e-8, atol=1.0e-10))
+        finally:
+            parallel.set_parallel(**conf)
+
+    def testCulled(self):
+        """
+        test the kernels that only visit pixels near each gaussian agree
+        with those that visit all pixels
+        """
+        from .fitting_nb import fill_fdiff, fill_fdiff_culled, FDIFF_MAX_CHI2
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise,mask=True)
+        obs=mdict['obs']
+
+        gm=gmix.GMixModel(mdict['pars'], 'exp')
+        gm.set_norms()
+
+        fdiff=np.zeros(obs.pixels.size)
+        cfdiff=np.zeros(obs.pixels.size)
+        fill_fdiff(gm.get_data(), obs.pixels, fdiff, 0)
+        fill_fdiff_culled(
+            gm.get_data(),
+            obs.pixels,
+            obs.pixel_index,
+            obs.jacobian._data,
+            cfdiff,
+            0,
+            FDIFF_MAX_CHI2,
+        )
+        self.assertTrue(np.allclose(fdiff, cfdiff))
+
+    def testGrid(self):
+        """
+        test the kernels that evaluate the model along image rows agree with
+        those that use the pixel coordinates
+        """
+        from .fitting_nb import get_loglike, fill_fdiff
+        from .render_nb import render
+        from .pixels import make_coords
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+        obs=mdict['obs']
+        self.assertTrue(obs.has_full_pixels())
+
+        gm=gmix.GMixModel(mdict['pars'], 'exp')
+        gm.set_norms()
+
+        dims=obs.image.shape
+        for fast_exp in [False, True]:
+            im=gm.make_image(dims, jacobian=obs.jacobian, fast_exp=fast_exp)
+
+            cim=np.zeros(dims)
+            render(
+                gm.get_data(),
+                make_coords(dims, obs.jacobian),
+                cim.ravel(),
+                fast_exp,
+            )
+            self.assertTrue(np.allclose(im, cim))
+
+        loglike=gm.get_loglike(obs, parallel=False)
+        cloglike=get_loglike(gm.get_data(), obs.pixels)[0]
+        self.assertTrue(np.allclose(loglike, cloglike))
+
+        fdiff=np.zeros(obs.pixels.size)
+        cfdiff=np.zeros(obs.pixels.size)
+        gm.fill_fdiff(obs, fdiff, parallel=False)
+        fill_fdiff(gm.get_data(), obs.pixels, cfdiff, 0)
+        self.assertTrue(np.allclose(fdiff, cfdiff))
+
+    def testSoA(self):
+        """
+        test the kernels using the structure-of-arrays pixel layout agree
+        with those using the array of pixel structs
+        """
+        from .fitting_nb import get_loglike, get_loglike_soa
+        from .admom_nb import admom, admom_soa
+        from .admom import Admom
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise,mask=True)
+        obs=mdict['obs']
+
+        gm=gmix.GMixModel(mdict['pars'], 'exp')
+
+        pixels_soa=obs.pixels_soa
+        self.assertEqual(pixels_soa.shape, (4, obs.pixels.size))
+
+        res=get_loglike(gm.get_data(), obs.pixels)
+        res_soa=get_loglike_soa(gm.get_data(), pixels_soa)
+        self.assertTrue(np.allclose(res, res_soa))
+
+        am=Admom(obs)
+        guess=am._get_guess(4.0)
+        ares=am._get_am_result()
+        ares_soa=am._get_am_result()
+        admom(am.conf, guess._data.copy(), obs.pixels, ares)
+        admom_soa(am.conf, guess._data.copy(), pixels_soa, ares_soa)
+
+        self.assertEqual(ares['flags'][0], ares_soa['flags'][0])
+        self.assertTrue(np.allclose(ares['sums'], ares_soa['sums']))
+
+    def testAdmomBatch(self):
+        """
+        test running adaptive moments for many objects in one call
+        """
+        from .admom import Admom, run_admom_obs_batch, get_result
+
+        noise=0.001
+        obs_list=[]
+        guesses=[]
+        for i in range(4):
+            mdict=self.get_obs_data('exp',noise)
+            obs_list.append(mdict['obs'])
+
+            am=Admom(mdict['obs'], rng=self.rng)
+            guesses.append(am._get_guess(4.0))
+
+        result=run_admom_obs_batch(obs_list, guesses, ntry=2, rng=self.rng)
+        self.assertEqual(result.size, len(obs_list))
+
+        for i, obs in enumerate(obs_list):
+            am=Admom(obs)
+            am.go(guesses[i])
+            res=am.get_result()
+
+            bres=get_result(result[i:i+1])
+            self.assertEqual(bres['flags'], res['flags'])
+            self.assertEqual(bres['ntry'], 1)
+            self.assertTrue(np.allclose(bres['pars'], res['pars']))
+
+        result=run_admom_obs_batch(obs_list, 4.0, ntry=3, rng=self.rng)
+        self.assertTrue(np.all(result['flags'] == 0))
+
+    def testWeightedMomentsBatch(self):
+        """
+        test fixed weight moments for many objects agree with the
+        sums for each observation
+        """
+        from .observation import ObsList, MultiBandObsList
+
+        noise=0.001
+        maxrad=10.0
+        wt=gmix.GMixModel([0.0, 0.0, 0.0, 0.0, 4.0, 1.0], 'gauss')
+
+        obs_lists=[
+            self.get_obs_data('exp',noise)['obs'],
+            ObsList(),
+            MultiBandObsList(),
+        ]
+        for i in range(2):
+            obs_lists[1].append(self.get_obs_data('exp',noise)['obs'])
+
+            olist=ObsList()
+            olist.append(self.get_obs_data('exp',noise)['obs'])
+            obs_lists[2].append(olist)
+
+        res=gmix.get_weighted_moments_batch(obs_lists, wt, maxrad)
+        self.assertEqual(res.size, len(obs_lists))
+        self.assertTrue(np.all(res['flags'] == 0))
+        self.assertTrue(np.all(res['nimage'] == [1, 2, 2]))
+
+        flat_lists=[
+            [obs_lists[0]],
+            list(obs_lists[1]),
+            [olist[0] for olist in obs_lists[2]],
+        ]
+        for i, flat_list in enumerate(flat_lists):
+            tres=None
+            for obs in flat_list:
+                tres=wt.get_weighted_sums(obs, maxrad, res=tres)
+            stats=gmix.get_weighted_moments_stats(tres)
+
+            self.assertEqual(res['npix'][i], tres['npix'])
+            self.assertTrue(np.allclose(res['sums'][i], tres['sums']))
+            self.assertTrue(np.allclose(res['sums_cov'][i], tres['sums_cov']))
+            self.assertTrue(np.allclose(res['T'][i], stats['T']))
+            self.assertTrue(np.allclose(res['e'][i], stats['e']))
+            self.assertTrue(np.allclose(res['s2n'][i], stats['s2n']))
+
+    def testLazyPixels(self):
+        """
+        test the pixels are created on demand and the partial refreshes
+        agree with rebuilding from scratch
+        """
+        from .pixels import make_pixels, make_pixel_index
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise,mask=True)
+        obs=mdict['obs']
+        self.assertTrue(obs._pixels is None)
+
+        npix=obs.pixels.size
+        self.assertEqual(npix, (obs.weight > 0).sum())
+
+        def check(obs):
+            pixels=make_pixels(obs.image, obs.weight, obs.jacobian)
+            for name in ['u','v','val','ierr']:
+                self.assertTrue(np.allclose(obs.pixels[name], pixels[name]))
+            self.assertTrue(
+                np.all(obs.pixel_index == make_pixel_index(obs.weight))
+            )
+
+        pixels=obs.pixels
+        obs.image = obs.image + self.rng.normal(size=obs.image.shape)
+        check(obs)
+        # only the values were refreshed, in place
+        self.assertTrue(obs.pixels is pixels)
+
+        jac=UnitJacobian(row=3.5, col=4.25)
+        obs.jacobian = jac
+        check(obs)
+        self.assertTrue(obs.pixels is pixels)
+
+        weight=obs.weight.copy()
+        weight[weight.shape[0]//2, :] = 0.0
+        obs.weight = weight
+        check(obs)
+        self.assertTrue(obs.pixels.size < npix)
+
+        with self.assertRaises(GMixFatalError):
+            obs.weight = np.zeros(obs.image.shape)
+
+    def testExpMethods(self):
+        """
+        test the accuracy of the exponential methods over [-300,0], and
+        that fits using them agree
+        """
+        from .fastexp import get_exp_method, get_exp_method_max_relerr
+        from .fastexp_nb import fill_exp
+        from .fitting import LMSimple
+
+        x=np.linspace(-300.0, 0.0, 300001)
+        expected=np.exp(x)
+        vals=np.zeros(x.size)
+
+        for method in ['table','poly','exact']:
+            fill_exp(x, vals, get_exp_method(method))
+            relerr=np.abs(vals/expected-1.0).max()
+            self.assertTrue(relerr <= get_exp_method_max_relerr(method))
+
+        with self.assertRaises(ValueError):
+            get_exp_method('blah')
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise,mask=True)
+        obs=mdict['obs']
+
+        gm=gmix.GMixModel(mdict['pars'], 'exp')
+        loglike=gm.get_loglike(obs, exp_method='exact')
+        ploglike=gm.get_loglike(obs, exp_method='poly')
+        self.assertTrue(np.allclose(loglike, ploglike))
+
+        pars={}
+        for method in ['table','poly','exact']:
+            fitter=LMSimple(obs, 'exp', exp_method=method)
+            fitter.go(mdict['pars'])
+            res=fitter.get_result()
+            self.assertEqual(res['flags'], 0)
+            pars[method]=res['pars']
+
+        self.assertTrue(np.allclose(pars['poly'], pars['exact']))
+
+    def testLMBounds(self):
+        """
+        test fits with bounds, which go through the parameter transforms in
+        leastsqbound, and that each fdiff is a new array
+        """
+        from .fitting import LMSimple
+        from .priors import CenPrior, GPriorBA, Normal
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+        obs=mdict['obs']
+        obs.set_psf(mdict['psf_obs'])
+        pars=mdict['pars']
+
+        boot=bootstrap.Bootstrapper(obs)
+        boot.fit_psfs('gauss', 4.0)
+
+        prior=joint_prior.PriorSimpleSep(
+            CenPrior(0.0, 0.0, 1.0, 1.0),
+            GPriorBA(0.3),
+            Normal(self.T, self.T, bounds=[-0.1*self.T, 100.0*self.T]),
+            Normal(self.counts, self.counts, bounds=[-10.0, 1.0e4]),
+        )
+
+        res={}
+        for use_jacob in [True, False]:
+            fitter=LMSimple(obs, 'exp', prior=prior, use_jacob=use_jacob)
+            fitter.go(pars)
+            res[use_jacob]=fitter.get_result()
+            self.assertEqual(res[use_jacob]['flags'], 0)
+
+        pdiff=np.abs(res[True]['pars']-res[False]['pars'])
+        self.assertTrue(np.all(pdiff < 0.25*res[False]['pars_err']))
+
+        fdiff1=fitter._calc_fdiff(pars)
+        fdiff1_copy=fdiff1.copy()
+        fdiff2=fitter._calc_fdiff(pars*1.01)
+        self.assertTrue(fdiff1 is not fdiff2)
+        self.assertTrue(np.all(fdiff1 == fdiff1_copy))
+        self.assertTrue(fitter._calc_fdiff(pars) is not fdiff1)
+
     def testWeight(self):
 
         rng=self.rng
@@ -183,6 +628,148 @@ class TestFitting(unittest.TestCase):
             print('s2n:',res['s2n_w'])
 
 
+    def testGMixInto(self):
+        """
+        test filling existing mixtures with copy_into and convolve_into,
+        and pickling the slotted mixtures
+        """
+        import pickle
+
+        pars=np.array([0.1, -0.05, 0.2, 0.1, self.T, self.counts])
+        psf=gmix.GMixModel([0.0, 0.0, 0.0, 0.05, self.Tpsf, 1.0], 'turb')
+
+        gm0=gmix.GMixModel(pars, 'exp')
+        gm=gm0.convolve(psf)
+
+        other=gmix.GMixModel(pars*1.1, 'exp')
+        other.convolve_into(psf, gm)
+        self.assertTrue(np.all(
+            gm.get_full_pars() == other.convolve(psf).get_full_pars()
+        ))
+
+        gm_copy=gmix.GMix(ngauss=len(gm))
+        gm.copy_into(gm_copy)
+        self.assertTrue(np.all(gm.get_full_pars() == gm_copy.get_full_pars()))
+
+        with self.assertRaises(GMixFatalError):
+            gm0.convolve_into(psf, gm0)
+
+        with self.assertRaises(AttributeError):
+            gm0.blah=1
+
+        for tgm in [gm0, gm, gmix.GMixCM(0.5, 1.0, pars)]:
+            new=pickle.loads(pickle.dumps(tgm))
+            self.assertTrue(np.all(
+                new.get_full_pars() == tgm.get_full_pars()
+            ))
+            self.assertEqual(new._model_name, tgm._model_name)
+
+    def testGMixModelBatch(self):
+        """
+        test filling and convolving mixtures for sets of parameters
+        """
+        nobj=5
+        names=['p','row','col','irr','irc','icc']
+
+        psf_pars=[0.0, 0.0, 0.0, 0.05, self.Tpsf, 1.0]
+        psf=gmix.GMixModel(psf_pars, 'turb')
+        psfs=[gmix.GMixModel(psf_pars[:4]+[self.Tpsf*(1+0.1*i), 1.0], 'turb')
+              for i in range(nobj)]
+
+        for model in ['exp','dev','turb','gauss','cm','bdf','coellip']:
+            if model=='bdf':
+                npars=7
+            elif model=='coellip':
+                npars=gmix.get_coellip_npars(2)
+            else:
+                npars=6
+
+            pars=np.zeros( (nobj, npars) )
+            pars[:,0:2] = self.rng.uniform(low=-0.5, high=0.5, size=(nobj,2))
+            pars[:,2:4] = self.rng.uniform(low=-0.2, high=0.2, size=(nobj,2))
+            if model=='coellip':
+                pars[:,4] = self.T
+                pars[:,5] = self.T*2
+                pars[:,6] = self.counts*0.6
+                pars[:,7] = self.counts*0.4
+            else:
+                pars[:,4] = self.T*self.rng.uniform(low=0.9, high=1.1, size=nobj)
+                pars[:,-1] = self.counts
+            if model=='bdf':
+                pars[:,5] = 0.5
+
+            fracdev=self.rng.uniform(size=nobj)
+            kw={}
+            if model=='cm':
+                kw['fracdev']=fracdev
+
+            single=gmix.make_gmix_model_batch(pars, model, **kw)
+            shared=gmix.make_gmix_model_batch(pars, model, psf=psf, **kw)
+            each=gmix.make_gmix_model_batch(pars, model, psf=psfs, **kw)
+
+            for i in range(nobj):
+                if model=='cm':
+                    gm=gmix.GMixCM(fracdev[i], 1.0, pars[i])
+                else:
+                    gm=gmix.make_gmix_model(pars[i], model)
+
+                for batch, egm in [(single, gm),
+                                   (shared, gm.convolve(psf)),
+                                   (each, gm.convolve(psfs[i]))]:
+                    edata=egm.get_data()
+                    for n in names:
+                        self.assertTrue(np.allclose(batch[n][i], edata[n]))
+
+        with self.assertRaises(GMixFatalError):
+            gmix.make_gmix_model_batch(np.zeros( (nobj, 5) ), 'exp')
+
+    def testMakeImageBatch(self):
+        """
+        test rendering a set of mixtures into a stack of images
+        """
+        nobj=4
+        dims=[25, 25]
+
+        pars=np.zeros( (nobj, 6) )
+        pars[:,0:2] = self.rng.uniform(low=-0.5, high=0.5, size=(nobj,2))
+        pars[:,2:4] = self.rng.uniform(low=-0.2, high=0.2, size=(nobj,2))
+        pars[:,4] = self.T
+        pars[:,5] = self.counts
+
+        psf=gmix.GMixModel([0.0, 0.0, 0.0, 0.05, self.Tpsf, 1.0], 'turb')
+        gmdata=gmix.make_gmix_model_batch(pars, 'exp', psf=psf)
+        gms=[gmix.GMixModel(p, 'exp').convolve(psf) for p in pars]
+
+        jacobs=[
+            DiagonalJacobian(row=12.0+0.1*i, col=12.0-0.1*i, scale=0.27)
+            for i in range(nobj)
+        ]
+
+        for jacobian in [None, jacobs[0], jacobs]:
+            for fast_exp in [False, True]:
+                images=gmix.make_image_batch(
+                    gmdata, dims, jacobian=jacobian, fast_exp=fast_exp,
+                )
+                limages=gmix.make_image_batch(
+                    gms, dims, jacobian=jacobian, fast_exp=fast_exp,
+                )
+                self.assertEqual(images.shape, (nobj, dims[0], dims[1]))
+
+                for i in range(nobj):
+                    if isinstance(jacobian, list):
+                        jac=jacobian[i]
+                    else:
+                        jac=jacobian
+
+                    im=gms[i].make_image(
+                        dims, jacobian=jac, fast_exp=fast_exp, parallel=False,
+                    )
+                    self.assertTrue(np.allclose(images[i], im))
+                    self.assertTrue(np.allclose(limages[i], im))
+
+        with self.assertRaises(ValueError):
+            gmix.make_image_batch(gmdata, dims, jacobian=jacobs[:2])
+
     def testEM(self):
 
         print('\n')
@@ -211,6 +798,153 @@ class TestFitting(unittest.TestCase):
                 gm=runner.fitter.get_gmix()
                 print(gm)
 
+    def testEMMulti(self):
+        """
+        test EM with several starts in one call, and for a stack of images
+        """
+        dims=[25, 25]
+        jacob=DiagonalJacobian(row=12.0, col=12.0, scale=0.263)
+
+        images=[]
+        for i in range(3):
+            Tpsf=self.Tpsf*(1.0 + 0.1*i)
+            gm=gmix.GMixModel([0.0, 0.0, 0.01, -0.02, Tpsf, 1.0], 'turb')
+            images.append( gm.make_image(dims, jacobian=jacob) )
+        images=np.array(images)
+
+        im, sky = em.prep_image(images[0])
+        obs=Observation(im, jacobian=jacob)
+
+        runner=bootstrap.EMRunner(obs, self.Tpsf, 2, {}, rng=self.rng)
+        guesses=[runner.get_guess() for i in range(3)]
+
+        fitter=em.GMixEM(obs)
+        fitter.go(guesses[0], sky, maxiter=500, tol=1.0e-6)
+        T=fitter.get_gmix().get_T()
+
+        fitter.go_multi(guesses[0:1], sky, maxiter=500, tol=1.0e-6)
+        res=fitter.get_result()
+        self.assertEqual(res['flags'], 0)
+        self.assertTrue(np.allclose(fitter.get_gmix().get_T(), T, rtol=1.0e-5))
+
+        fitter.go_multi(guesses, sky, maxiter=500, tol=1.0e-6)
+        res=fitter.get_result()
+        self.assertEqual(res['flags'], 0)
+        self.assertEqual(res['nstart'], 3)
+        self.assertTrue(np.allclose(fitter.get_gmix().get_T(), T, rtol=1.0e-3))
+
+        em_pars={'maxiter':500, 'tol':1.0e-6, 'multistart':True}
+        runner=bootstrap.EMRunner(obs, self.Tpsf, 2, em_pars, rng=self.rng)
+        runner.go(ntry=4)
+        res=runner.fitter.get_result()
+        self.assertEqual(res['flags'], 0)
+        self.assertEqual(res['ntry'], 4)
+
+        batch_guesses=[guesses]*images.shape[0]
+        bfitter=em.fit_em_batch(
+            images, batch_guesses, jacobian=jacob, maxiter=500, tol=1.0e-6,
+        )
+        gm_list=bfitter.get_gmix_list()
+        res_list=bfitter.get_result_list()
+        for i in range(images.shape[0]):
+            self.assertEqual(res_list[i]['flags'], 0)
+
+            im, sky = em.prep_image(images[i])
+            fitter=em.GMixEM(Observation(im, jacobian=jacob))
+            fitter.go_multi(guesses, sky, maxiter=500, tol=1.0e-6)
+            self.assertTrue(np.allclose(
+                gm_list[i].get_full_pars(),
+                fitter.get_gmix().get_full_pars(),
+            ))
+
+    def testEMAccelerate(self):
+        """
+        test EM with SQUAREM acceleration, which should take fewer passes
+        over the pixels than plain EM for a typical psf
+        """
+        dims=[25, 25]
+        jacob=DiagonalJacobian(row=12.0, col=12.0, scale=0.263)
+
+        Tpsf=0.5
+        gm=gmix.GMixModel([0.0, 0.0, 0.01, -0.02, Tpsf, 1.0], 'turb')
+        im, sky = em.prep_image(gm.make_image(dims, jacobian=jacob))
+        obs=Observation(im, jacobian=jacob)
+
+        runner=bootstrap.EMRunner(obs, Tpsf, 3, {}, rng=self.rng)
+        guesses=[runner.get_guess() for i in range(10)]
+
+        fitter=em.GMixEM(obs)
+        npass={False: 0, True: 0}
+        for guess in guesses:
+            Tvals=[]
+            for accelerate in [False, True]:
+                fitter.go(guess, sky, maxiter=5000, tol=1.0e-6,
+                          accelerate=accelerate)
+                res=fitter.get_result()
+                self.assertEqual(res['flags'], 0)
+                self.assertTrue(res['npass'] >= res['numiter'])
+                npass[accelerate] += res['npass']
+                Tvals.append(fitter.get_gmix().get_T())
+
+            self.assertTrue(np.allclose(Tvals[0], Tvals[1], rtol=1.0e-3))
+
+        self.assertTrue(npass[True] < npass[False])
+
+    def testEMFixedPSF(self):
+        """
+        test EM deconvolving a fixed psf, and using it for guesses
+        """
+        mdict=self.get_obs_data('gauss', 1.0e-6)
+        obs=mdict['obs']
+        obs.set_psf(mdict['psf_obs'])
+
+        boot=bootstrap.Bootstrapper(obs, rng=self.rng)
+        boot.fit_psfs('gauss', 4.0)
+
+        guess=gmix.GMixModel([0.1, -0.1, 0.0, 0.0, self.T*1.2, 1.0], 'gauss')
+        fitter=em.fit_em_fixpsf(obs, guess, maxiter=2000, tol=1.0e-6)
+
+        res=fitter.get_result()
+        self.assertEqual(res['flags'], 0)
+
+        g1, g2, T = fitter.get_gmix().get_g1g2T()
+        self.assertTrue(abs(T/self.T-1) < 0.02)
+        self.assertTrue(abs(g1-self.g1) < 0.01)
+        self.assertTrue(abs(g2-self.g2) < 0.01)
+
+        conv=fitter.get_convolved_gmix()
+        self.assertEqual(len(conv), len(obs.get_psf_gmix()))
+
+        # the same start, alone and with a poor second start, gives the
+        # same mixture
+        pars=fitter.get_gmix().get_full_pars()
+        loglike=res['loglike']
+
+        im, sky = em.prep_image(obs.image)
+        mfitter=em.GMixEMFixedPSF(Observation(im, jacobian=obs.jacobian),
+                                  psf=obs.get_psf_gmix())
+        poor=gmix.GMixModel([0.5, 0.5, 0.0, 0.0, self.T*4.0, 1.0], 'gauss')
+        for guesses in [[guess], [poor, guess]]:
+            mfitter.go_multi(guesses, sky, maxiter=2000, tol=1.0e-6)
+            mres=mfitter.get_result()
+            self.assertEqual(mres['flags'], 0)
+            self.assertEqual(mres['nstart'], len(guesses))
+            self.assertTrue(mres['loglike'] >= loglike-1.0e-8)
+            self.assertTrue(np.allclose(
+                mfitter.get_gmix().get_full_pars(), pars, rtol=1.0e-4,
+            ))
+
+        for key in ['parallel','accelerate']:
+            with self.assertRaises(ValueError):
+                mfitter.go(guess, sky, **{key:True})
+
+        max_pars={'method':'lm',
+                  'lm_pars':{'maxfev':4000}}
+        guesser=boot.get_em_guesser()
+        boot.fit_max('gauss', max_pars, guesser=guesser)
+        res=boot.get_max_fitter().get_result()
+        self.assertEqual(res['flags'], 0)
+
     def testMetacalGetAll(self):
         """
         test getting metacal sheared images
@@ -241,3 +975,539 @@ class TestFitting(unittest.TestCase):
             for t in metacal.METACAL_MINIMAL_TYPES:
                 assert t in odict,'missing metacal type for psf="%s": %s' % (psf,t)
 
+
+    def testPSFFitCache(self):
+        """
+        test psf fits are reused from the cache, within and across
+        bootstrappers and from the disk store
+        """
+        import shutil
+        import tempfile
+        from .psfcache import PSFFitCache
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+        psf_obs=mdict['psf_obs']
+
+        cache_dir=tempfile.mkdtemp()
+        try:
+            cache=PSFFitCache(maxsize=1, cache_dir=cache_dir)
+
+            gmixes=[]
+            for i in range(2):
+                obs=mdict['obs'].copy()
+                obs.set_psf(psf_obs.copy())
+                boot=bootstrap.Bootstrapper(obs, psf_cache=cache)
+                boot.fit_psfs('gauss', 4.0)
+                gmixes.append(boot.mb_obs_list[0][0].psf.gmix)
+
+            self.assertEqual(cache.nmiss, 1)
+            self.assertEqual(cache.nhit, 1)
+            self.assertTrue(
+                np.all(gmixes[0].get_full_pars() == gmixes[1].get_full_pars())
+            )
+
+            # a different psf image evicts the first fit from memory, but it
+            # is still found on disk
+            key=cache.get_key(psf_obs, 'gauss', 4.0, 4, None)
+            other=psf_obs.copy()
+            other.image = other.image*1.1
+            boot=bootstrap.Bootstrapper(
+                mdict['obs'].copy(), psf_cache=cache,
+            )
+            boot.mb_obs_list[0][0].set_psf(other)
+            boot.fit_psfs('gauss', 4.0)
+            self.assertEqual(len(cache), 1)
+
+            new_cache=PSFFitCache(cache_dir=cache_dir)
+            self.assertTrue(new_cache.get(key) is not None)
+
+            # the em fitter returns its own gmix; renormalizing it after the
+            # put must not change the cached fit
+            im, sky = em.prep_image(psf_obs.image)
+            em_obs=Observation(im, jacobian=psf_obs.jacobian)
+            guess=gmix.GMixModel([0.0, 0.0, 0.0, 0.0, 4.0, 1.0], 'gauss')
+            fitter=em.GMixEM(em_obs)
+            fitter.go(guess, sky, maxiter=2000, tol=1.0e-6)
+            self.assertEqual(fitter.get_result()['flags'], 0)
+
+            em_cache=PSFFitCache()
+            em_key=em_cache.get_key(em_obs, 'em1', 4.0, 4, None)
+            em_cache.put(em_key, fitter)
+            pars=fitter.get_gmix().get_full_pars()
+
+            fitter.get_gmix().set_psum(123.0)
+            cached_pars=em_cache.get(em_key).get_gmix().get_full_pars()
+            self.assertTrue(np.all(cached_pars == pars))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def testMetacalPSFCache(self):
+        """
+        test that the target psfs are drawn once and shared by the gal_shear
+        types, and that the observations do not share the cached images
+        """
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+        obs=mdict['obs']
+        obs.set_psf(mdict['psf_obs'])
+
+        mc = metacal.Metacal(obs)
+        odict = mc.get_all()
+
+        # one dilated psf for all gal shears, one for each psf shear
+        self.assertEqual(len(mc._target_psf_cache), 5)
+
+        im1p = odict['1p'].psf.image
+        im1m = odict['1m'].psf.image
+        self.assertTrue(np.all(im1p == im1m))
+
+        im1p[:, :] = 0.0
+        self.assertTrue(np.any(odict['1m'].psf.image != 0.0))
+
+        sh = Shape(0.01, 0.0)
+        psf_image, psf_obj = mc.get_target_psf(sh, 'gal_shear')
+        self.assertTrue(np.all(psf_image.array == im1m))
+
+    def testMetacalFFT(self):
+        """
+        test the fft metacal against the galsim version
+        """
+        from .metacal_fft import MetacalFFT, get_fft_grid
+
+        noise=0.001
+        mdict=self.get_obs_data('exp',noise)
+        obs=mdict['obs']
+        obs.set_psf(mdict['psf_obs'])
+
+        # transforming and drawing with no changes gives back the image
+        for shape in [(25, 25), (24, 26)]:
+            grid = get_fft_grid(shape, 2)
+            im = self.rng.normal(size=shape)
+            self.assertTrue(np.allclose(grid.draw(grid.get_kimage(im)), im))
+
+        odict = metacal.Metacal(obs).get_all()
+
+        for k_interpolant in ['linear', 'cubic']:
+            fft_odict = MetacalFFT(
+                obs,
+                k_interpolant=k_interpolant,
+            ).get_all()
+
+            for t in metacal.METACAL_TYPES:
+                gobs = odict[t]
+                fobs = fft_odict[t]
+
+                for gim, fim in [(gobs.image, fobs.image),
+                                 (gobs.psf.image, fobs.psf.image)]:
+                    self.assertEqual(gim.shape, fim.shape)
+                    maxdiff = np.abs(gim - fim).max()
+                    self.assertTrue(
+                        maxdiff < 0.01*np.abs(gim).max(),
+                        'type %s: max diff %g' % (t, maxdiff),
+                    )
+
+        fft_odict = metacal.get_all_metacal(obs, backend='fft')
+        for t in metacal.METACAL_TYPES:
+            self.assertTrue(t in fft_odict)
+
+    def testMetacalFFTBatch(self):
+        """
+        test the batched fft metacal against the single object version
+        """
+        from .metacal_fft import MetacalFFT
+
+        nstamp=3
+        obslist=[]
+        for i in range(nstamp):
+            mdict=self.get_obs_data('exp',0.001)
+            obs=mdict['obs']
+            obs.set_psf(mdict['psf_obs'])
+            obslist.append(obs)
+
+        images=np.array([obs.image for obs in obslist])
+        weights=np.array([obs.weight for obs in obslist])
+        psf_images=np.array([obs.psf.image for obs in obslist])
+        jacobians=[obs.jacobian for obs in obslist]
+        psf_jacobians=[obs.psf.jacobian for obs in obslist]
+
+        odict = metacal.get_all_metacal_batch(
+            images,
+            weights,
+            psf_images,
+            jacobians,
+            psf_jacobians=psf_jacobians,
+            fixnoise=False,
+        )
+
+        for i, obs in enumerate(obslist):
+            sdict = MetacalFFT(obs).get_all()
+            for t in metacal.METACAL_TYPES:
+                bobs = odict[t][i]
+                sobs = sdict[t]
+                self.assertTrue(np.allclose(bobs.image, sobs.image))
+                self.assertTrue(np.allclose(bobs.psf.image, sobs.psf.image))
+
+        self.assertTrue(hasattr(odict['noshear'][0], 'psf_nopix'))
+
+        odict = metacal.get_all_metacal_batch(
+            images,
+            weights,
+            psf_images,
+            jacobians,
+            psf_jacobians=psf_jacobians,
+            types=['noshear', '1p', '1m'],
+            rng=self.rng,
+        )
+        self.assertEqual(sorted(odict.keys()), ['1m', '1p', 'noshear'])
+        for t in odict:
+            self.assertEqual(len(odict[t]), nstamp)
+            for i, obs in enumerate(odict[t]):
+                self.assertTrue(np.allclose(obs.weight, 0.5*weights[i]))
+
+        # 4 byte floats, as read from MEDS files, and lists of stamps
+        odict = metacal.get_all_metacal_batch(
+            images.astype('f4'),
+            weights.astype('f4'),
+            list(psf_images.astype('f4')),
+            jacobians,
+            psf_jacobians=psf_jacobians,
+            fixnoise=False,
+        )
+        for i, obs in enumerate(obslist):
+            bobs = odict['1p'][i]
+            sobs = MetacalFFT(obs).get_all(types=['1p'])['1p']
+            self.assertTrue(np.allclose(bobs.image, sobs.image,
+                                        rtol=1.0e-4, atol=1.0e-6))
+
+    def testRunnerChunks(self):
+        """
+        test the runner gives the same results for any chunk size, and
+        leaves the state of the global random number generator alone
+        """
+        import copy
+        from . import runner
+        from . import priors
+        from .observation import ObsList, MultiBandObsList
+
+        class StubMBMEDS(object):
+            """
+            stands in for MultiBandNGMixMEDS, with one band
+            """
+            def __init__(self, mbobs_list):
+                self.mbobs_list = mbobs_list
+                self.mlist = [{'id': np.arange(len(mbobs_list)) + 100}]
+                self.nband = 1
+
+            def get_mbobs(self, iobj, weight_type='weight'):
+                return copy.deepcopy(self.mbobs_list[iobj])
+
+        noise=0.001
+        nobj=4
+        mbobs_list=[]
+        for i in range(nobj):
+            mdict=self.get_obs_data('gauss',noise)
+            obs=mdict['obs']
+            obs.set_psf(mdict['psf_obs'])
+
+            obslist=ObsList()
+            obslist.append(obs)
+            mbobs=MultiBandObsList()
+            mbobs.append(obslist)
+            mbobs_list.append(mbobs)
+
+        config=runner._get_config({
+            'psf_model':'gauss',
+            'gal_model':'gauss',
+            'max_pars':{'method':'lm', 'lm_pars':{'maxfev':2000}},
+            'psf_Tguess':4.0,
+        })
+
+        seed=31415
+        runner._worker_state.update({
+            'mbmeds':StubMBMEDS(mbobs_list),
+            'config':config,
+            'psf_cache':None,
+        })
+
+        try:
+            state=np.random.get_state()
+
+            outputs=[]
+            for chunksize in [nobj, 3, 1]:
+                chunks=[
+                    runner._process_chunk(start, min(start+chunksize, nobj), seed)
+                    for start in range(0, nobj, chunksize)
+                ]
+                outputs.append(np.hstack(chunks))
+
+            new_state=np.random.get_state()
+            self.assertTrue(np.all(state[1] == new_state[1]))
+            self.assertEqual(state[2], new_state[2])
+        finally:
+            runner._worker_state.clear()
+
+        output=outputs[0]
+        self.assertTrue(np.all(output['index'] == np.arange(nobj)))
+        self.assertTrue(np.all(output['id'] == np.arange(nobj) + 100))
+        self.assertTrue(np.all(output['flags'] == 0))
+
+        for other in outputs[1:]:
+            for name in output.dtype.names:
+                self.assertTrue(np.all(output[name] == other[name]), name)
+
+        # the generators in the caller's prior are not reseeded
+        prior=joint_prior.PriorSimpleSep(
+            priors.CenPrior(0.0, 0.0, 0.1, 0.1, rng=self.rng),
+            priors.GPriorBA(0.3, rng=self.rng),
+            priors.FlatPrior(-10.0, 1.0e4, rng=self.rng),
+            priors.FlatPrior(-1.0, 1.0e9, rng=self.rng),
+        )
+        prior_state=self.rng.get_state()
+
+        pconfig=dict(config, prior=prior)
+        pconfig=runner._get_config(pconfig)
+        runner._seed_rngs(pconfig['prior'], np.random.RandomState(seed))
+
+        self.assertIsNot(pconfig['prior'], prior)
+        new_prior_state=prior.g_prior.rng.get_state()
+        self.assertTrue(np.all(prior_state[1] == new_prior_state[1]))
+        self.assertEqual(prior_state[2], new_prior_state[2])
+
+    def _write_meds(self, fname, ncutout, box_size, band=0):
+        """
+        write a small MEDS file with image, weight and bmask cutouts
+        """
+        import fitsio
+
+        rng=self.rng
+
+        nobj=len(ncutout)
+        maxcut=max(max(ncutout), 1)
+
+        cat=np.zeros(nobj, dtype=[
+            ('id','i8'),
+            ('number','i4'),
+            ('ncutout','i4'),
+            ('box_size','i4'),
+            ('file_id','i4',maxcut),
+            ('start_row','i8',maxcut),
+            ('orig_row','f8',maxcut),
+            ('orig_col','f8',maxcut),
+            ('orig_start_row','i4',maxcut),
+            ('orig_start_col','i4',maxcut),
+            ('cutout_row','f8',maxcut),
+            ('cutout_col','f8',maxcut),
+            ('dudrow','f8',maxcut),
+            ('dudcol','f8',maxcut),
+            ('dvdrow','f8',maxcut),
+            ('dvdcol','f8',maxcut),
+        ])
+
+        npix=0
+        for i in range(nobj):
+            cat['id'][i]=1000+i
+            cat['number'][i]=i+1
+            cat['ncutout'][i]=ncutout[i]
+            cat['box_size'][i]=box_size[i]
+            for icut in range(ncutout[i]):
+                cen=(box_size[i]-1)/2.0
+                cat['file_id'][i,icut]=icut
+                cat['start_row'][i,icut]=npix
+                cat['orig_row'][i,icut]=rng.uniform(low=100, high=200)
+                cat['orig_col'][i,icut]=rng.uniform(low=100, high=200)
+                cat['cutout_row'][i,icut]=cen + rng.uniform(low=-0.5, high=0.5)
+                cat['cutout_col'][i,icut]=cen + rng.uniform(low=-0.5, high=0.5)
+                cat['dudrow'][i,icut]=0.0
+                cat['dudcol'][i,icut]=0.263
+                cat['dvdrow'][i,icut]=0.263
+                cat['dvdcol'][i,icut]=0.0
+                npix += box_size[i]**2
+
+        image_info=np.zeros(maxcut, dtype=[('image_path','S20')])
+        for i in range(maxcut):
+            image_info['image_path'][i]='/data/image%d-%d.fits' % (band, i)
+
+        images=rng.normal(size=npix).astype('f4')
+        weights=rng.uniform(low=0.5, high=1.5, size=npix).astype('f4')
+        bmasks=rng.randint(0, 4, size=npix).astype('i4')
+
+        with fitsio.FITS(fname, 'rw', clobber=True) as fits:
+            fits.write(cat, extname='object_data')
+            fits.write(image_info, extname='image_info')
+            fits.write(images, extname='image_cutouts')
+            fits.write(weights, extname='weight_cutouts')
+            fits.write(bmasks, extname='bmask_cutouts')
+
+    def _check_same_obslists(self, obslist1, obslist2):
+        """
+        check the observations in the lists have the same data
+        """
+        self.assertEqual(len(obslist1), len(obslist2))
+        for obs1, obs2 in zip(obslist1, obslist2):
+            self.assertTrue(np.all(obs1.image == obs2.image))
+            self.assertTrue(np.all(obs1.weight == obs2.weight))
+            self.assertTrue(np.all(obs1.bmask == obs2.bmask))
+            self.assertFalse(obs1.has_noise() or obs2.has_noise())
+            self.assertTrue(np.all(obs1.jacobian._data == obs2.jacobian._data))
+            self.assertEqual(sorted(obs1.meta.keys()), sorted(obs2.meta.keys()))
+            for key in obs1.meta:
+                self.assertEqual(obs1.meta[key], obs2.meta[key])
+
+    def testMEDSReaders(self):
+        """
+        test memory mapped reads give the same observations as reading
+        each cutout
+        """
+        import os
+        import tempfile
+        import shutil
+        try:
+            from .medsreaders import NGMixMEDS
+        except ImportError:
+            self.skipTest("the optional meds package is not installed")
+
+        ncutout=[1, 2, 0, 2, 1]
+        box_size=[16, 20, 16, 24, 16]
+
+        tmpdir=tempfile.mkdtemp()
+        try:
+            fname=os.path.join(tmpdir, 'test-meds.fits')
+            self._write_meds(fname, ncutout, box_size)
+
+            m=NGMixMEDS(fname)
+            mm=NGMixMEDS(fname, mmap=True)
+            try:
+                self.assertTrue(mm._get_cutout_map('image') is not None)
+                self.assertTrue(mm._has_hdu('bmask'))
+                self.assertFalse(mm._has_hdu('noise'))
+                self.assertTrue(mm._get_cutout_map('noise') is None)
+
+                obslists=[m.get_obslist(i) for i in range(m.size)]
+                for i, obslist in enumerate(obslists):
+                    self.assertEqual(len(obslist), ncutout[i])
+                    for obs in obslist:
+                        self.assertEqual(obs.meta['id'], 1000+i)
+                        self.assertEqual(obs.image.shape, (box_size[i],)*2)
+
+                    self._check_same_obslists(obslist, mm.get_obslist(i))
+
+                # the maps are copy on write, the file is not changed
+                obs=mm.get_obslist(1)[0]
+                obs.bmask[:, :] = 99
+                self.assertTrue(np.all(mm.get_obslist(1)[0].bmask == 99))
+                self.assertTrue(np.all(m.get_obslist(1)[0].bmask != 99))
+                self._check_same_obslists(
+                    obslists[1],
+                    NGMixMEDS(fname, mmap=True).get_obslist(1),
+                )
+            finally:
+                m.close()
+                mm.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testMEDSObsRange(self):
+        """
+        test bulk reads of a range of objects give the same observations
+        as reading each cutout, with and without memory mapping
+        """
+        import os
+        import tempfile
+        import shutil
+        try:
+            from .medsreaders import NGMixMEDS
+        except ImportError:
+            self.skipTest("the optional meds package is not installed")
+
+        ncutout=[1, 2, 0, 2, 1]
+        box_size=[16, 20, 16, 24, 16]
+
+        tmpdir=tempfile.mkdtemp()
+        try:
+            fname=os.path.join(tmpdir, 'test-meds.fits')
+            self._write_meds(fname, ncutout, box_size)
+
+            m=NGMixMEDS(fname)
+            mm=NGMixMEDS(fname, mmap=True)
+            try:
+                obslists=[m.get_obslist(i) for i in range(m.size)]
+
+                for reader in [m, mm]:
+                    for start, stop in [(0, m.size), (1, 4), (2, 3)]:
+                        range_obslists=reader.get_obs_range(start, stop)
+                        self.assertEqual(len(range_obslists), stop-start)
+                        for i, obslist in enumerate(range_obslists):
+                            self._check_same_obslists(
+                                obslists[start+i],
+                                obslist,
+                            )
+            finally:
+                m.close()
+                mm.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testMEDSIterMBObs(self):
+        """
+        test the prefetching iterator and bulk reads over bands give the
+        objects in order, with the same observations as get_mbobs
+        """
+        import os
+        import tempfile
+        import shutil
+        try:
+            from .medsreaders import NGMixMEDS, MultiBandNGMixMEDS
+        except ImportError:
+            self.skipTest("the optional meds package is not installed")
+
+        ncutout=[1, 2, 1, 2, 1, 1, 2]
+        box_size=[16, 20, 16, 24, 16, 20, 16]
+        nband=2
+
+        tmpdir=tempfile.mkdtemp()
+        try:
+            mlist=[]
+            for band in range(nband):
+                fname=os.path.join(tmpdir, 'test-meds-%d.fits' % band)
+                self._write_meds(fname, ncutout, box_size, band=band)
+                mlist.append(NGMixMEDS(fname, mmap=(band == 1)))
+
+            mbmeds=MultiBandNGMixMEDS(mlist)
+            try:
+                mbobs_list=[mbmeds.get_mbobs(i) for i in range(mbmeds.size)]
+
+                def check(indices, mbobs_iter):
+                    count=0
+                    for index, mbobs in zip(indices, mbobs_iter):
+                        self.assertEqual(len(mbobs), nband)
+                        for band in range(nband):
+                            obslist=mbobs[band]
+                            self.assertEqual(obslist[0].meta['index'], index)
+                            self._check_same_obslists(
+                                mbobs_list[index][band],
+                                obslist,
+                            )
+                        count += 1
+                    self.assertEqual(count, len(indices))
+
+                indices=list(range(mbmeds.size))
+                check(indices, mbmeds.iter_mbobs())
+
+                indices=[5, 0, 6, 3, 1, 2, 4]
+                for prefetch in [1, 2, 8]:
+                    check(
+                        indices,
+                        list(mbmeds.iter_mbobs(indices=indices,
+                                               prefetch=prefetch)),
+                    )
+
+                check([2, 3, 4], mbmeds.get_mbobs_range(2, 5))
+
+                with self.assertRaises(ValueError):
+                    next(mbmeds.iter_mbobs(prefetch=0))
+            finally:
+                for m in mlist:
+                    m.close()
+        finally:
+            shutil.rmtree(tmpdir)